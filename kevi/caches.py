@@ -0,0 +1,47 @@
+# coding=utf-8
+
+import collections
+import threading
+
+_NotFound = object()
+
+# A thread safe mapping that discards the least recently used item
+# once it holds capacity items
+class LRUCache(object):
+
+	def __init__(self, capacity):
+		if capacity <= 0:
+			raise ValueError('capacity must be greater than 0')
+
+		self._capacity = capacity
+		self._items = collections.OrderedDict()
+		self._lock = threading.Lock()
+
+	@property
+	def capacity(self):
+		return self._capacity
+
+	def get(self, key, default=None):
+		with self._lock:
+			value = self._items.get(key, _NotFound)
+			if value is _NotFound:
+				return default
+			self._items.move_to_end(key)
+			return value
+
+	def __setitem__(self, key, value):
+		with self._lock:
+			self._items[key] = value
+			self._items.move_to_end(key)
+			if len(self._items) > self._capacity:
+				self._items.popitem(last=False)
+
+	def __contains__(self, key):
+		return key in self._items
+
+	def __len__(self):
+		return len(self._items)
+
+	def clear(self):
+		with self._lock:
+			self._items.clear()
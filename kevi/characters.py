@@ -2,6 +2,6 @@
 
 import string
 
-ScannerCharactersToBeSkippedCharacterSet = set(('\t', '\n', '\v', '\f', '\r', ' ', '\0085', '\00a0'))
+ScannerCharactersToBeSkippedCharacterSet = set(('\t', '\n', '\v', '\f', '\r', ' ', '\u0085', '\u00a0'))
 IdentifierExpressionCharacterSet = set(c for c in '_$abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
 PropertyKeyCharacterSet = set(c for c in string.ascii_letters + string.digits + '_-')
@@ -0,0 +1,116 @@
+# coding=utf-8
+
+import collections.abc
+
+from . import kvc
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+def requireNumpy():
+	if numpy is None:
+		raise ImportError('Vectorized evaluation requires numpy')
+	return numpy
+
+def isArray(value):
+	return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+# Contexts stored as equally long columns, keyed by key path. A key path
+# without a column is read through the column of its longest prefix.
+class ColumnBatch(object):
+
+	def __init__(self, columns, count=None):
+		requireNumpy()
+
+		self._columns = {}
+		for keyPath, column in columns.items():
+			column = numpy.asarray(column)
+			if column.ndim != 1:
+				raise ValueError('Column for %s is not one dimensional' % keyPath)
+			if count is None:
+				count = len(column)
+			elif len(column) != count:
+				raise ValueError('Column for %s has %i rows, expected %i' % (keyPath, len(column), count))
+			self._columns[keyPath] = column
+
+		self._count = count or 0
+
+	@staticmethod
+	def batchWithColumns(columns):
+		return columns if isinstance(columns, ColumnBatch) else ColumnBatch(columns)
+
+	@property
+	def count(self):
+		return self._count
+
+	@property
+	def columns(self):
+		return self._columns
+
+	def valuesForKeyPath(self, keyPath):
+		column = self._columns.get(keyPath)
+		if column is not None:
+			return column
+
+		# Resolve the rest of the key path through the longest prefix column
+		separatorIndex = keyPath.rfind('.')
+		while separatorIndex != -1:
+			column = self._columns.get(keyPath[:separatorIndex])
+			if column is not None:
+				remainingKeyPath = keyPath[separatorIndex + 1:]
+				return self.objectArray([kvc.valueForKeyPath(value, remainingKeyPath) for value in column])
+			separatorIndex = keyPath.rfind('.', 0, separatorIndex)
+
+		return self.objectArray([None] * self._count)
+
+	def subset(self, rows):
+		return ColumnBatch(dict((keyPath, column[rows]) for keyPath, column in self._columns.items()), count=len(rows))
+
+	def rows(self):
+		# For expressions that have no vectorized form
+		return [_ColumnRow(self._columns, i) for i in range(self._count)]
+
+	def objectArray(self, values):
+		array = numpy.empty(len(values), dtype=object)
+		array[:] = values
+		return array
+
+	def broadcast(self, value, dtype=object):
+		if isArray(value):
+			return value
+		array = numpy.empty(self._count, dtype=dtype)
+		array.fill(value)
+		return array
+
+
+class _ColumnRow(collections.abc.Mapping):
+
+	def __init__(self, columns, index, prefix=''):
+		self._columns = columns
+		self._index = index
+		self._prefix = prefix
+
+	def __getitem__(self, key):
+		keyPath = self._prefix + key
+		column = self._columns.get(keyPath)
+		if column is not None:
+			value = column[self._index]
+			return value.item() if isinstance(value, numpy.generic) else value
+
+		keyPath += '.'
+		if any(k.startswith(keyPath) for k in self._columns):
+			return _ColumnRow(self._columns, self._index, keyPath)
+		raise KeyError(key)
+
+	def __iter__(self):
+		keys = set()
+		for keyPath in self._columns:
+			if keyPath.startswith(self._prefix):
+				keys.add(keyPath[len(self._prefix):].split('.', 1)[0])
+		return iter(keys)
+
+	def __len__(self):
+		return len(list(iter(self)))
@@ -1,36 +1,106 @@
 # coding=utf-8
 
-import collections
+import collections.abc
 
-from .rules import DefaultModel
+from . import rules
 
-class Context(collections.MutableMapping):
+class Context(collections.abc.MutableMapping):
 
 	def __init__(self, model=None, parentContext=None):
-		self._model = parentContext.model if parentContext is not None else model if model is not None else DefaultModel
+		# The default model is looked up when the context is created, so a
+		# context keeps using the same model after the default is replaced
+		self._model = parentContext.model if parentContext is not None else model if model is not None else rules.DefaultModel
 		self._parentContext = parentContext
 		self._localValues = dict()
+		self._conditionValues = dict()
+		self._inferredValues = dict()
+		self._dependentKeys = dict()   # key -> keys whose inferred value read it
+		self._inferenceStack = []      # keys read by each inference in progress
+		self._generation = None        # the model's generation when values were cached
 
 	@property
 	def model(self):
 		return self._model
 
+	@property
+	def conditionValues(self):
+		# Results of shared condition nodes, until the local values change
+		return self._conditionValues
+
+	def hasLocalValueForKey(self, key):
+		return key in self._localValues
+
 	def inferValueForKey(self, key):
 		return self.model.fireRuleForKeyPathInContext(key, self)
 
 	def inferAllPossibleValuesForKey(self, key):
 		return self.model.fireAllRulesForKeyPathInContext(key, self)
 
+	def invalidateInferredValues(self):
+		# Only needed when objects reachable from the local values are mutated
+		# in place
+		self._inferredValues.clear()
+		self._dependentKeys.clear()
+		self._conditionValues.clear()
+
+	def _inferAndCacheValueForKey(self, key):
+		# Values inferred before the model's rules changed are discarded
+		generation = self.model.generation
+		if generation != self._generation:
+			self.invalidateInferredValues()
+			self._generation = generation
+
+		readKeys = set()
+		self._inferenceStack.append(readKeys)
+		try:
+			rule = self.model.ruleForKeyPathInContext(key, self)
+			value = rule.fire(self) if rule is not None else None
+		finally:
+			self._inferenceStack.pop()
+
+		# Values that depend on anything other than key paths, such as now,
+		# may differ every time they are inferred, and so may the rule chosen
+		# by specifiers that do
+		if self.model.significantKeyPaths(key) is None or \
+		   (rule is not None and not rule.value._collectKeyPaths(set())):
+			return value
+
+		self._inferredValues[key] = value
+		for readKey in readKeys:
+			dependentKeys = self._dependentKeys.get(readKey)
+			if dependentKeys is None:
+				dependentKeys = self._dependentKeys[readKey] = set()
+			dependentKeys.add(key)
+
+		return value
+
+	def _invalidateValuesDependingOnKey(self, key):
+		self._conditionValues.clear()
+		self._inferredValues.pop(key, None)
+
+		# Inferred values that read an invalidated value are invalid too
+		keys = [key]
+		while keys:
+			for dependentKey in self._dependentKeys.pop(keys.pop(), ()):
+				self._inferredValues.pop(dependentKey, None)
+				keys.append(dependentKey)
+
 	def __getitem__(self, key):
+		if self._inferenceStack:
+			self._inferenceStack[-1].add(key)
 		if key in self._localValues:
 			return self._localValues[key]
-		return self.inferValueForKey(key)
+		if key in self._inferredValues and self._generation == self.model.generation:
+			return self._inferredValues[key]
+		return self._inferAndCacheValueForKey(key)
 
 	def __setitem__(self, key, value):
 		self._localValues[key] = value
+		self._invalidateValuesDependingOnKey(key)
 
 	def __delitem__(self, key):
 		del self._localValues[key]
+		self._invalidateValuesDependingOnKey(key)
 
 	def __iter__(self):
 		return iter(self._localValues)
@@ -16,24 +16,38 @@ _BuiltInFunctions = {
 	'first:'           : lambda params: params[0],
 	'last:'            : lambda params: params[-1],
 	'fromObject:index:': lambda object, index: object[index],
-	'add:to:'          : lambda n_m: n_m[0] + n_m[1],
-	'from:subtract:'   : lambda n_m1: n_m1[0] - n_m1[1],
-	'multiply:by:'     : lambda n_m2: n_m2[0] * n_m2[1],
-	'divide:by:'       : lambda n_m3: n_m3[0] / n_m3[1],
-	'sqrt:'            : lambda num4: math.sqrt(num4[0]),
-	'raise:toPower:'   : lambda n_m5: math.pow(n_m5[0], n_m5[1]),
-	'abs:'             : lambda num6: math.fabs(num6[0]),
-	'now'              : lambda _: datetime.datetime.now,
-	'ln:'              : lambda num7: math.log10(num7[0]),
-	'exp:'             : lambda num8: math.exp(num8[0]),
-	'ceiling:'         : lambda num9: math.ceil(num9[0]),
-	'random:'          : lambda num10: random.randint(0, num10[0]),
-	'modulus:by:'      : lambda n_m11: n_m11[0] % n_m11[1],
-	'chs'              : lambda num12: -num12[0],
+	'add:to:'          : lambda n, m: n + m,
+	'from:subtract:'   : lambda n, m: n - m,
+	'multiply:by:'     : lambda n, m: n * m,
+	'divide:by:'       : lambda n, m: n / m,
+	'sqrt:'            : math.sqrt,
+	'raise:toPower:'   : math.pow,
+	'abs:'             : math.fabs,
+	'now'              : datetime.datetime.now,
+	'ln:'              : math.log10,
+	'exp:'             : math.exp,
+	'ceiling:'         : math.ceil,
+	'random:'          : lambda num: random.randint(0, num),
+	'modulus:by:'      : lambda n, m: n % m,
+	'chs'              : lambda num: -num,
 
 	'valueForKeyPath:' : lambda object, keyPath: kvc.valueForKeyPath(object, keyPath)
 }
 
+# Functions whose result can differ between calls with the same arguments,
+# and therefore must never be folded into a constant.
+_VolatileFunctions = frozenset(('now', 'random:'))
+
+# Values that can be shared by every evaluation of a folded constant, since
+# nobody can change them in place
+_ImmutableTypes = (type(None), bool, int, float, complex, str, bytes, frozenset,
+                   datetime.date, datetime.time, datetime.timedelta)
+
+def _isImmutable(value):
+	if isinstance(value, tuple):
+		return all(_isImmutable(v) for v in value)
+	return isinstance(value, _ImmutableTypes)
+
 # Quasi-Enums
 
 class ExpressionType(object):
@@ -53,6 +67,8 @@ class ExpressionType(object):
 
 class Expression(object):
 
+	__slots__ = ('_type', '_compiled', '_hash')
+
 	# Creating an Expression for a Value
 
 	@staticmethod
@@ -133,6 +149,8 @@ class Expression(object):
 
 	def __init__(self, type):
 		self._type = type
+		self._compiled = None
+		self._hash = None
 
 	@property
 	def expressionType(self):
@@ -160,8 +178,100 @@ class Expression(object):
 	def expressionValueWithObject(self, object, context=None):
 		return None
 
+	# Compiling an Expression
+
+	def compile(self):
+		# Built once per expression, with constant expressions folded unless
+		# their value, such as a list, could be changed by whoever gets it
+		if self._compiled is None:
+			compiled = None
+			if self._isConstant():
+				try:
+					value = self.expressionValueWithObject(None)
+				except Exception:
+					pass
+				else:
+					if _isImmutable(value):
+						compiled = lambda obj: value
+			self._compiled = compiled or self._compile()
+		return self._compiled
+
+	def _compile(self):
+		return self.expressionValueWithObject
+
+	def _isConstant(self):
+		return False
+
+	def _collectKeyPaths(self, keyPaths):
+		# Adds the key paths read by the expression to keyPaths, and returns
+		# whether the expression's value depends on nothing else.
+		return False
+
+	def _cost(self):
+		# A rough, relative cost of evaluating the compiled expression.
+		# Constant expressions are folded, so they cost nothing.
+		return 0 if self._isConstant() else 1
+
+	# Simplifying an Expression
+
+	def _simplified(self):
+		# Returns an equivalent expression with constant functions replaced
+		# by their values, or the expression itself if nothing changes
+		return self
+
+	# Evaluating an Expression over Columns
+
+	def expressionValuesWithColumns(self, columns):
+		# An array with a value for every row, or a single value if the
+		# expression does not depend on the row
+		from .columns import ColumnBatch
+
+		if self._isConstant():
+			return self.compile()(None)
+		return self._expressionValuesWithColumnBatch(ColumnBatch.batchWithColumns(columns))
+
+	def _expressionValuesWithColumnBatch(self, batch):
+		# Expressions without a vectorized form are evaluated row by row
+		evaluate = self.compile()
+		return batch.objectArray([evaluate(row) for row in batch.rows()])
+
+	# Comparing Expressions
+
+	def _structure(self):
+		# A tuple that is equal for expressions that evaluate the same way
+		return (self._type,)
+
+	def __eq__(self, other):
+		if self is other:
+			return True
+		if not isinstance(other, Expression):
+			return NotImplemented
+		return other.__class__ is self.__class__ and \
+		       hash(other) == hash(self) and \
+		       other._structure() == self._structure()
+
+	def __hash__(self):
+		if self._hash is None:
+			self._hash = hash((self.__class__,) + self._structure())
+		return self._hash
+
+	# Interning an Expression
+
+	def _internWithTable(self, table):
+		# Subexpressions are interned first, so equal subtrees share one instance
+		interned = table.get(self)
+		if interned is None:
+			self._internSubexpressionsWithTable(table)
+			interned = table.setdefault(self, self)
+		return interned
+
+	def _internSubexpressionsWithTable(self, table):
+		pass
+
 class ConstantValueExpression(Expression):
 
+	__slots__ = ('_value',)
+
 	def __init__(self, value):
 		super(ConstantValueExpression, self).__init__(ExpressionType.ConstantValue)
 
@@ -177,6 +287,23 @@ class ConstantValueExpression(Expression):
 	def expressionValueWithObject(self, object, context=None):
 		return self.constantValue
 
+	def _isConstant(self):
+		return True
+
+	def _collectKeyPaths(self, keyPaths):
+		return True
+
+	def _structure(self):
+		# 1, 1.0 and True are equal, but are different constants. Values
+		# that cannot be hashed are only the same constant when they are
+		# the same object.
+		value = self._value
+		try:
+			hash(value)
+		except TypeError:
+			return (value.__class__, id(value))
+		return (value.__class__, value)
+
 	# Getting Representations
 
 	def __str__(self):
@@ -192,6 +319,8 @@ class ConstantValueExpression(Expression):
 
 class SelfExpression(Expression):
 
+	__slots__ = ()
+
 	def __init__(self):
 		super(SelfExpression, self).__init__(ExpressionType.EvaluatedObject)
 
@@ -201,6 +330,9 @@ class SelfExpression(Expression):
 	def expressionValueWithObject(self, object, context=None):
 		return object
 
+	def _compile(self):
+		return lambda obj: obj
+
 	# Getting Representations
 
 	def __str__(self):
@@ -214,6 +346,8 @@ class SelfExpression(Expression):
 
 class VariableExpression(Expression):
 
+	__slots__ = ('_variable',)
+
 	def __init__(self, variable):
 		super(VariableExpression, self).__init__(ExpressionType.Variable)
 
@@ -240,6 +374,12 @@ class VariableExpression(Expression):
 
 		return None
 
+	def _collectKeyPaths(self, keyPaths):
+		return True
+
+	def _structure(self):
+		return (self._variable,)
+
 	# Getting Representations
 
 	def __str__(self):
@@ -255,6 +395,8 @@ class VariableExpression(Expression):
 
 class AggregateExpression(Expression):
 
+	__slots__ = ('_collection',)
+
 	def __init__(self, collection):
 		super(AggregateExpression, self).__init__(ExpressionType.Aggregate)
 
@@ -271,6 +413,31 @@ class AggregateExpression(Expression):
 	def expressionValueWithObject(self, object, context=None):
 		return [e.expressionValueWithObject(object, context=context) for e in self.collection]
 
+	def _compile(self):
+		functions = [e.compile() for e in self.collection]
+		return lambda obj: [f(obj) for f in functions]
+
+	def _isConstant(self):
+		return all(e._isConstant() for e in self.collection)
+
+	def _collectKeyPaths(self, keyPaths):
+		return all([e._collectKeyPaths(keyPaths) for e in self.collection])
+
+	def _cost(self):
+		return sum(e._cost() for e in self.collection)
+
+	def _simplified(self):
+		collection = [e._simplified() for e in self.collection]
+		if all(a is b for a, b in zip(collection, self.collection)):
+			return self
+		return AggregateExpression(collection)
+
+	def _structure(self):
+		return tuple(self._collection)
+
+	def _internSubexpressionsWithTable(self, table):
+		self._collection = [e._internWithTable(table) for e in self._collection]
+
 	# Getting Representations
 
 	def __str__(self):
@@ -286,6 +453,8 @@ class AggregateExpression(Expression):
 
 class SetExpression(Expression):
 
+	__slots__ = ('_leftExpression', '_rightExpression')
+
 	_expressionFunctionNamesByType = {
 		ExpressionType.UnionSet : 'union',
 		ExpressionType.IntersectSet: 'intersection',
@@ -325,6 +494,31 @@ class SetExpression(Expression):
 
 		return expressionFunction(rightValue)
 
+	def _isConstant(self):
+		return self.leftExpression._isConstant() and self.rightExpression._isConstant()
+
+	def _collectKeyPaths(self, keyPaths):
+		return all([self.leftExpression._collectKeyPaths(keyPaths), self.rightExpression._collectKeyPaths(keyPaths)])
+
+	def _cost(self):
+		if self._isConstant():
+			return 0
+		return 2 + self.leftExpression._cost() + self.rightExpression._cost()
+
+	def _simplified(self):
+		leftExpression = self.leftExpression._simplified()
+		rightExpression = self.rightExpression._simplified()
+		if leftExpression is self.leftExpression and rightExpression is self.rightExpression:
+			return self
+		return SetExpression(self._type, leftExpression, rightExpression)
+
+	def _structure(self):
+		return (self._type, self._leftExpression, self._rightExpression)
+
+	def _internSubexpressionsWithTable(self, table):
+		self._leftExpression = self._leftExpression._internWithTable(table)
+		self._rightExpression = self._rightExpression._internWithTable(table)
+
 	# Getting Representations
 
 	def __str__(self):
@@ -342,6 +536,8 @@ class SetExpression(Expression):
 
 class FunctionExpression(Expression):
 
+	__slots__ = ('_selector', '_operand', '_arguments', '_argc')
+
 	def __init__(self, operand, selector, parameters, type):
 		super(FunctionExpression, self).__init__(type)
 
@@ -373,24 +569,133 @@ class FunctionExpression(Expression):
 
 		return target_function(*arguments)
 
+	def _compile(self):
+		if not self.operand._isConstant():
+			return super(FunctionExpression, self)._compile()
+
+		# Resolve the target function once, instead of on every evaluation
+		target = self.operand.expressionValueWithObject(None)
+		try:
+			target_function = target[self.function] if isinstance(target, dict) else getattr(target, self.function)
+		except (KeyError, AttributeError):
+			return super(FunctionExpression, self)._compile()
+
+		arguments = [arg.compile() for arg in self.arguments]
+		if not arguments:
+			return lambda obj: target_function()
+		if len(arguments) == 1:
+			argument, = arguments
+			return lambda obj: target_function(argument(obj))
+		if len(arguments) == 2:
+			argument1, argument2 = arguments
+			return lambda obj: target_function(argument1(obj), argument2(obj))
+		return lambda obj: target_function(*[arg(obj) for arg in arguments])
+
+	def _isConstant(self):
+		return self._type == ExpressionType.Function and \
+		       self.operand.constantValue is _BuiltInFunctions and \
+		       self.function not in _VolatileFunctions and \
+		       all(arg._isConstant() for arg in self.arguments)
+
+	def _collectKeyPaths(self, keyPaths):
+		if self._type != ExpressionType.Function or \
+		   self.operand.constantValue is not _BuiltInFunctions or \
+		   self.function in _VolatileFunctions:
+			return False
+		return all([arg._collectKeyPaths(keyPaths) for arg in self.arguments])
+
+	def _cost(self):
+		if self._isConstant():
+			return 0
+		return 5 + self.operand._cost() + sum(arg._cost() for arg in self.arguments or ())
+
+	def _simplified(self):
+		operand = self.operand._simplified()
+		arguments = [arg._simplified() for arg in self.arguments or ()]
+		if operand is self.operand and all(a is b for a, b in zip(arguments, self.arguments or ())):
+			expression = self
+		else:
+			expression = FunctionExpression(operand, self.function, arguments, self._type)
+
+		if not expression._isConstant():
+			return expression
+		try:
+			value = expression.expressionValueWithObject(None)
+			hash(value)
+		except Exception:
+			# Functions that fail are left to fail when they are evaluated,
+			# and values that cannot be hashed are not shared as constants
+			return expression
+		return ConstantValueExpression(value)
+
+	def _structure(self):
+		return (self._type, self._selector, self._operand, tuple(self._arguments or ()))
+
+	def _internSubexpressionsWithTable(self, table):
+		self._operand = self._operand._internWithTable(table)
+		if self._arguments:
+			self._arguments = [arg._internWithTable(table) for arg in self._arguments]
+
 	def _expressionWithSubstitutionVariables(self, variables):
 		operand = self.operand._expressionWithSubstitutionVariables(variables)
 		arguments = [arg._expressionWithSubstitutionVariables(variables) for arg in self.arguments]
 
-		return expressionForFunction(operand, self.function, arguments)
+		return FunctionExpression(operand, self.function, arguments, self._type)
 
-class KeyPathExpression(FunctionExpression):
+# Only the key path is kept; the operand and arguments of the
+# valueForKeyPath: function are made when they are asked for
+class KeyPathExpression(Expression):
+
+	__slots__ = ('_keyPath',)
 
 	def __init__(self, keyPath):
-		super(KeyPathExpression, self).__init__(Expression.expressionForConstantValue(_BuiltInFunctions), 'valueForKeyPath:', [Expression.expressionForEvaluatedObject(), Expression.expressionForConstantValue(keyPath)], ExpressionType.KeyPath)
+		super(KeyPathExpression, self).__init__(ExpressionType.KeyPath)
+
+		# The same key paths occur throughout a model
+		self._keyPath = kvc.KeyPath.keyPathWithString(keyPath)
+
+	def _expressionWithSubstitutionVariables(self, variables):
+		return self
+
+	@property
+	def function(self):
+		return 'valueForKeyPath:'
+
+	@property
+	def operand(self):
+		return Expression.expressionForConstantValue(_BuiltInFunctions)
+
+	@property
+	def arguments(self):
+		return [Expression.expressionForEvaluatedObject(), self.pathExpression]
 
 	@property
 	def pathExpression(self):
-		return self.arguments[1]
+		return Expression.expressionForConstantValue(self.keyPath)
 
 	@property
 	def keyPath(self):
-		return self.pathExpression.constantValue
+		return self._keyPath.string
+
+	def expressionValueWithObject(self, object, context=None):
+		return self._keyPath.valueWithObject(object)
+
+	def _compile(self):
+		return self._keyPath.valueWithObject
+
+	def _collectKeyPaths(self, keyPaths):
+		keyPaths.add(self.keyPath)
+		return True
+
+	def _cost(self):
+		# Collection operators read every element of a collection
+		return len(self._keyPath.keys) + (10 if self._keyPath.hasCollectionOperator else 0)
+
+	def _structure(self):
+		return (self._keyPath.string,)
+
+	def _expressionValuesWithColumnBatch(self, batch):
+		return batch.valuesForKeyPath(self.keyPath)
 
 	# Getting Representations
 
@@ -0,0 +1,163 @@
+# coding=utf-8
+
+import heapq
+import itertools
+import operator
+
+from . import kvc
+from .expressions import ConstantValueExpression, KeyPathExpression
+from .predicates import ComparisonPredicate, ComparisonPredicateModifier, ComparisonPredicateType
+from .predicates import CompoundPredicate, CompoundPredicateType
+
+def equalityTestsForPredicate(predicate):
+	# Key paths compared with == to a hashable constant, alone or in an AND,
+	# mapped to the constant
+	tests = {}
+
+	if isinstance(predicate, ComparisonPredicate):
+		test = _equalityTestForComparisonPredicate(predicate)
+		if test is not None:
+			tests[test[0]] = test[1]
+	elif isinstance(predicate, CompoundPredicate) and predicate.compoundPredicateType == CompoundPredicateType.And:
+		for subpredicate in predicate.subpredicates:
+			for keyPath, value in equalityTestsForPredicate(subpredicate).items():
+				tests.setdefault(keyPath, value)
+
+	return tests
+
+def _equalityTestForComparisonPredicate(predicate):
+	if predicate.operatorType != ComparisonPredicateType.EqualTo or \
+	   predicate.modifier != ComparisonPredicateModifier.Direct or \
+	   predicate.options:
+		return None
+
+	left, right = predicate.leftExpression, predicate.rightExpression
+	if isinstance(right, KeyPathExpression):
+		left, right = right, left
+	if not isinstance(left, KeyPathExpression) or not isinstance(right, ConstantValueExpression):
+		return None
+
+	try:
+		hash(right.constantValue)
+	except TypeError:
+		return None
+
+	return (left.keyPath, right.constantValue)
+
+
+# Each node tests one key path against the constants its rules require,
+# so only the rules on the matching branch, or not testing it, are candidates
+class DiscriminationIndex(object):
+
+	# Rule lists shorter than this are scanned instead of being split further
+	MinimumNodeSize = 4
+
+	def __init__(self, rules):
+		self._rules = rules
+		entries = [(position, rule, equalityTestsForPredicate(rule.specifier)) for position, rule in enumerate(rules)]
+		self._root = self._nodeForEntries(entries, rules)
+
+	@property
+	def rules(self):
+		return self._rules
+
+	def _nodeForEntries(self, entries, rules=None):
+		if len(entries) >= self.__class__.MinimumNodeSize:
+			counts = {}
+			for _, _, tests in entries:
+				for keyPath in tests:
+					counts[keyPath] = counts.get(keyPath, 0) + 1
+
+			if counts:
+				keyPath = max(counts, key=lambda k: counts[k])
+				branches = {}
+				wildcard = []
+				for position, rule, tests in entries:
+					if keyPath in tests:
+						tests = dict(tests)
+						value = tests.pop(keyPath)
+						branches.setdefault(value, []).append((position, rule, tests))
+					else:
+						wildcard.append((position, rule, tests))
+
+				branches = dict((value, self._nodeForEntries(branch)) for value, branch in branches.items())
+				return _DiscriminationNode(keyPath, branches, self._nodeForEntries(wildcard))
+
+		if rules is None:
+			rules = [rule for _, rule, _ in entries]
+		return _DiscriminationLeaf([position for position, _, _ in entries], rules)
+
+	def candidatesInContext(self, context):
+		# In priority order. Key paths are only read once their rules are next.
+		root = self._root
+		if isinstance(root, _DiscriminationLeaf):
+			return root.rules
+		return map(_entryRule, root.entriesInContext(context, {}))
+
+
+_entryRule = operator.itemgetter(1)
+
+class _DiscriminationNode(object):
+
+	def __init__(self, keyPath, branches, wildcard):
+		self.keyPath = keyPath
+		self.branches = branches
+		self.wildcard = wildcard
+		self.firstBranchPosition = min(branch.firstPosition for branch in branches.values())
+		self.firstPosition = self.firstBranchPosition
+		self.lastPosition = max(branch.lastPosition for branch in branches.values())
+		if wildcard.firstPosition is not None:
+			self.firstPosition = min(self.firstPosition, wildcard.firstPosition)
+			self.lastPosition = max(self.lastPosition, wildcard.lastPosition)
+
+	def entriesInContext(self, context, values):
+		# Yields the (position, rule) entries that may fire in context in
+		# position order. Rules that do not test the key path and come before
+		# every rule that does are yielded before the key path is read.
+		wildcard = self.wildcard.entriesInContext(context, values)
+		for entry in wildcard:
+			if entry[0] > self.firstBranchPosition:
+				break
+			yield entry
+		else:
+			entry = None
+
+		branches = self._branchesInContext(context, values)
+		if len(branches) == 1 and (entry is None or entry[0] > branches[0].lastPosition):
+			# The branch's rules all come before the remaining ones
+			yield from branches[0].entriesInContext(context, values)
+			if entry is not None:
+				yield entry
+				yield from wildcard
+			return
+
+		entries = [branch.entriesInContext(context, values) for branch in branches]
+		if entry is not None:
+			entries.append(itertools.chain((entry,), wildcard))
+		yield from heapq.merge(*entries)
+
+	def _branchesInContext(self, context, values):
+		keyPath = self.keyPath
+		if keyPath in values:
+			value = values[keyPath]
+		else:
+			value = values[keyPath] = kvc.valueForKeyPath(context, keyPath)
+
+		try:
+			branch = self.branches.get(value)
+		except TypeError:
+			# Unhashable values cannot be looked up, so every branch may match
+			return list(self.branches.values())
+		return [branch] if branch is not None else []
+
+
+class _DiscriminationLeaf(object):
+
+	def __init__(self, positions, rules):
+		self.rules = rules
+		self.entries = list(zip(positions, rules))
+		self.firstPosition = positions[0] if positions else None
+		self.lastPosition = positions[-1] if positions else None
+
+	def entriesInContext(self, context, values):
+		return iter(self.entries)
@@ -1,37 +1,255 @@
 # coding=utf-8
 
-import collections
+import collections.abc
+import operator
+import sys
+import types
 
-def valueForKey(obj, key):
+# Resolving Keys
+
+# How a key is read from objects of each type is decided once, the first
+# time the key is read from an object of that type.
+_accessorsByKey = {}   # key -> {type -> accessor}
+
+def _accessorsForKey(key):
+	accessors = _accessorsByKey.get(key)
+	if accessors is None:
+		accessors = _accessorsByKey.setdefault(key, {})
+	return accessors
+
+def _accessorForType(cls, key):
 	if not key:
-		return None
-
-	if isinstance(obj, collections.Sequence) and not isinstance(obj, str):
-		return [valueForKey(o, key) for o in obj]
-	elif isinstance(obj, collections.Mapping):
-		return obj.get(key)
-	else:
-		if not hasattr(obj, key):
-			return None
-		value = getattr(obj, key)
-		if isinstance(value, collections.Callable):
-			value = value()
-		return value
+		return lambda obj: None
 
-def valueForKeyPath(obj, keyPath):
-	separatorIndex = keyPath.find('.')
+	if issubclass(cls, collections.abc.Sequence) and not issubclass(cls, str):
+		return lambda obj: [valueForKey(o, key) for o in obj]
+	if issubclass(cls, collections.abc.Mapping):
+		return lambda obj: obj.get(key)
+
+	# Methods are called, unless instances can have an attribute that
+	# hides the method
+	if isinstance(getattr(cls, key, None), types.FunctionType) and not cls.__dictoffset__:
+		return operator.methodcaller(key)
+
+	def attribute(obj):
+		value = getattr(obj, key, None)
+		return value() if callable(value) else value
+	return attribute
+
+# Collection Operators
+
+# Arrays and column batches are only handled once numpy and kevi.columns
+# have been imported by whoever made them, so reading key paths never
+# imports numpy itself.
+
+def _numpy():
+	return sys.modules.get('numpy')
+
+def _isArray(value):
+	numpy = _numpy()
+	return numpy is not None and isinstance(value, numpy.ndarray)
+
+def _isColumnBatch(value):
+	columns = sys.modules.get(__package__ + '.columns')
+	return columns is not None and isinstance(value, columns.ColumnBatch)
+
+def _valuesForCollection(collection, keyPath):
+	# Returns the values of keyPath for the elements of collection. Arrays,
+	# column batches and mappings of columns give arrays where they can, so
+	# that operators reduce them without a loop.
+	if keyPath is None:
+		return collection
+	if _isColumnBatch(collection):
+		return collection.valuesForKeyPath(keyPath.string)
+	if _isArray(collection):
+		names = collection.dtype.names
+		if names and len(keyPath.keys) == 1 and keyPath.string in names:
+			return collection[keyPath.string]
+		return [keyPath.valueWithObject(element) for element in collection.tolist()]
+	if isinstance(collection, collections.abc.Mapping):
+		return keyPath.valueWithObject(collection)
+	return [keyPath.valueWithObject(element) for element in collection]
+
+def _numericArray(values):
+	if _isArray(values) and values.dtype.kind in 'biuf':
+		return values
+	return None
+
+def _nonNullValues(values):
+	if _isArray(values):
+		values = values.tolist()
+	return [value for value in values if value is not None]
+
+def _count(values):
+	if _isColumnBatch(values):
+		return values.count
+	return len(values)
+
+def _sum(values):
+	array = _numericArray(values)
+	if array is not None:
+		return array.sum().item()
+	return sum(_nonNullValues(values))
+
+def _average(values):
+	array = _numericArray(values)
+	if array is not None:
+		return array.mean().item() if len(array) else None
+	values = _nonNullValues(values)
+	return sum(values) / len(values) if values else None
+
+def _minimum(values):
+	array = _numericArray(values)
+	if array is not None:
+		return array.min().item() if len(array) else None
+	values = _nonNullValues(values)
+	return min(values) if values else None
+
+def _maximum(values):
+	array = _numericArray(values)
+	if array is not None:
+		return array.max().item() if len(array) else None
+	values = _nonNullValues(values)
+	return max(values) if values else None
+
+def _unionOfObjects(values):
+	return values.tolist() if _isArray(values) else list(values)
+
+def _distinctUnionOfObjects(values):
+	# Distinct values in the order they first occur
+	array = _numericArray(values)
+	if array is not None:
+		numpy = _numpy()
+		_, indexes = numpy.unique(array, return_index=True)
+		return array[numpy.sort(indexes)].tolist()
+
+	distinct = []
+	seen = set()
+	for value in _unionOfObjects(values):
+		try:
+			if value in seen:
+				continue
+			seen.add(value)
+		except TypeError:
+			if value in distinct:
+				continue
+		distinct.append(value)
+	return distinct
 
-	if separatorIndex is -1:
-		return valueForKey(obj, keyPath)
+def _elementsOfArray(array):
+	# Values that are not collections are taken as arrays of one value
+	if _isArray(array):
+		return array.tolist()
+	if isinstance(array, (str, bytes, collections.abc.Mapping)) or not isinstance(array, collections.abc.Iterable):
+		return (array,)
+	return array
 
-	firstKeyComponent = keyPath[0 : separatorIndex]
-	remainingKeyPath = keyPath[separatorIndex + 1 :]
-	intermediateValue = valueForKey(obj, firstKeyComponent)
+def _unionOfArrays(values):
+	return [value for array in _unionOfObjects(values) if array is not None for value in _elementsOfArray(array)]
 
-	return valueForKeyPath(intermediateValue, remainingKeyPath)
+def _distinctUnionOfArrays(values):
+	return _distinctUnionOfObjects(_unionOfArrays(values))
+
+_CollectionOperators = {
+	'@count'                  : _count,
+	'@sum'                    : _sum,
+	'@avg'                    : _average,
+	'@min'                    : _minimum,
+	'@max'                    : _maximum,
+	'@unionOfObjects'         : _unionOfObjects,
+	'@distinctUnionOfObjects' : _distinctUnionOfObjects,
+	'@unionOfArrays'          : _unionOfArrays,
+	'@distinctUnionOfArrays'  : _distinctUnionOfArrays
+}
+
+# Key Paths
+
+# The keys after a collection operator are read from each element of the
+# value of the keys before it
+class KeyPath(object):
+
+	__slots__ = ('_string', '_keys', '_steps', '_collectionOperator')
+
+	_keyPaths = {}
+	_keyPathsCapacity = 4096
+
+	@classmethod
+	def keyPathWithString(cls, string):
+		keyPath = cls._keyPaths.get(string)
+		if keyPath is None:
+			if len(cls._keyPaths) >= cls._keyPathsCapacity:
+				cls._keyPaths.clear()
+			keyPath = cls._keyPaths.setdefault(string, cls(string))
+		return keyPath
+
+	def __init__(self, string):
+		self._string = sys.intern(string)
+		self._keys = tuple(sys.intern(key) for key in string.split('.'))
+		self._collectionOperator = None
+
+		steps = []
+		for i, key in enumerate(self._keys):
+			collectionOperator = _CollectionOperators.get(key)
+			if collectionOperator is not None:
+				keyPath = KeyPath.keyPathWithString('.'.join(self._keys[i + 1:])) if i + 1 < len(self._keys) else None
+				self._collectionOperator = (collectionOperator, keyPath)
+				break
+			steps.append((key, _accessorsForKey(key)))
+		self._steps = tuple(steps)
+
+	@property
+	def string(self):
+		return self._string
+
+	@property
+	def keys(self):
+		return self._keys
+
+	@property
+	def hasCollectionOperator(self):
+		return self._collectionOperator is not None
+
+	def valueWithObject(self, obj):
+		for key, accessors in self._steps:
+			cls = type(obj)
+			accessor = accessors.get(cls)
+			if accessor is None:
+				accessor = accessors[cls] = _accessorForType(cls, key)
+			obj = accessor(obj)
+
+		if self._collectionOperator is not None and obj is not None:
+			collectionOperator, keyPath = self._collectionOperator
+			values = _valuesForCollection(obj, keyPath)
+			return collectionOperator(values) if values is not None else None
+		return obj
+
+	def __str__(self):
+		return self._string
+
+	def __repr__(self):
+		return '<%s> %s' % (
+			self.__class__.__name__,
+			self.__str__()
+		)
+
+# Values
+
+def valueForKey(obj, key):
+	accessors = _accessorsByKey.get(key)
+	if accessors is None:
+		accessors = _accessorsForKey(key)
+
+	cls = type(obj)
+	accessor = accessors.get(cls)
+	if accessor is None:
+		accessor = accessors[cls] = _accessorForType(cls, key)
+	return accessor(obj)
+
+def valueForKeyPath(obj, keyPath):
+	return KeyPath.keyPathWithString(keyPath).valueWithObject(obj)
 
 def setValueForKey(obj, value, key):
 	pass
 
 def setValueForKeyPath(obj, value, keyPath):
-	pass
\ No newline at end of file
+	pass
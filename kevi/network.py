@@ -0,0 +1,100 @@
+# coding=utf-8
+
+from .predicates import ComparisonPredicate, CompoundPredicate, CompoundPredicateType
+
+# Each distinct comparison is one condition node, evaluated at most once
+# per context state and shared by every rule that uses it
+class ConditionNetwork(object):
+
+	def __init__(self, rules=None):
+		self._conditions = {}
+		self._evaluators = {}
+
+		for rule in rules or ():
+			self.addRule(rule)
+
+	@property
+	def conditionCount(self):
+		return len(self._conditions)
+
+	# Adding and Removing Rules
+
+	def addRule(self, rule):
+		self._evaluators[id(rule)] = (rule, self._evaluatorForPredicate(rule.specifier))
+
+	def removeRule(self, rule):
+		self._evaluators.pop(id(rule), None)
+
+	def _conditionForPredicate(self, predicate):
+		# Equal predicates compare and hash by structure, including options
+		condition = self._conditions.get(predicate)
+		if condition is None:
+			condition = self._conditions[predicate] = _ConditionNode(predicate)
+		return condition
+
+	def _evaluatorForPredicate(self, predicate):
+		if predicate._isConstant():
+			value = predicate.compile()(None)
+			return lambda obj, memo: value
+
+		if isinstance(predicate, ComparisonPredicate):
+			return self._conditionForPredicate(predicate).evaluate
+
+		if isinstance(predicate, CompoundPredicate):
+			evaluators = [self._evaluatorForPredicate(p) for p in predicate.subpredicates]
+
+			if predicate.compoundPredicateType == CompoundPredicateType.Not:
+				evaluate, = evaluators
+				return lambda obj, memo: not evaluate(obj, memo)
+
+			if predicate.compoundPredicateType == CompoundPredicateType.And:
+				def evaluateAnd(obj, memo):
+					for evaluate in evaluators:
+						if not evaluate(obj, memo):
+							return False
+					return True
+				return evaluateAnd
+
+			def evaluateOr(obj, memo):
+				for evaluate in evaluators:
+					if evaluate(obj, memo):
+						return True
+				return False
+			return evaluateOr
+
+		evaluate = predicate.compile()
+		return lambda obj, memo: evaluate(obj)
+
+	# Evaluating Rules
+
+	def memoForContext(self, context):
+		memo = getattr(context, 'conditionValues', None)
+		return memo if memo is not None else {}
+
+	def canFireInContext(self, rule, context, memo=None):
+		if memo is None:
+			memo = self.memoForContext(context)
+		entry = self._evaluators.get(id(rule))
+		if entry is None or entry[0] is not rule:
+			return rule.canFireInContext(context)
+		return entry[1](context, memo)
+
+	def rulesThatCanFire(self, rules, context):
+		memo = self.memoForContext(context)
+		for rule in rules:
+			if self.canFireInContext(rule, context, memo):
+				yield rule
+
+
+class _ConditionNode(object):
+
+	def __init__(self, predicate):
+		self.predicate = predicate
+		self.test = predicate.compile()
+
+	def evaluate(self, obj, memo):
+		try:
+			return memo[self]
+		except KeyError:
+			value = memo[self] = self.test(obj)
+			return value
@@ -1,17 +1,175 @@
 # coding=utf-8
 
+import bisect
 import builtins
+import functools
+import operator
 import re
+import unicodedata
 
 from . import predicates
 
+def _numpy():
+	# numpy is only imported once vectorized evaluation is used
+	from .columns import requireNumpy
+	return requireNumpy()
+
+def _isInArray(array, collection):
+	# numpy converts the collection to a single type, so only collections of
+	# values with the same kind as the array are compared as in would
+	if not isinstance(collection, (list, tuple, set, frozenset)):
+		return None
+	if array.dtype.kind in 'biuf':
+		if not all(isinstance(value, (int, float)) and value == value for value in collection):
+			return None
+	elif array.dtype.kind == 'U':
+		if not all(isinstance(value, str) for value in collection):
+			return None
+	else:
+		return None
+	return _numpy().isin(array, list(collection))
+
+# String Comparisons
+
+def _stringWithoutDiacritics(string):
+	if string.isascii():
+		return string
+	return ''.join(c for c in unicodedata.normalize('NFD', string) if not unicodedata.combining(c))
+
+def _foldedValue(value, options):
+	# Applies the case and diacritic insensitive options to strings, and
+	# leaves any other value as it is
+	if not isinstance(value, str):
+		return value
+	if options & predicates.ComparisonPredicateOptions.DiacriticInsensitive:
+		value = _stringWithoutDiacritics(value)
+	if options & predicates.ComparisonPredicateOptions.CaseInsensitive:
+		value = value.casefold()
+	return value
+
+def _foldedCollection(value, options):
+	# Folds the strings in a collection, or value itself if it is not one
+	if isinstance(value, (list, tuple, set, frozenset, dict)):
+		return [_foldedValue(element, options) for element in value]
+	return _foldedValue(value, options)
+
+def _regularExpressionForLikePattern(pattern):
+	# * matches any number of characters and ? matches one, and a backslash
+	# makes the next character match itself
+	regularExpression = []
+	escaped = False
+	for c in pattern:
+		if escaped:
+			regularExpression.append(re.escape(c))
+			escaped = False
+		elif c == '\\':
+			escaped = True
+		elif c == '*':
+			regularExpression.append('.*')
+		elif c == '?':
+			regularExpression.append('.')
+		else:
+			regularExpression.append(re.escape(c))
+	return ''.join(regularExpression)
+
+@functools.lru_cache(maxsize=1024)
+def _patternForString(string, operatorType, options):
+	# Case is ignored with a flag rather than by folding the pattern, which
+	# would change escapes like \S
+	if options & predicates.ComparisonPredicateOptions.DiacriticInsensitive:
+		string = _stringWithoutDiacritics(string)
+	flags = re.IGNORECASE if options & predicates.ComparisonPredicateOptions.CaseInsensitive else 0
+	if operatorType == predicates.ComparisonPredicateType.Like:
+		return re.compile(_regularExpressionForLikePattern(string), flags | re.DOTALL)
+	return re.compile(string, flags)
+
+# Membership Tests
+
+def _isTotallyOrdered(value):
+	# Whether value is a number, string or sequence of those, which sort
+	# consistently with ==. Sets are only partially ordered by <, and NaN
+	# is not ordered at all, so neither can be found with a binary search.
+	if isinstance(value, (list, tuple)):
+		return all(_isTotallyOrdered(element) for element in value)
+	if isinstance(value, float):
+		return value == value
+	return isinstance(value, (int, str, bytes))
+
+def _membershipTestForCollection(collection):
+	# Returns a function that tells whether a value is in collection. The
+	# hashable values are kept in a frozenset, and any others in a sorted
+	# list if they are totally ordered, or a tuple if not. Values that
+	# cannot be looked up that way are compared with every value, as with in.
+	hashableValues = []
+	otherValues = []
+	for value in collection:
+		try:
+			hash(value)
+		except TypeError:
+			otherValues.append(value)
+		else:
+			hashableValues.append(value)
+
+	values = tuple(collection)
+	members = frozenset(hashableValues)
+	if not otherValues:
+		def isMember(value):
+			try:
+				return value in members
+			except TypeError:
+				return value in values
+		return isMember
+
+	try:
+		if not all(_isTotallyOrdered(value) for value in otherValues):
+			raise TypeError
+		otherValues.sort()
+	except TypeError:
+		otherValues = tuple(otherValues)
+		def isMember(value):
+			try:
+				if value in members:
+					return True
+			except TypeError:
+				pass
+			return value in otherValues
+		return isMember
+
+	def isMember(value):
+		try:
+			return value in members
+		except TypeError:
+			pass
+		try:
+			i = bisect.bisect_left(otherValues, value)
+		except TypeError:
+			return value in values
+		return i < len(otherValues) and otherValues[i] == value
+	return isMember
+
+_Collections = (list, tuple, set, frozenset)
+
+
+# Operators are immutable, and shared through operatorWithType
 class PredicateOperator(object):
 
+	__slots__ = ('_operatorType', '_modifier', '_options')
+
+	_operators = {}
+
 	def __init__(self, operatorType, modifier, options):
 		self._operatorType = operatorType
 		self._modifier = modifier
 		self._options = options
 
+	@classmethod
+	def operatorWithType(cls, operatorType, modifier, options):
+		key = (cls, operatorType, modifier, options)
+		predicateOperator = PredicateOperator._operators.get(key)
+		if predicateOperator is None:
+			predicateOperator = PredicateOperator._operators.setdefault(key, cls(operatorType, modifier, options))
+		return predicateOperator
+
 	@property
 	def operatorType(self):
 		return self._operatorType
@@ -30,31 +188,194 @@ class PredicateOperator(object):
 
 class ComparisonPredicateOperator(PredicateOperator):
 
+	__slots__ = ('_function',)
+
 	_operatorFunctionsByType = {
-		predicates.ComparisonPredicateType.LessThan           : lambda l, r: l < r,
-		predicates.ComparisonPredicateType.LessThanOrEqual    : lambda l, r: l <= r,
-		predicates.ComparisonPredicateType.GreaterThan        : lambda l, r: l > r,
-		predicates.ComparisonPredicateType.GreaterThanOrEqual : lambda l, r: l >= r,
-		predicates.ComparisonPredicateType.EqualTo            : lambda l, r: l == r,
-		predicates.ComparisonPredicateType.NotEqualTo         : lambda l, r: l != r,
-		predicates.ComparisonPredicateType.Matches            : lambda l, r: re.match(r, l) != None,
+		predicates.ComparisonPredicateType.LessThan           : operator.lt,
+		predicates.ComparisonPredicateType.LessThanOrEqual    : operator.le,
+		predicates.ComparisonPredicateType.GreaterThan        : operator.gt,
+		predicates.ComparisonPredicateType.GreaterThanOrEqual : operator.ge,
+		predicates.ComparisonPredicateType.EqualTo            : operator.eq,
+		predicates.ComparisonPredicateType.NotEqualTo         : operator.ne,
+		predicates.ComparisonPredicateType.Matches            : None, # uses a compiled pattern, see _patternForString
 		predicates.ComparisonPredicateType.Like               : None, # subset of MATCHES, similar to SQL like
 		predicates.ComparisonPredicateType.BeginsWith         : lambda l, r: l.startswith(r) if l else False,
-		predicates.ComparisonPredicateType.EndsWith           : lambda l, r: l.endwith(r) if l else False,
+		predicates.ComparisonPredicateType.EndsWith           : lambda l, r: l.endswith(r) if l else False,
 		predicates.ComparisonPredicateType.In                 : lambda l, r: l in r if r else False,
 		predicates.ComparisonPredicateType.CustomSelector     : None, # not supported yet
 		predicates.ComparisonPredicateType.Contains           : lambda l, r: r in l if l else False, # l contains r, l must be a collection
 		predicates.ComparisonPredicateType.Between            : lambda l, r: r[0] < l < r[1]
 	}
 
+	# Types whose operands are folded by the case and diacritic options
+	_foldedOperatorTypes = frozenset([
+		predicates.ComparisonPredicateType.LessThan,
+		predicates.ComparisonPredicateType.LessThanOrEqual,
+		predicates.ComparisonPredicateType.GreaterThan,
+		predicates.ComparisonPredicateType.GreaterThanOrEqual,
+		predicates.ComparisonPredicateType.EqualTo,
+		predicates.ComparisonPredicateType.NotEqualTo,
+		predicates.ComparisonPredicateType.BeginsWith,
+		predicates.ComparisonPredicateType.EndsWith,
+		predicates.ComparisonPredicateType.In,
+		predicates.ComparisonPredicateType.Contains
+	])
+
+	# Rough, relative costs of the operations, for ordering subpredicates
+	_costsByType = {
+		predicates.ComparisonPredicateType.LessThan           : 1,
+		predicates.ComparisonPredicateType.LessThanOrEqual    : 1,
+		predicates.ComparisonPredicateType.GreaterThan        : 1,
+		predicates.ComparisonPredicateType.GreaterThanOrEqual : 1,
+		predicates.ComparisonPredicateType.EqualTo            : 1,
+		predicates.ComparisonPredicateType.NotEqualTo         : 1,
+		predicates.ComparisonPredicateType.Matches            : 10,
+		predicates.ComparisonPredicateType.Like               : 10,
+		predicates.ComparisonPredicateType.BeginsWith         : 2,
+		predicates.ComparisonPredicateType.EndsWith           : 2,
+		predicates.ComparisonPredicateType.In                 : 2,
+		predicates.ComparisonPredicateType.Contains           : 3,
+		predicates.ComparisonPredicateType.Between            : 2
+	}
+
+	def __init__(self, operatorType, modifier, options):
+		super(ComparisonPredicateOperator, self).__init__(operatorType, modifier, options)
+		self._function = None
+
+	def cost(self):
+		# Folding strings for the options costs about as much as a pattern
+		return self.__class__._costsByType.get(self.operatorType, 10) + (5 if self.options else 0)
+
+	def operatorFunction(self):
+		if self._function is None:
+			self._function = self._operatorFunctionWithOptions()
+		return self._function
+
+	def _operatorFunctionWithOptions(self):
+		operatorType = self.operatorType
+		options = self.options
+
+		if operatorType in (predicates.ComparisonPredicateType.Matches, predicates.ComparisonPredicateType.Like):
+			isLike = operatorType == predicates.ComparisonPredicateType.Like
+			def match(l, r):
+				if not isinstance(l, str) or not isinstance(r, str):
+					return False
+				pattern = _patternForString(r, operatorType, options)
+				l = _foldedValue(l, options & predicates.ComparisonPredicateOptions.DiacriticInsensitive)
+				return (pattern.fullmatch(l) if isLike else pattern.match(l)) is not None
+			return match
+
+		function = self.__class__._operatorFunctionsByType[operatorType]
+		if function is None or not options or operatorType not in self.__class__._foldedOperatorTypes:
+			return function
+		if operatorType == predicates.ComparisonPredicateType.In:
+			return lambda l, r: function(_foldedValue(l, options), _foldedCollection(r, options))
+		if operatorType == predicates.ComparisonPredicateType.Contains:
+			return lambda l, r: function(_foldedCollection(l, options), _foldedValue(r, options))
+		return lambda l, r: function(_foldedValue(l, options), _foldedValue(r, options))
+
+	def operatorFunctionWithRightValue(self, rightValue):
+		# Prepares patterns and folded strings for rightValue up front
+		operatorType = self.operatorType
+		options = self.options
+		function = self.operatorFunction()
+		if function is None:
+			return None
+
+		if operatorType in (predicates.ComparisonPredicateType.Matches, predicates.ComparisonPredicateType.Like):
+			if not isinstance(rightValue, str):
+				return lambda l: False
+			pattern = _patternForString(rightValue, operatorType, options)
+			match = pattern.fullmatch if operatorType == predicates.ComparisonPredicateType.Like else pattern.match
+			diacriticOptions = options & predicates.ComparisonPredicateOptions.DiacriticInsensitive
+			if diacriticOptions:
+				return lambda l: match(_foldedValue(l, diacriticOptions)) is not None if isinstance(l, str) else False
+			return lambda l: match(l) is not None if isinstance(l, str) else False
+
+		if options and operatorType == predicates.ComparisonPredicateType.In and isinstance(rightValue, _Collections):
+			isMember = _membershipTestForCollection(_foldedCollection(rightValue, options))
+			return lambda l: isMember(_foldedValue(l, options))
+
+		if options and operatorType in self.__class__._foldedOperatorTypes:
+			function = self.__class__._operatorFunctionsByType[operatorType]
+			if operatorType == predicates.ComparisonPredicateType.In:
+				rightValue = _foldedCollection(rightValue, options)
+				return lambda l: function(_foldedValue(l, options), rightValue)
+			rightValue = _foldedValue(rightValue, options)
+			if operatorType == predicates.ComparisonPredicateType.Contains:
+				return lambda l: function(_foldedCollection(l, options), rightValue)
+			return lambda l: function(_foldedValue(l, options), rightValue)
+
+		if operatorType == predicates.ComparisonPredicateType.In and isinstance(rightValue, _Collections):
+			return _membershipTestForCollection(rightValue)
+
+		return lambda l: function(l, rightValue)
+
+	def operatorFunctionWithLeftValue(self, leftValue):
+		function = self.operatorFunction()
+		if function is None:
+			return None
+
+		if self.operatorType == predicates.ComparisonPredicateType.Contains and not self.options and \
+		   isinstance(leftValue, _Collections):
+			return _membershipTestForCollection(leftValue)
+
+		return lambda r: function(leftValue, r)
+
 	def performOperationUsingObjects(self, obj1, obj2):
 		operatorFunction = self.operatorFunction()
 
 		return operatorFunction(obj1, obj2)
 
+	# Vectorized Operations
+
+	_vectorizedFunctionsByType = {
+		predicates.ComparisonPredicateType.LessThan           : operator.lt,
+		predicates.ComparisonPredicateType.LessThanOrEqual    : operator.le,
+		predicates.ComparisonPredicateType.GreaterThan        : operator.gt,
+		predicates.ComparisonPredicateType.GreaterThanOrEqual : operator.ge,
+		predicates.ComparisonPredicateType.EqualTo            : operator.eq,
+		predicates.ComparisonPredicateType.NotEqualTo         : operator.ne,
+		predicates.ComparisonPredicateType.BeginsWith         : lambda l, r: _numpy().char.startswith(l, r) if l.dtype.kind == 'U' and isinstance(r, str) else None,
+		predicates.ComparisonPredicateType.EndsWith           : lambda l, r: _numpy().char.endswith(l, r) if l.dtype.kind == 'U' and isinstance(r, str) else None,
+		predicates.ComparisonPredicateType.In                 : lambda l, r: _isInArray(l, r),
+		predicates.ComparisonPredicateType.Between            : lambda l, r: (l > r[0]) & (l < r[1]) if l.dtype.kind in 'biuf' and isinstance(r, (list, tuple)) else None
+	}
+
+	def performVectorizedOperationUsingArrays(self, leftValues, rightValues, batch):
+		# The values are arrays with one value per row, or a single value
+		from .columns import isArray
+		numpy = _numpy()
+
+		# Compare whole arrays against a single value where numpy can, and
+		# fall back to the operator function one row at a time otherwise.
+		vectorizedFunction = self.__class__._vectorizedFunctionsByType.get(self.operatorType)
+		if self.options:
+			# The vectorized functions compare strings as they are
+			vectorizedFunction = None
+		if isinstance(rightValues, (list, tuple, set, frozenset, dict)) and \
+		   self.operatorType not in (predicates.ComparisonPredicateType.In, predicates.ComparisonPredicateType.Between):
+			# numpy would broadcast a collection instead of comparing with it
+			vectorizedFunction = None
+		if vectorizedFunction is not None and isArray(leftValues) and not isArray(rightValues):
+			try:
+				result = vectorizedFunction(leftValues, rightValues)
+			except TypeError:
+				result = None
+			if isArray(result) and result.dtype == bool and result.shape == (batch.count,):
+				return result
+
+		operatorFunction = self.operatorFunction()
+		leftValues = batch.broadcast(leftValues).tolist()
+		rightValues = batch.broadcast(rightValues).tolist()
+
+		return numpy.fromiter((bool(operatorFunction(l, r)) for l, r in zip(leftValues, rightValues)), dtype=bool, count=batch.count)
+
 
 class CompoundPredicateOperator(PredicateOperator):
 
+	__slots__ = ()
+
 	_operatorFunctionsByType = {
 		predicates.CompoundPredicateType.Not: lambda p: not next(p),
 		predicates.CompoundPredicateType.And: getattr(builtins, 'all'),
@@ -68,3 +389,28 @@ class CompoundPredicateOperator(PredicateOperator):
 		evaluatedPredicates = (p.evaluateWithObject(obj) for p in predicates)
 
 		return operatorFunction(evaluatedPredicates)
+
+	def evaluatePredicatesWithColumnBatch(self, subpredicates, batch):
+		numpy = _numpy()
+
+		if self.operatorType == predicates.CompoundPredicateType.Not:
+			return numpy.logical_not(subpredicates[0]._evaluateWithColumnBatch(batch))
+
+		# Each subpredicate is only evaluated for the rows that the preceding
+		# subpredicates left undecided, as with short-circuit evaluation.
+		isAnd = self.operatorType == predicates.CompoundPredicateType.And
+		result = numpy.full(batch.count, isAnd, dtype=bool)
+		rows = numpy.arange(batch.count)
+		remaining = batch
+
+		for predicate in subpredicates:
+			mask = predicate._evaluateWithColumnBatch(remaining)
+			decided = numpy.logical_not(mask) if isAnd else mask
+			if decided.any():
+				result[rows[decided]] = not isAnd
+				rows = rows[numpy.logical_not(decided)]
+				if not len(rows):
+					break
+				remaining = batch.subset(rows)
+
+		return result
@@ -71,7 +71,9 @@ class CompoundPredicateType(object):
 
 
 class Predicate(object):
-	
+
+	__slots__ = ('_compiled', '_hash')
+
 	# Creating a Predicate
 
 	@staticmethod
@@ -102,7 +104,8 @@ class Predicate(object):
 	# Initializing a Predicate
 
 	def __init__(self):
-		pass
+		self._compiled = None
+		self._hash = None
 
 	# Evaluating a Predicate
 
@@ -112,6 +115,98 @@ class Predicate(object):
 	def evaluateWithObjectAndSubstitutionVariables(self, obj, variables):
 		predicate = self.predicateWithSubstitutionVariables(self, variables)
 		return predicate.evaluateWithObject(obj)
+
+	# Compiling a Predicate
+
+	def compile(self):
+		# Cached; predicates that do not depend on the object become constants
+		# when they evaluate to a plain bool
+		if self._compiled is None:
+			compiled = None
+			if self._isConstant():
+				try:
+					value = self.evaluateWithObject(None)
+				except Exception:
+					pass
+				else:
+					if isinstance(value, bool):
+						compiled = lambda obj: value
+			self._compiled = compiled or self._compile()
+		return self._compiled
+
+	def _compile(self):
+		return self.evaluateWithObject
+
+	def _isConstant(self):
+		return False
+
+	def _collectKeyPaths(self, keyPaths):
+		# Adds the key paths read by the predicate to keyPaths, and returns
+		# whether the predicate's result depends on nothing else.
+		return False
+
+	def _cost(self):
+		# A rough, relative cost of evaluating the compiled predicate
+		return 0 if self._isConstant() else 1
+
+	# Simplifying a Predicate
+
+	def _simplified(self):
+		# Returns an equivalent predicate with constant comparisons and
+		# functions folded, identity terms dropped and nested ANDs and ORs
+		# flattened, or the predicate itself if nothing changes
+		return self
+
+	def significantKeyPaths(self):
+		# None if the result may depend on more than key paths
+		keyPaths = set()
+		return keyPaths if self._collectKeyPaths(keyPaths) else None
+
+	# Evaluating a Predicate over Columns
+
+	def evaluateWithColumns(self, columns):
+		# A boolean array with the result for every row
+		from .columns import ColumnBatch
+		return self._evaluateWithColumnBatch(ColumnBatch.batchWithColumns(columns))
+
+	def _evaluateWithColumnBatch(self, batch):
+		# Predicates without a vectorized form are evaluated row by row
+		from .columns import numpy
+		evaluate = self.compile()
+		return numpy.fromiter((bool(evaluate(row)) for row in batch.rows()), dtype=bool, count=batch.count)
+
+	# Comparing Predicates
+
+	def _structure(self):
+		# A tuple that is equal for predicates that evaluate the same way
+		return ()
+
+	def __eq__(self, other):
+		if self is other:
+			return True
+		if not isinstance(other, Predicate):
+			return NotImplemented
+		return other.__class__ is self.__class__ and \
+		       hash(other) == hash(self) and \
+		       other._structure() == self._structure()
+
+	def __hash__(self):
+		if self._hash is None:
+			self._hash = hash((self.__class__,) + self._structure())
+		return self._hash
+
+	# Interning a Predicate
+
+	def _internWithTable(self, table):
+		# Returns the equal predicate from table, after interning its parts
+		interned = table.get(self)
+		if interned is None:
+			self._internSubnodesWithTable(table)
+			interned = table.setdefault(self, self)
+		return interned
+
+	def _internSubnodesWithTable(self, table):
+		pass
 	
 	# Getting Representations
 
@@ -123,13 +218,17 @@ class Predicate(object):
 
 
 class ComparisonPredicate(Predicate):
-	
+
+	__slots__ = ('_leftExpression', '_rightExpression', '_operator')
+
 	def __init__(self, leftExpression, rightExpression, modifier=ComparisonPredicateModifier.Direct, type=ComparisonPredicateType.EqualTo, options=0):
 		from .operators import ComparisonPredicateOperator
 
+		super(ComparisonPredicate, self).__init__()
+
 		self._leftExpression = leftExpression
 		self._rightExpression = rightExpression
-		self._operator = ComparisonPredicateOperator(type, modifier, options)
+		self._operator = ComparisonPredicateOperator.operatorWithType(type, modifier, options)
 	
 	def predicateWithSubstitutionVariables(self, variables):
 		leftExpression = self.leftExpression._expressionWithSubstitutionVariables(variables)
@@ -164,6 +263,79 @@ class ComparisonPredicate(Predicate):
 
 		return self._operator.performOperationUsingObjects(leftValue, rightValue)
 
+	def _compile(self):
+		operatorFunction = self._operator.operatorFunction()
+		if operatorFunction is None:
+			return self.evaluateWithObject
+
+		left = self.leftExpression.compile()
+		right = self.rightExpression.compile()
+
+		if not self.rightExpression._isConstant():
+			if self.leftExpression._isConstant():
+				# For example, a constant aggregate that CONTAINS a value
+				operatorFunction = self._operator.operatorFunctionWithLeftValue(left(None))
+				return lambda obj: operatorFunction(right(obj))
+			return lambda obj: operatorFunction(left(obj), right(obj))
+
+		rightValue = right(None)
+		if not self.options:
+			if self.operatorType == ComparisonPredicateType.EqualTo:
+				return lambda obj: left(obj) == rightValue
+			if self.operatorType == ComparisonPredicateType.NotEqualTo:
+				return lambda obj: left(obj) != rightValue
+
+		# Patterns and folded strings are prepared once for a constant
+		operatorFunction = self._operator.operatorFunctionWithRightValue(rightValue)
+		return lambda obj: operatorFunction(left(obj))
+
+	def _isConstant(self):
+		return self._operator.operatorFunction() is not None and \
+		       self.leftExpression._isConstant() and \
+		       self.rightExpression._isConstant()
+
+	def _collectKeyPaths(self, keyPaths):
+		return all([self.leftExpression._collectKeyPaths(keyPaths), self.rightExpression._collectKeyPaths(keyPaths)])
+
+	def _cost(self):
+		if self._isConstant():
+			return 0
+		if self._operator.operatorFunction() is None:
+			return 10 + self.leftExpression._cost() + self.rightExpression._cost()
+		return self._operator.cost() + self.leftExpression._cost() + self.rightExpression._cost()
+
+	def _simplified(self):
+		leftExpression = self.leftExpression._simplified()
+		rightExpression = self.rightExpression._simplified()
+		if leftExpression is self.leftExpression and rightExpression is self.rightExpression:
+			predicate = self
+		else:
+			predicate = ComparisonPredicate(leftExpression, rightExpression, modifier=self.modifier, type=self.operatorType, options=self.options)
+
+		if not predicate._isConstant():
+			return predicate
+		try:
+			value = predicate.evaluateWithObject(None)
+		except Exception:
+			return predicate
+		return Predicate.predicateWithValue(value)
+
+	def _evaluateWithColumnBatch(self, batch):
+		if self._operator.operatorFunction() is None:
+			return super(ComparisonPredicate, self)._evaluateWithColumnBatch(batch)
+
+		leftValues = self.leftExpression.expressionValuesWithColumns(batch)
+		rightValues = self.rightExpression.expressionValuesWithColumns(batch)
+
+		return self._operator.performVectorizedOperationUsingArrays(leftValues, rightValues, batch)
+
+	def _structure(self):
+		return (self.modifier, self.operatorType, self.options, self._leftExpression, self._rightExpression)
+
+	def _internSubnodesWithTable(self, table):
+		self._leftExpression = self._leftExpression._internWithTable(table)
+		self._rightExpression = self._rightExpression._internWithTable(table)
+
 	# Getting Representations
 
 	def __str__(self):
@@ -180,13 +352,74 @@ class ComparisonPredicate(Predicate):
 			self.__str__()
 		)
 
+# Ordering Subpredicates
+
+def _evaluatorWithFunctions(functions, isAnd):
+	if not functions:
+		return lambda obj: isAnd
+	if len(functions) == 1:
+		evaluate, = functions
+		return lambda obj: True if evaluate(obj) else False
+	if len(functions) == 2:
+		evaluate1, evaluate2 = functions
+		if isAnd:
+			return lambda obj: True if evaluate1(obj) and evaluate2(obj) else False
+		return lambda obj: True if evaluate1(obj) or evaluate2(obj) else False
+
+	if isAnd:
+		def evaluateAnd(obj):
+			for evaluate in functions:
+				if not evaluate(obj):
+					return False
+			return True
+		return evaluateAnd
+
+	def evaluateOr(obj):
+		for evaluate in functions:
+			if evaluate(obj):
+				return True
+		return False
+	return evaluateOr
+
+def _rankForSubpredicate(cost, probability, isAnd):
+	# The cost paid per evaluation that decides the result: AND is decided
+	# by a false subpredicate and OR by a true one
+	return (cost + 1) / ((1.0 - probability) if isAnd else probability)
+
+def _orderWithRanks(movable, ranks):
+	# Sorts each run of movable subpredicates by rank, and leaves the others
+	# where they are. Equal ranks keep their order.
+	order = []
+	run = []
+	for i, canMove in enumerate(movable):
+		if canMove:
+			run.append(i)
+			continue
+		order.extend(sorted(run, key=ranks.__getitem__))
+		order.append(i)
+		run = []
+	order.extend(sorted(run, key=ranks.__getitem__))
+	return order
+
+
+# A compiled AND or OR tries the subpredicates that are cheapest and most
+# likely to decide first, unless they depend on more than key paths.
+# Where the written order raises, a moved subpredicate may decide first,
+# so the compiled predicate can return a result instead.
 class CompoundPredicate(Predicate):
 
+	__slots__ = ('_subpredicates', '_operator')
+
+	# Evaluations counted before the order of the subpredicates is settled
+	_sampleCount = 1000
+
 	def __init__(self, subpredicates, type=CompoundPredicateType.And):
 		from .operators import CompoundPredicateOperator
 
-		self._subpredicates = subpredicates
-		self._operator = CompoundPredicateOperator(type, 0, 0)
+		super(CompoundPredicate, self).__init__()
+
+		self._subpredicates = tuple(subpredicates)
+		self._operator = CompoundPredicateOperator.operatorWithType(type, 0, 0)
 
 	def predicateWithSubstitutionVariables(self, variables):
 		subpredicates = [p.predicateWithSubstitutionVariables(variables) for p in self.subpredicates]
@@ -205,11 +438,131 @@ class CompoundPredicate(Predicate):
 	def evaluateWithObject(self, obj):
 		return self._operator.evaluatePredicatesWithObject(self.subpredicates, obj)
 
+	def _compile(self):
+		if self.compoundPredicateType == CompoundPredicateType.Not:
+			evaluate = self.subpredicates[0].compile()
+			return lambda obj: not evaluate(obj)
+
+		# TRUE is the identity of AND and FALSE the identity of OR, so
+		# constant subpredicates either drop out or decide the result.
+		isAnd = self.compoundPredicateType == CompoundPredicateType.And
+		subpredicates = []
+		for predicate in self.subpredicates:
+			if not predicate._isConstant():
+				subpredicates.append(predicate)
+			elif bool(predicate.compile()(None)) != isAnd:
+				return lambda obj: not isAnd
+
+		functions = [p.compile() for p in subpredicates]
+		evaluate = _evaluatorWithFunctions(functions, isAnd)
+
+		# Only subpredicates that depend on nothing but key paths are moved
+		movable = [p._collectKeyPaths(set()) for p in subpredicates]
+		if not any(movable[i] and movable[i + 1] for i in range(len(movable) - 1)):
+			return evaluate
+		return self._adaptiveEvaluator(subpredicates, functions, movable, evaluate)
+
+	def _adaptiveEvaluator(self, subpredicates, functions, movable, evaluateInSourceOrder):
+		# Evaluates the subpredicates cheapest first, counting how often each
+		# is true over the first evaluations, then settles on the order that
+		# is expected to short-circuit soonest for its cost.
+		isAnd = self.compoundPredicateType == CompoundPredicateType.And
+		costs = [p._cost() for p in subpredicates]
+		evaluations = [0] * len(subpredicates)
+		trues = [0] * len(subpredicates)
+		remaining = self.__class__._sampleCount
+
+		def orderWithSelectivity():
+			ranks = [_rankForSubpredicate(cost, (t + 1.0) / (n + 2.0), isAnd) for cost, t, n in zip(costs, trues, evaluations)]
+			return _orderWithRanks(movable, ranks)
+
+		order = orderWithSelectivity()
+
+		def sample(obj):
+			nonlocal current, remaining
+			result = isAnd
+			for i in order:
+				value = functions[i](obj)
+				evaluations[i] += 1
+				if value:
+					trues[i] += 1
+				if bool(value) != isAnd:
+					result = not isAnd
+					break
+
+			# Concurrent evaluations may miss each other's decrements
+			remaining -= 1
+			if remaining <= 0:
+				current = _evaluatorWithFunctions([functions[i] for i in orderWithSelectivity()], isAnd)
+			return result
+
+		current = sample
+
+		def evaluate(obj):
+			try:
+				return current(obj)
+			except Exception:
+				# A moved subpredicate may raise for a value that one written
+				# before it rules out, for example a comparison with a value
+				# that an earlier subpredicate checks for nil
+				return evaluateInSourceOrder(obj)
+		return evaluate
+
+	def _isConstant(self):
+		return all(p._isConstant() for p in self.subpredicates)
+
+	def _cost(self):
+		return sum(p._cost() for p in self.subpredicates)
+
+	def _simplified(self):
+		compoundPredicateType = self.compoundPredicateType
+		subpredicates = [p._simplified() for p in self.subpredicates]
+
+		if compoundPredicateType == CompoundPredicateType.Not:
+			subpredicate, = subpredicates
+			if isinstance(subpredicate, ValuePredicate):
+				return Predicate.predicateWithValue(not subpredicate.value)
+			if subpredicate is self.subpredicates[0]:
+				return self
+			return CompoundPredicate(subpredicates, compoundPredicateType)
+
+		# TRUE is the identity of AND and FALSE the identity of OR
+		isAnd = compoundPredicateType == CompoundPredicateType.And
+		flattened = []
+		for predicate in subpredicates:
+			if isinstance(predicate, ValuePredicate):
+				if bool(predicate.value) != isAnd:
+					return Predicate.predicateWithValue(not isAnd)
+			elif isinstance(predicate, CompoundPredicate) and predicate.compoundPredicateType == compoundPredicateType:
+				flattened.extend(predicate.subpredicates)
+			else:
+				flattened.append(predicate)
+
+		if not flattened:
+			return Predicate.predicateWithValue(isAnd)
+		if len(flattened) == 1:
+			return flattened[0]
+		if len(flattened) == len(self.subpredicates) and all(a is b for a, b in zip(flattened, self.subpredicates)):
+			return self
+		return CompoundPredicate(flattened, compoundPredicateType)
+
+	def _collectKeyPaths(self, keyPaths):
+		return all([p._collectKeyPaths(keyPaths) for p in self.subpredicates])
+
+	def _evaluateWithColumnBatch(self, batch):
+		return self._operator.evaluatePredicatesWithColumnBatch(self.subpredicates, batch)
+
+	def _structure(self):
+		return (self.compoundPredicateType,) + self._subpredicates
+
+	def _internSubnodesWithTable(self, table):
+		self._subpredicates = tuple(p._internWithTable(table) for p in self._subpredicates)
+
 	# Getting Representations
 
 	def __str__(self):
 		return '%s' % (
-			self.subpredicates
+			list(self.subpredicates),
 		)
 
 	def __repr__(self):
@@ -220,7 +573,11 @@ class CompoundPredicate(Predicate):
 
 class ValuePredicate(Predicate):
 
+	__slots__ = ('_value',)
+
 	def __init__(self, value):
+		super(ValuePredicate, self).__init__()
+
 		self._value = value
 
 	def predicateWithSubstitutionVariables(self, variables):
@@ -235,6 +592,24 @@ class ValuePredicate(Predicate):
 	def evaluateWithObject(self, obj):
 		return self.value
 
+	def _isConstant(self):
+		return True
+
+	def _collectKeyPaths(self, keyPaths):
+		return True
+
+	def _cost(self):
+		return 0
+
+	def _simplified(self):
+		return Predicate.predicateWithValue(self.value)
+
+	def _evaluateWithColumnBatch(self, batch):
+		return batch.broadcast(bool(self.value), dtype=bool)
+
+	def _structure(self):
+		return (bool(self._value),)
+
 	# Getting Representations
 
 	def __str__(self):
@@ -1,16 +1,54 @@
 # coding=utf-8
 
-import bisect
+import concurrent.futures
+import functools
 import itertools
+import operator
 import urllib.request, urllib.error, urllib.parse
 
-from . import expressions, predicates
+from . import expressions, kvc, predicates
+from .caches import LRUCache
+from .indexes import DiscriminationIndex
+from .network import ConditionNetwork
+from .shadowing import shadowedRulesInModel
 
 DefaultModel = None
 
+_NotFound = object()
+
+_rulePriority = operator.attrgetter('priority')
+
+def _bucketRangeForPriority(bucket, priority):
+	# Returns the start and end of the rules with priority in bucket, which
+	# is sorted by descending priority.
+	lo, hi = 0, len(bucket)
+	while lo < hi:
+		mid = (lo + hi) // 2
+		if bucket[mid].priority > priority:
+			lo = mid + 1
+		else:
+			hi = mid
+	start, hi = lo, len(bucket)
+	while lo < hi:
+		mid = (lo + hi) // 2
+		if bucket[mid].priority >= priority:
+			lo = mid + 1
+		else:
+			hi = mid
+	return start, lo
+
+# Quasi-Enums
+
+class ModelEngineType(object):
+
+	Default = 0         # Each rule evaluates its own compiled specifier
+	Network = 1         # Specifiers share a network of condition nodes
+
 class Rule(object):
-	
-	def __init__(self, specifier, key, value, weight=0):
+
+	__slots__ = ('_specifier', '_key', '_value', '_weight', '_priority')
+
+	def __init__(self, specifier, key, value, weight=0, priority=None):
 		if key is None:
 			raise ValueError('key cannot be None')
 
@@ -28,14 +66,26 @@ class Rule(object):
 		self._weight = weight
 		self._priority = -1
 
-		self._calculatePriority()
+		if priority is None:
+			self._calculatePriority()
+		else:
+			self._priority = priority
 
 	def _ruleWithSubstitutionVariables(self, variables):
 		if variables == None:
 			return self
 
 		specifier = self.specifier.predicateWithSubstitutionVariables(variables)
-		return Rule(specifier, self.key, self.value, weight=self.weight)
+		return Rule(specifier, self.key, self.value, weight=self.weight, priority=self.priority)
+
+	def _simplifiedRule(self):
+		# Returns the rule with its specifier and value simplified, keeping
+		# the priority calculated for the specifier as written
+		specifier = self.specifier._simplified()
+		value = self.value._simplified()
+		if specifier is self.specifier and value is self.value:
+			return self
+		return Rule(specifier, self.key, value, weight=self.weight, priority=self.priority)
 
 	@property
 	def specifier(self):
@@ -75,12 +125,10 @@ class Rule(object):
 		return 0
 
 	def canFireInContext(self, context):
-		return self.specifier.evaluateWithObject(context) if self.specifier else True
+		return self.specifier.compile()(context)
 
 	def fire(self, context):
-		if self.value is None:
-			return None
-		return self.value.expressionValueWithObject(context)
+		return self.value.compile()(context)
 
 	def __str__(self):
 		return '%s %s: %s [%i]' % (
@@ -102,7 +150,7 @@ class Rule(object):
 		if not isinstance(other, self.__class__):
 			return False
 
-		return self.specifier == other.speciifer and \
+		return self.specifier == other.specifier and \
 		       self.key == other.key and \
 		       self.value == other.value and \
 		       self.weight == other.weight
@@ -125,20 +173,54 @@ class Rule(object):
 
 class Model(object):
 	
-	def __init__(self, rules=None, variables=None):
-		self._rules = rules
+	def __init__(self, rules=None, variables=None, engine=ModelEngineType.Default, ruleCacheSize=1024, internTable=None):
+		self._rules = list(rules) if rules is not None else []
+		self._bucketRulePairs = None   # (rule, rule in its bucket or None) for each rule
+		self._ruleEntries = None       # sequence -> such a pair, in the order of the rules
+		self._ruleSequences = None     # id(rule) -> sequences of the rule's entries
+		self._nextRuleSequence = 0
 		self._variables = variables
+		self._internTable = internTable if internTable is not None else {}
+		self._engine = engine
 		self._buckets = {}
+		self._indexes = {}
+		self._network = None
+		self._significantKeyPaths = {}
+		self._bucketGenerations = {}
+		self._generation = 0
+		self._ruleCache = LRUCache(ruleCacheSize) if ruleCacheSize else None
 		self._bucketsAreValid = False
 		self._sortRulesIntoBuckets()
 
 	# Creating Models
 
 	@staticmethod
-	def modelFromFile(path):
+	def modelFromFile(path, cache=False):
+		# With cache, the parsed model is kept in a precompiled file next to the
+		# rule file. Only use it in directories that nobody else can write to.
+		if cache:
+			from .serialization import modelFromFileWithCache
+			return modelFromFileWithCache(path, Model._modelFromString)
+
 		with open(path, 'r') as f:
 			return Model._modelFromFileObj(f)
 
+	@staticmethod
+	def modelFromFiles(paths, workers=None, cache=False):
+		# The files are parsed in worker processes, which send back only their
+		# encoded rules, and the rules are sorted into buckets once, here
+		from .serialization import _encodedRulesFromFile, decodeRules
+
+		paths = list(paths)
+		parse = functools.partial(_encodedRulesFromFile, cache=cache)
+		if workers == 1 or len(paths) < 2:
+			encodedRules = [parse(path) for path in paths]
+		else:
+			with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+				encodedRules = list(executor.map(parse, paths))
+
+		return Model(rules=list(itertools.chain.from_iterable(decodeRules(data) for data in encodedRules)))
+
 	@staticmethod
 	def modelFromURL(url):
 		f = urllib.request.urlopen(url)
@@ -146,73 +228,471 @@ class Model(object):
 
 	@staticmethod
 	def _modelFromFileObj(f):
+		from .scanners import StreamingModelScanner
+
+		# The source is parsed as it is read, one ruleset at a time
+		scanner = StreamingModelScanner(f)
+		return scanner.parseModel()
+
+	@staticmethod
+	def _modelFromString(data):
 		from .scanners import ModelScanner
-		
-		data = f.read()
+
 		scanner = ModelScanner(data)
 		return scanner.parseModel()
 
+	@classmethod
+	def _modelWithBuckets(cls, rules, buckets, variables=None, engine=ModelEngineType.Default, ruleCacheSize=1024):
+		# Creates a model whose rules are already sorted into buckets
+		model = cls(rules=[], variables=variables, engine=engine, ruleCacheSize=ruleCacheSize)
+		model._rules = rules
+		model._bucketRulePairs = None
+		model._ruleEntries = None
+		model._setBuckets(buckets)
+		return model
+
+	# Saving and Loading Precompiled Models
+
+	def save(self, path):
+		from .serialization import writeModel
+		writeModel(self, path)
+
+	@staticmethod
+	def load(path, mapped=False):
+		# A mapped model decodes the rules for a key when they are first needed
+		if mapped:
+			from .serialization import MappedModel
+			return MappedModel(path)
+
+		from .serialization import readModel
+		return readModel(path)
+
 	@property
 	def rules(self):
+		if self._rules is None:
+			self._rules = [rule for rule, _ in self._ruleEntries.values()]
 		return self._rules
 
+	@property
+	def engine(self):
+		return self._engine
+
+	@property
+	def generation(self):
+		# Changes whenever the rules of any bucket change
+		return self._generation
+
 	def _invalidateCaches(self):
 		self._buckets = {}
+		self._indexes = {}
+		self._network = None
+		self._significantKeyPaths = {}
+		self._bucketGenerations = {}
+		if self._ruleCache is not None:
+			self._ruleCache.clear()
+		self._generation += 1
 		self._bucketsAreValid = False
 
+	def _invalidateCachesForKey(self, keyPath):
+		self._indexes.pop(keyPath, None)
+		self._significantKeyPaths.pop(keyPath, None)
+
+		# Rules cached for the key are keyed on the bucket's generation, so
+		# results from before the change are never looked up again
+		self._bucketGenerations[keyPath] = self._bucketGenerations.get(keyPath, 0) + 1
+		self._generation += 1
+
 	def _sortRulesIntoBuckets(self):
 		self._invalidateCaches()
 
-		# If a variables dictionary is specified, go through all the rule
-		# predicates substituting for variables
-		if self._variables != None:
-			rules = [rule._ruleWithSubstitutionVariables(self._variables) for rule in self.rules]
-		else:
-			rules = self.rules
+		# Group the rules by key, then sort each bucket so the most specific
+		# specifiers are first. The sort is stable, so rules with the same
+		# priority keep their order. Rules that can never fire are left out,
+		# but their keys are still inferrable.
+		buckets = {}
+		pairs = []
+		for rule in self.rules:
+			bucket = buckets.get(rule.key)
+			if bucket is None:
+				bucket = buckets[rule.key] = []
+			bucketRule = self._bucketRuleForRule(rule)
+			if bucketRule is not None:
+				bucket.append(bucketRule)
+			pairs.append((rule, bucketRule))
+
+		for bucket in buckets.values():
+			bucket.sort(key=_rulePriority, reverse=True)
+
+		self._setBuckets(buckets)
+		self._bucketRulePairs = pairs
+		self._ruleEntries = None
+
+	def _internRule(self, rule):
+		rule._specifier = rule.specifier._internWithTable(self._internTable)
+		rule._value = rule.value._internWithTable(self._internTable)
+
+	def _setBuckets(self, buckets):
+		self._invalidateCaches()
+		self._buckets = buckets
 
-		# Group the rules by key, sorted by priority
-		for key, group in itertools.groupby(rules, key=lambda x: x.key):
-			if not key in self._buckets:
-				bucket = []
-				self._buckets[key] = bucket
-			else:
-				bucket = self._buckets[key]
+		if self._engine == ModelEngineType.Network:
+			self._network = ConditionNetwork(itertools.chain.from_iterable(self._buckets.values()))
+
+		self._bucketsAreValid = True
 
-			for rule in group:
-				bisect.insort_left(bucket, rule)
+	# Changing Rules
+
+	def _ruleEntriesForChanges(self):
+		# Each of the model's rules is paired with its copy in its bucket, so
+		# rules can be found and removed without a scan. The pairs are only
+		# indexed once rules are changed.
+		if self._ruleEntries is not None:
+			return self._ruleEntries
+
+		pairs = self._bucketRulePairs
+		if pairs is None:
+			# Models loaded with their buckets do not know which rule of a
+			# bucket came from which of the model's rules. A bucket has the
+			# rules for its key that can fire in a stable order of priority,
+			# so it lines up with those rules sorted the same way.
+			rules = self.rules
+			pairs = [(rule, None) for rule in rules]
+			bucketRules = dict((key, iter(bucket)) for key, bucket in self._buckets.items())
+			for i in sorted(range(len(rules)), key=lambda i: rules[i].priority, reverse=True):
+				rule = rules[i]
+				if self._bucketRuleForRule(rule) is not None:
+					pairs[i] = (rule, next(bucketRules[rule.key]))
+
+		self._bucketRulePairs = None
+		self._ruleEntries = dict(enumerate(pairs))
+		self._ruleSequences = {}
+		for sequence, (rule, _) in self._ruleEntries.items():
+			self._ruleSequences.setdefault(id(rule), []).append(sequence)
+		self._nextRuleSequence = len(pairs)
+		return self._ruleEntries
+
+	def addRule(self, rule):
+		# Only the rule's bucket is changed. It is copied, so this takes time
+		# linear in its size.
+		bucketRule = self._bucketRuleForRule(rule)
+		self._addRuleEntry(rule, bucketRule)
+		if bucketRule is not None:
+			self._addRuleToBucket(bucketRule)
+		elif self._bucketForKey(rule.key) is None:
+			self._buckets[rule.key] = []
+
+	def removeRule(self, rule):
+		# Raises ValueError if the model does not have the rule. As with
+		# addRule, this is linear in the size of the rule's bucket.
+		_, bucketRule = self._removeRuleEntry(rule)
+		if bucketRule is not None:
+			self._removeRuleFromBucket(bucketRule)
+
+	def replaceRules(self, oldRules, newRules):
+		for rule in oldRules:
+			self.removeRule(rule)
+		for rule in newRules:
+			self.addRule(rule)
+
+	def _addRuleEntry(self, rule, bucketRule):
+		entries = self._ruleEntriesForChanges()
+		sequence = self._nextRuleSequence
+		self._nextRuleSequence += 1
+		entries[sequence] = (rule, bucketRule)
+		self._ruleSequences.setdefault(id(rule), []).append(sequence)
+		if self._rules is not None:
+			self._rules.append(rule)
+
+	def _removeRuleEntry(self, rule):
+		entries = self._ruleEntriesForChanges()
+
+		# Looking for the rule itself is much cheaper than comparing it with
+		# every rule, so equal rules are only looked for when it is not found
+		sequences = self._ruleSequences.get(id(rule))
+		if sequences is None:
+			for sequence, (other, _) in entries.items():
+				if other == rule:
+					break
+			else:
+				raise ValueError('Model does not have rule %s' % rule)
+			sequences = self._ruleSequences[id(other)]
+			sequence = sequences.pop(sequences.index(sequence))
+			rule = other
+		else:
+			sequence = sequences.pop(0)
+		if not sequences:
+			del self._ruleSequences[id(rule)]
 
-		# Reverse the order of the buckets, so most specific specifiers are first
-		[bucket.reverse() for bucket in list(self._buckets.values())]
+		self._rules = None
+		return entries.pop(sequence)
 
-		self._bucketsAreValid = True
+	def _bucketRuleForRule(self, rule):
+		# Variables are substituted, then the rule is simplified and shares
+		# equal specifiers and values with the other rules. Returns None if
+		# the rule can never fire.
+		if self._variables != None:
+			rule = rule._ruleWithSubstitutionVariables(self._variables)
+		rule = rule._simplifiedRule()
+		if rule.specifier is predicates.FalsePredicate:
+			return None
+		self._internRule(rule)
+		return rule
+
+	def _addRuleToBucket(self, rule):
+		key = rule.key
+		bucket = self._bucketForKey(key) or []
+		_, end = _bucketRangeForPriority(bucket, rule.priority)
+
+		# Buckets are replaced instead of changed in place, so inferences
+		# that are iterating over a bucket are not affected
+		self._buckets[key] = bucket[:end] + [rule] + bucket[end:]
+		if self._network is not None:
+			self._network.addRule(rule)
+		self._invalidateCachesForKey(key)
+
+	def _removeRuleFromBucket(self, rule):
+		key = rule.key
+		bucket = self._bucketForKey(key)
+		start, end = _bucketRangeForPriority(bucket, rule.priority)
+		i = start + operator.indexOf(map(id, itertools.islice(bucket, start, end)), id(rule))
+
+		bucket = bucket[:i] + bucket[i + 1:]
+		if bucket:
+			self._buckets[key] = bucket
+		else:
+			del self._buckets[key]
+		if self._network is not None:
+			self._network.removeRule(rule)
+		self._invalidateCachesForKey(key)
+
+	# Analyzing Rules
+
+	def shadowedRules(self):
+		# Rules that an earlier rule in their bucket always fires before
+		return shadowedRulesInModel(self)
+
+	def removeShadowedRules(self):
+		# Inferred values are unchanged, but fireAllRulesForKeyPathInContext no
+		# longer includes the values of the removed rules
+		shadowedRules = self.shadowedRules()
+		shadowed = set(id(shadowedRule.rule) for shadowedRule in shadowedRules)
+		if not shadowed:
+			return shadowedRules
+
+		# The shadowed rules are copies in buckets, found through the rules
+		# they were made from in one pass over the model's rules
+		entries = self._ruleEntriesForChanges()
+		keys = set()
+		for sequence, (rule, bucketRule) in list(entries.items()):
+			if bucketRule is None or id(bucketRule) not in shadowed:
+				continue
+			del entries[sequence]
+			sequences = self._ruleSequences[id(rule)]
+			sequences.remove(sequence)
+			if not sequences:
+				del self._ruleSequences[id(rule)]
+			if self._network is not None:
+				self._network.removeRule(bucketRule)
+			keys.add(rule.key)
+
+		for key in keys:
+			self._buckets[key] = [rule for rule in self._bucketForKey(key) if id(rule) not in shadowed]
+			self._invalidateCachesForKey(key)
+
+		self._rules = None
+		return shadowedRules
 
 	@property
 	def inferrableKeys(self):
 		return list(self._buckets.keys())
 
-	def candidates(self, keyPath, context):
+	def _bucketForKey(self, keyPath):
 		return self._buckets.get(keyPath)
 
-	def fireRuleForKeyPathInContext(self, keyPath, context):
-		candidates = self.candidates(keyPath, context)
-		if not candidates:
+	def candidates(self, keyPath, context):
+		index = self._indexes.get(keyPath)
+		if index is None:
+			bucket = self._bucketForKey(keyPath)
+			if not bucket:
+				return bucket
+			index = self._indexes[keyPath] = DiscriminationIndex(bucket)
+		return index.candidatesInContext(context)
+
+	def _rulesThatCanFire(self, candidates, context):
+		if self._network is not None:
+			return self._network.rulesThatCanFire(candidates, context)
+		return (rule for rule in candidates if rule.canFireInContext(context))
+
+	def significantKeyPaths(self, keyPath):
+		# None if some specifier depends on more than key paths
+		significantKeyPaths = self._significantKeyPathsForKey(keyPath)
+		return significantKeyPaths[0] if significantKeyPaths is not None else None
+
+	def _significantKeyPathsForKey(self, keyPath):
+		# The sorted key paths, and the kvc.KeyPaths that read them
+		significantKeyPaths = self._significantKeyPaths.get(keyPath, _NotFound)
+		if significantKeyPaths is _NotFound:
+			keyPaths = set()
+			for rule in self._bucketForKey(keyPath) or ():
+				if not rule.specifier._collectKeyPaths(keyPaths):
+					keyPaths = None
+					break
+			if keyPaths is not None:
+				keyPaths = tuple(sorted(keyPaths))
+				significantKeyPaths = (keyPaths, tuple(kvc.KeyPath.keyPathWithString(k) for k in keyPaths))
+			else:
+				significantKeyPaths = None
+			self._significantKeyPaths[keyPath] = significantKeyPaths
+		return significantKeyPaths
+
+	def _ruleCacheKey(self, keyPath, context):
+		significantKeyPaths = self._significantKeyPathsForKey(keyPath)
+		if significantKeyPaths is None:
+			return None
+
+		# Only values the context already holds are read, so looking up the
+		# cache never infers a key the rules in priority order would not reach
+		hasLocalValueForKey = getattr(context, 'hasLocalValueForKey', None)
+
+		# Values of different types may compare equal (1, 1.0 and True), but
+		# can still behave differently in a specifier.
+		values = []
+		for significantKeyPath in significantKeyPaths[1]:
+			if hasLocalValueForKey is not None:
+				key = significantKeyPath.keys[0]
+				if not hasLocalValueForKey(key) and self._bucketForKey(key) is not None:
+					return None
+			value = significantKeyPath.valueWithObject(context)
+			values.append(value.__class__)
+			values.append(value)
+		cacheKey = (keyPath, self._bucketGenerations.get(keyPath, 0), tuple(values))
+
+		try:
+			hash(cacheKey)
+		except TypeError:
 			return None
+		return cacheKey
+
+	def ruleForKeyPathInContext(self, keyPath, context):
+		# Rules are shared across contexts through a cache keyed on the values
+		# of the key's significant key paths
+		cacheKey = self._ruleCacheKey(keyPath, context) if self._ruleCache is not None else None
+		if cacheKey is not None:
+			rule = self._ruleCache.get(cacheKey, _NotFound)
+			if rule is not _NotFound:
+				return rule
+
+		rule = None
+		candidates = self.candidates(keyPath, context)
+		if candidates:
+			rule = next(self._rulesThatCanFire(candidates, context), None)
 
-		for rule in candidates:
-			if rule.canFireInContext(context):
-				return rule.fire(context)
+		if cacheKey is not None:
+			self._ruleCache[cacheKey] = rule
+		return rule
 
-		return None
+	def fireRuleForKeyPathInContext(self, keyPath, context):
+		rule = self.ruleForKeyPathInContext(keyPath, context)
+		if rule is None:
+			return None
+		return rule.fire(context)
 
 	def fireAllRulesForKeyPathInContext(self, keyPath, context):
 		candidates = self.candidates(keyPath, context)
 		if not candidates:
-			return null
+			return []
 
-		candidates = [rule for rule in candidates if rule.canFireInContext(context)]
+		candidates = list(self._rulesThatCanFire(candidates, context))
 		
 		return [rule.fire(context) for rule in candidates]
 
+	def rulesForKeyPathInContexts(self, keyPath, contexts):
+		# Each rule is tested against all unresolved contexts before the next,
+		# so the per rule overhead is paid once per batch
+		contexts = list(contexts)
+		rules = [None] * len(contexts)
+		bucket = self._bucketForKey(keyPath)
+		if not bucket:
+			return rules
+
+		# Contexts whose significant values have been seen before are
+		# resolved by the rule cache.
+		remaining = []
+		cacheKeys = [None] * len(contexts)
+		for i, context in enumerate(contexts):
+			if self._ruleCache is not None:
+				cacheKeys[i] = cacheKey = self._ruleCacheKey(keyPath, context)
+				if cacheKey is not None:
+					rule = self._ruleCache.get(cacheKey, _NotFound)
+					if rule is not _NotFound:
+						rules[i] = rule
+						continue
+			remaining.append(i)
+
+		network = self._network
+		if network is not None:
+			memos = [network.memoForContext(context) for context in contexts]
+
+		for rule in bucket:
+			if not remaining:
+				break
+
+			unresolved = []
+			if network is not None:
+				for i in remaining:
+					if network.canFireInContext(rule, contexts[i], memos[i]):
+						rules[i] = rule
+					else:
+						unresolved.append(i)
+			else:
+				canFire = rule.specifier.compile()
+				for i in remaining:
+					if canFire(contexts[i]):
+						rules[i] = rule
+					else:
+						unresolved.append(i)
+			remaining = unresolved
+
+		for i, cacheKey in enumerate(cacheKeys):
+			if cacheKey is not None:
+				self._ruleCache[cacheKey] = rules[i]
+
+		return rules
+
+	def fireRuleForKeyPathInContexts(self, keyPath, contexts):
+		contexts = list(contexts)
+		rules = self.rulesForKeyPathInContexts(keyPath, contexts)
+		return [rule.fire(context) if rule is not None else None for rule, context in zip(rules, contexts)]
+
+	def fireRuleForKeyPathWithColumns(self, keyPath, columns):
+		# Returns an object array with the value for every row
+		from .columns import ColumnBatch, requireNumpy
+
+		batch = ColumnBatch.batchWithColumns(columns)
+		results = batch.broadcast(None)
+		bucket = self._bucketForKey(keyPath)
+		if not bucket:
+			return results
+
+		numpy = requireNumpy()
+		rows = numpy.arange(batch.count)
+		remaining = batch
+		for rule in bucket:
+			if not len(rows):
+				break
+
+			mask = rule.specifier.evaluateWithColumns(remaining)
+			if not mask.any():
+				continue
+
+			fired = batch.subset(rows[mask])
+			results[rows[mask]] = fired.broadcast(rule.value.expressionValuesWithColumns(fired))
+
+			rows = rows[numpy.logical_not(mask)]
+			remaining = batch.subset(rows)
+
+		return results
+
 	def __str__(self):
 		return '%s' % (
 			self.rules
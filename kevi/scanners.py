@@ -1,14 +1,21 @@
 # coding=utf-8
 
+import bisect
+import codecs
 import itertools
-import string
+import re
+import sys
 
-from . import characters
+from . import characters, tokenizer
 from .expressions import Expression
 from .predicates import ComparisonPredicateModifier, ComparisonPredicateType, ComparisonPredicateOptions
 from .predicates import CompoundPredicateType
 from .predicates import Predicate, ComparisonPredicate, CompoundPredicate
 from .rules import Rule, Model
+from .tokenizer import TokenType, tokenize
+
+_NumberPattern = re.compile(r'[-+]?(?:%s)' % tokenizer.NumberPattern)
+_IntegerPattern = re.compile(r'[-+]?(?:%s|[0-9]+)' % tokenizer.HexadecimalNumberPattern)
 
 
 class Scanner(object):
@@ -18,6 +25,7 @@ class Scanner(object):
 		self._scanLocation = 0
 		self._charactersToBeSkipped = characters.ScannerCharactersToBeSkippedCharacterSet
 		self._caseSensitive = False
+		self._lowercaseString = None
 
 	# Getting a Scanner's String
 
@@ -55,7 +63,7 @@ class Scanner(object):
 	def charactersToBeSkipped(self, value):
 		self._charactersToBeSkipped = value
 
-	# Scanning a String	
+	# Scanning a String
 
 	def scanCharactersFromSet(self, scanSet):
 		return self._scanWithSet(scanSet, False)
@@ -69,25 +77,22 @@ class Scanner(object):
 
 		self._movePastCharactersToBeSkipped()
 
-		current = self.scanLocation
-		result = None
-
-		while current < len(self.string):
-			c = self.string[current]
-
-			if (c in scanSet) == stop:
-				break
-
-			if not c in self._charactersToBeSkipped:
-				if result is None:
-					result = ''
-				result += c
+		string = self.string
+		length = len(string)
+		start = current = self.scanLocation
 
+		while current < length and (string[current] in scanSet) != stop:
 			current += 1
 
-		if result:
-			self.scanLocation = current
+		result = string[start:current]
+		toSkip = self._charactersToBeSkipped
+		if toSkip and not toSkip.isdisjoint(result):
+			result = ''.join(c for c in result if c not in toSkip)
 
+		if not result:
+			return None
+
+		self.scanLocation = current
 		return result
 
 	def _movePastCharactersToBeSkipped(self):
@@ -111,66 +116,66 @@ class Scanner(object):
 		if self.atEnd:
 			return None
 
-		currentStr = self.string[self.scanLocation:self.scanLocation + len(s)]
-		if (self.caseSensitive and currentStr != s) or (not self.caseSensitive and (currentStr.lower() != s.lower())):
-			return None
+		location = self.scanLocation
+		if self.caseSensitive:
+			matches = self.string.startswith(s, location)
 		else:
-			self.scanLocation += len(s)
-			return s
+			matches = self.string[location:location + len(s)].lower() == s.lower()
+
+		if not matches:
+			return None
+
+		self.scanLocation += len(s)
+		return s
 
 	def scanUpToString(self, s):
 		current = self.scanLocation
 		string = self.string
-		captured = None
-
-		while current < len(string):
-			currentStr = string[current:current + len(s)]
-			if currentStr == s or (not self.caseSensitive and currentStr.lower() == s.lower()):
-				break
-
-			if not captured:
-				captured = ''
-			captured += string[current]
-			current += 1
-
-		if captured:
-			self.scanLocation = current
 
-		if self.charactersToBeSkipped:
-			pass
-			# trim charactersToBeSkipped from beginning of captured
+		if self.caseSensitive:
+			index = string.find(s, current)
+		else:
+			# Lowercasing may change the length of some strings, in which
+			# case offsets into the lowercased string are meaningless.
+			if self._lowercaseString is None:
+				lowercaseString = string.lower()
+				self._lowercaseString = lowercaseString if len(lowercaseString) == len(string) else False
+			if self._lowercaseString:
+				index = self._lowercaseString.find(s.lower(), current)
+			else:
+				index = current
+				while index < len(string) and string[index:index + len(s)].lower() != s.lower():
+					index += 1
+		if index == -1:
+			index = len(string)
+
+		captured = string[current:index]
+		if not captured:
+			return None
 
+		self.scanLocation = index
 		return captured
 
-	def scanWithParseFunction(self, func):
+	def _scanWithPattern(self, pattern):
 		self._movePastCharactersToBeSkipped()
-		string = self.string
-		loc = self.scanLocation
-
-		f = None
-		i = 0
-
-		if self.atEnd:
-			return f
-			
-		while loc + i + 1 <= len(string):
-			try:
-				f = func(string[loc:loc + i + 1])
-			except ValueError:
-				break
-			i += 1
+		match = pattern.match(self.string, self.scanLocation)
+		if match is None:
+			return None
 
-		self.scanLocation = loc + i
+		self.scanLocation = match.end()
+		return tokenizer.numberValue(match.group())
 
-		return f
+	def scanNumber(self):
+		# Decimal with an optional fraction and exponent, or hexadecimal with a
+		# 0x prefix. An int unless there is a fraction or an exponent.
+		return self._scanWithPattern(_NumberPattern)
 
 	def scanFloat(self):
-		import builtins
-		return self.scanWithParseFunction(builtins.float)
+		value = self.scanNumber()
+		return float(value) if value is not None else None
 
 	def scanInt(self):
-		import builtins
-		return self.scanWithParseFunction(builtins.int)
+		return self._scanWithPattern(_IntegerPattern)
 
 	def isAtEnd(self):
 		location = self.scanLocation
@@ -181,45 +186,160 @@ class Scanner(object):
 	atEnd = property(isAtEnd)
 
 
+_ConstantValueKeywords = {
+	'NULL': None,
+	'NIL': None,
+	'TRUE': True,
+	'YES': True,
+	'FALSE': False,
+	'NO': False
+}
+
+_CompoundPredicateKeywords = {
+	'AND': CompoundPredicateType.And,
+	'&&': CompoundPredicateType.And,
+	'OR': CompoundPredicateType.Or,
+	'||': CompoundPredicateType.Or
+}
+
+_ComparisonPredicateModifierKeywords = {
+	'ANY': (ComparisonPredicateModifier.Any, False),
+	'ALL': (ComparisonPredicateModifier.All, False),
+	'NONE': (ComparisonPredicateModifier.Any, True),
+	'SOME': (ComparisonPredicateModifier.All, True)
+}
+
+_ComparisonPredicateTypeKeywords = {
+	'<=': ComparisonPredicateType.LessThanOrEqual,
+	'=<': ComparisonPredicateType.LessThanOrEqual,
+	'>=': ComparisonPredicateType.GreaterThanOrEqual,
+	'=>': ComparisonPredicateType.GreaterThanOrEqual,
+	'==': ComparisonPredicateType.EqualTo,
+	'!=': ComparisonPredicateType.NotEqualTo,
+	'<>': ComparisonPredicateType.NotEqualTo,
+	'<': ComparisonPredicateType.LessThan,
+	'>': ComparisonPredicateType.GreaterThan,
+	'=': ComparisonPredicateType.EqualTo,
+	'MATCHES': ComparisonPredicateType.Matches,
+	'LIKE': ComparisonPredicateType.Like,
+	'BEGINSWITH': ComparisonPredicateType.BeginsWith,
+	'ENDSWITH': ComparisonPredicateType.EndsWith,
+	'IN': ComparisonPredicateType.In,
+	'CONTAINS': ComparisonPredicateType.Contains,
+	'BETWEEN': ComparisonPredicateType.Between
+}
+
+_ComparisonPredicateOptionKeywords = {
+	'cd': ComparisonPredicateOptions.CaseInsensitive | ComparisonPredicateOptions.DiacriticInsensitive,
+	'c': ComparisonPredicateOptions.CaseInsensitive,
+	'd': ComparisonPredicateOptions.DiacriticInsensitive
+}
+
+
+# The string is tokenized up front, so scanString matches whole tokens
 class ExpressionScanner(Scanner):
 
 	def __init__(self, string):
 		super(ExpressionScanner, self).__init__(string)
-		self._lineNumber = 1
-		self._maxScanLocation = 0
+		self._tokens = tokenize(string)
+		self._tokenIndex = 0
+		self._tokenStarts = None
 
 	@property
 	def lineNumber(self):
-		return self._lineNumber
+		return self._tokens[self._tokenIndex].line
 
-	def _movePastCharactersToBeSkipped(self):
-		loc1 = self.scanLocation
-		super(ExpressionScanner, self)._movePastCharactersToBeSkipped()
-		loc2 = self.scanLocation
+	# Scanning Tokens
 
-		loc1 = max(loc1, self._maxScanLocation)
-		loc2 = max(loc2, self._maxScanLocation)
-		if loc2 > loc1:
-			self._lineNumber += self.string[loc1:loc2].count('\n')
-		if loc2 > self._maxScanLocation:
-			self._maxScanLocation = loc2
+	@property
+	def scanLocation(self):
+		if self._tokenIndex == 0:
+			return 0
+		return self._tokens[self._tokenIndex - 1].end
+
+	@scanLocation.setter
+	def scanLocation(self, location):
+		# Move to the first token at or after location
+		if self._tokenStarts is None:
+			self._tokenStarts = [token.start for token in self._tokens]
+		self._tokenIndex = min(bisect.bisect_left(self._tokenStarts, location), len(self._tokens) - 1)
+
+	def isAtEnd(self):
+		return self._tokens[self._tokenIndex].type == TokenType.End
+	atEnd = property(isAtEnd)
+
+	def _nextToken(self):
+		return self._tokens[self._tokenIndex]
+
+	def _keywordForToken(self, token):
+		if token.type == TokenType.Identifier:
+			return token.text.upper()
+		if token.type == TokenType.Operator:
+			return token.text
+		return None
+
+	def scanString(self, s):
+		token = self._tokens[self._tokenIndex]
+		if token.type == TokenType.End:
+			return None
+
+		text = token.text
+		if text != s:
+			if token.type != TokenType.Identifier or len(text) != len(s) or \
+			   self._caseSensitive or text.upper() != s.upper():
+				return None
+
+		self._tokenIndex += 1
+		return s
+
+	def _scanKeyword(self, keywords):
+		# Looks the next token up in a dictionary of keywords, consuming it
+		# and returning its value if found.
+		token = self._tokens[self._tokenIndex]
+		keyword = self._keywordForToken(token)
+		if keyword is None or keyword not in keywords:
+			return None
+
+		self._tokenIndex += 1
+		return keywords[keyword]
+
+	# Parsing Expressions
 
 	def parseExpression(self):
 		return self.parseBinaryExpression()
 
 	def parseIdentifierExpression(self):
 		self.scanString('#')
-		ident = self.scanCharactersFromSet(characters.IdentifierExpressionCharacterSet)
-		if not ident:
-			raise ValueError('Missing identifier: %s' % self.string[self.scanLocation:])
-		return Expression.expressionForKeyPath(ident)
+		token = self._tokens[self._tokenIndex]
+		if token.type != TokenType.Identifier:
+			raise ValueError('Missing identifier: %s' % self.string[token.start:])
+		self._tokenIndex += 1
+		return Expression.expressionForKeyPath(token.text)
 
 	def parseSimpleExpression(self):
-		dbl = self.scanFloat()
-		if dbl is not None:
-			return Expression.expressionForConstantValue(dbl)
+		token = self._tokens[self._tokenIndex]
+		if token.type == TokenType.Number or token.type == TokenType.String:
+			self._tokenIndex += 1
+			return Expression.expressionForConstantValue(token.value)
+		if token.type == TokenType.Invalid and token.text in '"\'':
+			raise ValueError('Invalid %s literal at %i' % ('double quoted' if token.text == '"' else 'single quoted', token.start))
+		if token.type == TokenType.Identifier:
+			keyword = token.text.upper()
+			if keyword in _ConstantValueKeywords:
+				self._tokenIndex += 1
+				return Expression.expressionForConstantValue(_ConstantValueKeywords[keyword])
+			if keyword == 'SELF':
+				self._tokenIndex += 1
+				return Expression.expressionForEvaluatedObject()
+
+		if token.type == TokenType.Operator and token.text in ('-', '+'):
+			# A sign directly before a number is part of the number
+			nextToken = self._tokens[self._tokenIndex + 1]
+			if nextToken.type == TokenType.Number and nextToken.start == token.end:
+				self._tokenIndex += 2
+				return Expression.expressionForConstantValue(-nextToken.value if token.text == '-' else nextToken.value)
 		if self.scanString('-'):
-			return Expression.expressionForFunction('_chs', parameters=[self.parseExpression()])
+			return Expression.expressionForFunction('chs', parameters=[self.parseExpression()])
 		if self.scanString('('):
 			arg = self.parseExpression()
 			if not self.scanString(')'):
@@ -236,59 +356,13 @@ class ExpressionScanner(Scanner):
 			if not self.scanString('}'):
 				raise ValueError('Missing } in aggregate')
 			return Expression.expressionForAggregate(a)
-		if self.scanString('NULL') or self.scanString('NIL'):
-			return Expression.expressionForConstantValue(None)
-		if self.scanString('TRUE') or self.scanString('YES'):
-			return Expression.expressionForConstantValue(True)
-		if self.scanString('FALSE') or self.scanString('NO'):
-			return Expression.expressionForConstantValue(False)
-		if self.scanString('SELF'):
-			return Expression.expressionForEvaluatedObject()
 		if self.scanString('$'):
 			var = self.parseIdentifierExpression()
 			if not var.keyPath:
 				raise ValueError('Invalid variable identifier: %s' % var)
 			return Expression.expressionForVariable(var.keyPath)
-
-		location = self.scanLocation
 		if self.scanString('%'):
-			if not self.atEnd:
-				c = self.string[location]
-				if c == '%':
-					location = self.scanLocation
-				elif c == 'K':
-					self.scanLocation += 1
-					return Expression.expressionForKeyPath(self.nextArg())
-				elif c in '@cCdDioOuUxXeEfgG':
-					self.scanLocation += 1
-					return Expression.expressionForConstantValue(self.nextArg())
-				elif c == 'h':
-					self.scanString('h')
-					if not self.atEnd:
-						c = self.string[self.scanLocation]
-						if c in 'iu':
-							self.scanLocation += 1
-							return Expression.expressionForConstantValue(self.nextArg())
-				elif c == 'q':
-					self.scanString('q')
-					if not self.atEnd:
-						c = self.string[self.scanLocation]
-						if c in 'iuxX':
-							self.scanLocation += 1
-							return Expression.expressionForConstantValue(self.nextArg())
-			self.scanLocation = location
-
-		for q, q_name in (('"', 'double quoted'), ("'", 'single quoted')):
-			if self.scanString(q):
-				skip = self.charactersToBeSkipped
-				self.charactersToBeSkipped = None
-				scanned = self.scanUpToString(q)
-				if not scanned:
-					self.charactersToBeSkipped = skip
-					raise ValueError('Invalid %s literal at %i' % (q_name, location))
-				self.charactersToBeSkipped = skip
-				self.scanString(q)
-				return Expression.expressionForConstantValue(scanned)
+			raise ValueError('Format specifiers are not supported: %s' % self.string[token.start:])
 		if self.scanString('@'):
 			e = self.parseIdentifierExpression()
 			if not e.keyPath:
@@ -307,8 +381,8 @@ class ExpressionScanner(Scanner):
 				# function expression
 				if not left.keyPath:
 					raise ValueError('Invalid function identifier: %s' % left)
+				args = []
 				if not self.scanString(')'):
-					args = []
 					args.append(self.parseExpression())
 					while self.scanString(','):
 						args.append(self.parseExpression())
@@ -387,22 +461,10 @@ class ExpressionScanner(Scanner):
 class PredicateScanner(ExpressionScanner):
 
 	def scanPredicateKeyword(self, key):
-		loc = self.scanLocation
+		# Keywords are whole tokens, so a keyword never matches the start of
+		# a longer identifier.
 		self.caseSensitive = False
-
-		if not self.scanString(key):
-			return False
-		if self.atEnd:
-			return True
-
-		# Does the next character still belong to the token?
-		c = self.string[self.scanLocation]
-		if not (c in string.ascii_letters or c in string.digits):
-			return True
-
-		# Back up, no match
-		self.scanLocation = loc
-		return False
+		return self.scanString(key) is not None
 
 	def parsePredicate(self):
 		return self.parseConjunction()
@@ -410,39 +472,25 @@ class PredicateScanner(ExpressionScanner):
 	def parseConjunction(self):
 		l = self.parseNot()
 
-		predicate_type_container = [-1,]
-		def hasKeyword():
-			for keyword, predicate_type_i in (
-				('AND', CompoundPredicateType.And),
-				('&&', CompoundPredicateType.And),
-				('OR', CompoundPredicateType.Or),
-				('||', CompoundPredicateType.Or),
-				('', -1)
-			):
-				if self.scanPredicateKeyword(keyword):
-					predicate_type_container[0] = predicate_type_i
-					return True
-				if not keyword:
-					return False
-
-		while hasKeyword():
-			predicate_type = predicate_type_container[0]
+		while True:
+			predicate_type = self._scanKeyword(_CompoundPredicateKeywords)
+			if predicate_type is None:
+				return l
+
 			r = self.parseNot()
 
 			if isinstance(r, CompoundPredicate) and r.compoundPredicateType == predicate_type:
 				if isinstance(l, CompoundPredicate) and l.compoundPredicateType == predicate_type:
 					subpredicates = l.subpredicates + r.subpredicates
 				else:
-					subpredicates = r.subpredicates + [l]
+					subpredicates = r.subpredicates + (l,)
 			elif isinstance(l, CompoundPredicate) and l.compoundPredicateType == predicate_type:
-				subpredicates = l.subpredicates + [r]
+				subpredicates = l.subpredicates + (r,)
 			else:
-				subpredicates = [l, r]
+				subpredicates = (l, r)
 
 			l = CompoundPredicate(subpredicates, type=predicate_type)
 
-		return l
-
 	def parseNot(self):
 		if self.scanString('('):
 			r = self.parsePredicate()
@@ -453,62 +501,24 @@ class PredicateScanner(ExpressionScanner):
 		if self.scanPredicateKeyword('NOT') or self.scanPredicateKeyword('!'):
 			return CompoundPredicate((self.parseNot(),), type=CompoundPredicateType.Not)
 
-		for keyword, value in (
-			('TRUEPREDICATE', True),
-			('FALSEPREDICATE', False)
-		):
-			if self.scanPredicateKeyword(keyword):
-				return Predicate.predicateWithValue(value)
-		
+		if self.scanPredicateKeyword('TRUEPREDICATE'):
+			return Predicate.predicateWithValue(True)
+		if self.scanPredicateKeyword('FALSEPREDICATE'):
+			return Predicate.predicateWithValue(False)
+
 		return self.parseComparison()
 
 	def parseComparison(self):
-		for keyword, predicate_modifier, negate in (
-			('ANY', ComparisonPredicateModifier.Any, False),
-			('ALL', ComparisonPredicateModifier.All, False),
-			('NONE', ComparisonPredicateModifier.Any, True),
-			('SOME', ComparisonPredicateModifier.All, True),
-			('', ComparisonPredicateModifier.Direct, False)
-		):
-			if not keyword or self.scanPredicateKeyword(keyword):
-				break
+		predicate_modifier, negate = self._scanKeyword(_ComparisonPredicateModifierKeywords) or \
+			(ComparisonPredicateModifier.Direct, False)
 
 		left = self.parseExpression()
 
-		for keyword, predicate_type in (
-			('<=', ComparisonPredicateType.LessThanOrEqual),
-			('=<', ComparisonPredicateType.LessThanOrEqual),
-			('>=', ComparisonPredicateType.GreaterThanOrEqual),
-			('=>', ComparisonPredicateType.GreaterThanOrEqual),
-			('==', ComparisonPredicateType.EqualTo),
-			('!=', ComparisonPredicateType.NotEqualTo),
-			('<>', ComparisonPredicateType.NotEqualTo),
-			('<', ComparisonPredicateType.LessThan),
-			('>', ComparisonPredicateType.GreaterThan),
-			('=', ComparisonPredicateType.EqualTo),
-			('MATCHES', ComparisonPredicateType.Matches),
-			('LIKE', ComparisonPredicateType.Like),
-			('BEGINSWITH', ComparisonPredicateType.BeginsWith),
-			('ENDSWITH', ComparisonPredicateType.EndsWith),
-			('IN', ComparisonPredicateType.In),
-			('CONTAINS', ComparisonPredicateType.Contains),
-			('BETWEEN', ComparisonPredicateType.Between),
-			('', 99)
-		):
-			if not keyword or self.scanPredicateKeyword(keyword):
-				break
-		
-		if predicate_type == 99:
-			raise ValueError('Invalid comparison predicate: %s' % self.string[self.scanLocation:])
-
-		for opt_string, options in (
-			('[cd]', ComparisonPredicateOptions.CaseInsensitive | ComparisonPredicateOptions.DiacriticInsensitive),
-			('[c]', ComparisonPredicateOptions.CaseInsensitive),
-			('[d]', ComparisonPredicateOptions.DiacriticInsensitive),
-			('', 0)
-		):
-			if not opt_string or self.scanString(opt_string):
-				break
+		predicate_type = self._scanKeyword(_ComparisonPredicateTypeKeywords)
+		if predicate_type is None:
+			raise ValueError('Invalid comparison predicate: %s' % self.string[self._nextToken().start:])
+
+		options = self._scanComparisonPredicateOptions()
 
 		right = self.parseExpression()
 
@@ -518,10 +528,34 @@ class PredicateScanner(ExpressionScanner):
 
 		return predicate
 
+	def _scanComparisonPredicateOptions(self):
+		# Options are written as [c], [d] or [cd] right after the operator
+		tokens = self._tokens
+		i = self._tokenIndex
+		if tokens[i].text != '[' or i + 2 >= len(tokens) or tokens[i + 2].text != ']':
+			return 0
+
+		options = _ComparisonPredicateOptionKeywords.get(tokens[i + 1].text.lower())
+		if options is None:
+			return 0
+
+		self._tokenIndex += 3
+		return options
+
 
 class ModelScanner(PredicateScanner):
 
+	def __init__(self, string, internTable=None):
+		super(ModelScanner, self).__init__(string)
+
+		# Equal predicates and expressions throughout the model are parsed
+		# into one shared instance
+		self._internTable = internTable if internTable is not None else {}
+
 	def parseModel(self):
+		return Model(rules=self.parseRules(), internTable=self._internTable)
+
+	def parseRules(self):
 		rules = []
 		expect_more = True
 		while expect_more:
@@ -529,14 +563,13 @@ class ModelScanner(PredicateScanner):
 				rules.extend(self.parseRuleset())
 			except:
 				expect_more = False
-		model = Model(rules=rules)
 		if not self.atEnd:
 			raise ValueError('Failed to parse past line %i' % self.lineNumber)
-		return model
+		return rules
 
 	def parseRuleset(self, parent_specifiers=None):
 		# Scan the specifiers (one or more Predicates)
-		specifiers = self.parseSpecifierFormats()
+		specifiers = self.parseSpecifiers()
 		if not specifiers:
 			raise ValueError('Expected specifier')
 
@@ -544,61 +577,73 @@ class ModelScanner(PredicateScanner):
 		# the local specifiers should be compounded with each parent
 		# specifier with an AND.
 		if parent_specifiers:
-			specifiers = [' AND '.join(str(s) for s in spec) \
-				for spec in itertools.product(parent_specifiers, specifiers)]
+			specifiers = [self._andSpecifiers(parent, specifier) \
+				for parent, specifier in itertools.product(parent_specifiers, specifiers)]
 
 		# Expecting opening {
 		if not self.scanString('{'):
 			raise ValueError('Expected { after specifiers: %s' % specifiers)
-		
+
 		# Scan 0 or more declarations and nested rulesets
 		declarations = []
 		nested_rules = []
 		expect_more = True
 		while (expect_more):
 			try:
-				mark = self.scanLocation
+				mark = self._tokenIndex
 				declarations.append(self.parseDeclaration())
 				if not self.scanString(';'):
 					expect_more = False
 			except ValueError as declaration_e:
-				self.scanLocation = mark
+				self._tokenIndex = mark
 				try:
 					nested_rules.extend(self.parseRuleset(parent_specifiers=specifiers))
 				except ValueError as e:
-
+					self._tokenIndex = mark
 					expect_more = False
 
 		# Expecting closing }
 		if not self.scanString('}'):
 			raise ValueError('Expected to find }')
 
-		# For each specifier and declaration, create a rule
-		rules = [Rule(Predicate.predicateWithFormat(spec), decl[0], decl[1]) \
+		# For each specifier and declaration, create a rule. The rules of a
+		# specifier share its Predicate instance.
+		rules = [Rule(spec, decl[0], decl[1]) \
 			for spec, decl in itertools.product(specifiers, declarations)]
 		rules.extend(nested_rules)
 
 		return rules
 
-	def parseSpecifierFormats(self):
+	def parseSpecifiers(self):
 		specifiers = []
 		expect_more = True
 
 		while expect_more:
-			mark = self.scanLocation
+			mark = self._tokenIndex
 			try:
 				predicate = self.parsePredicate()
 			except ValueError as e:
+				self._tokenIndex = mark
 				return None
-			predicateFormat = self.string[mark:self.scanLocation]
-			predicateFormat = predicateFormat.strip(''.join(self.charactersToBeSkipped))
-			specifiers.append(predicateFormat)
+			specifiers.append(predicate._internWithTable(self._internTable))
 			expect_more = self.scanString(',') is not None
-		
+
 		return specifiers
 
+	def _andSpecifiers(self, parent, specifier):
+		# Nested AND specifiers are flattened into one conjunction, the
+		# parent's terms first, as if the specifiers had been written out
+		# joined with AND.
+		subpredicates = []
+		for predicate in (parent, specifier):
+			if isinstance(predicate, CompoundPredicate) and predicate.compoundPredicateType == CompoundPredicateType.And:
+				subpredicates.extend(predicate.subpredicates)
+			else:
+				subpredicates.append(predicate)
+		return Predicate.andPredicateWithSubpredicates(subpredicates)._internWithTable(self._internTable)
+
 	def parseDeclaration(self):
-		key = self.scanCharactersFromSet(characters.PropertyKeyCharacterSet)
+		key = self._scanPropertyKey()
 		if not key:
 			raise ValueError('Could not scan property key')
 		if not self.scanString(':'):
@@ -606,5 +651,122 @@ class ModelScanner(PredicateScanner):
 		expr = self.parseExpression()
 		if not expr:
 			raise ValueError('Could not parse expression value for key: %s' % key)
-		return (key, expr)
+		return (key, expr._internWithTable(self._internTable))
+
+	def _scanPropertyKey(self):
+		# Property keys may contain '-', so a key is made of adjacent tokens
+		# that consist of property key characters only.
+		tokens = self._tokens
+		i = start = self._tokenIndex
+		end = tokens[i].start
+
+		while tokens[i].type != TokenType.End and tokens[i].start == end and \
+		      characters.PropertyKeyCharacterSet.issuperset(tokens[i].text):
+			end = tokens[i].end
+			i += 1
+
+		if i == start:
+			return None
+
+		self._tokenIndex = i
+		return sys.intern(self.string[tokens[start].start:end])
+
+
+# Yields the rules of each top level ruleset once it is closed. Only the
+# text after the last closed ruleset is kept, unless a quote or brace is
+# left open.
+class StreamingModelScanner(object):
+
+	DefaultChunkSize = 64 * 1024
+
+	def __init__(self, fileObj, chunkSize=DefaultChunkSize):
+		self._fileObj = fileObj
+		self._chunkSize = chunkSize
+		self._lineNumber = 1
+		self._internTable = {}
+
+	@property
+	def lineNumber(self):
+		# Where the text that is still to be parsed starts
+		return self._lineNumber
+
+	def parseModel(self):
+		return Model(rules=list(self.parseRules()), internTable=self._internTable)
 
+	def parseRules(self):
+		buffer = ''
+		decoder = None
+		depth = 0
+
+		while True:
+			chunk = self._fileObj.read(self._chunkSize)
+			if not chunk:
+				break
+			if isinstance(chunk, bytes):
+				# A character may be split between chunks
+				if decoder is None:
+					decoder = codecs.getincrementaldecoder('utf-8')()
+				chunk = decoder.decode(chunk)
+			buffer += chunk
+
+			# A top level ruleset can only have been closed by a } in this
+			# chunk. Braces in strings make the count wrong, which only
+			# delays parsing until a later chunk, or the end.
+			depth += chunk.count('{') - chunk.count('}')
+			if depth > 0 or not '}' in chunk:
+				continue
+
+			rules, buffer = self._parseRulesets(buffer)
+			for rule in rules:
+				yield rule
+			depth = buffer.count('{') - buffer.count('}')
+
+		if decoder is not None:
+			buffer += decoder.decode(b'', final=True)
+		rules, buffer = self._parseRulesets(buffer, final=True)
+		for rule in rules:
+			yield rule
+
+	def _parseRulesets(self, buffer, final=False):
+		# Parses the complete rulesets at the start of buffer, and returns
+		# their rules and the rest of buffer
+		scanner = ModelScanner(buffer, internTable=self._internTable)
+		rules = []
+		while not scanner.atEnd:
+			mark = scanner._tokenIndex
+			try:
+				rules.extend(scanner.parseRuleset())
+			except ValueError:
+				scanner._tokenIndex = mark
+				if final or self._isFollowedByRuleset(scanner, mark):
+					raise ValueError('Failed to parse past line %i' % (self._lineNumber + scanner.lineNumber - 1))
+				break
+
+		consumed = scanner._nextToken().start
+		self._lineNumber += buffer.count('\n', 0, consumed)
+		return rules, buffer[consumed:]
+
+	def _isFollowedByRuleset(self, scanner, index):
+		# A ruleset that fails to parse is malformed, rather than cut short
+		# by the end of the buffer, if a complete ruleset follows it. In a
+		# ruleset that is cut short, braces closed at the top level can only
+		# close aggregates in its specifiers, and no ruleset follows those.
+		depth = 0
+		try:
+			for i, token in enumerate(itertools.islice(scanner._tokens, index, None), index):
+				if token.type != TokenType.Operator:
+					continue
+				if token.text == '{':
+					depth += 1
+				elif token.text == '}':
+					depth -= 1
+					if depth == 0:
+						scanner._tokenIndex = i + 1
+						try:
+							scanner.parseRuleset()
+							return True
+						except ValueError:
+							pass
+		finally:
+			scanner._tokenIndex = index
+		return False
@@ -0,0 +1,569 @@
+# coding=utf-8
+
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+from . import expressions
+from .expressions import Expression
+from .predicates import Predicate, ComparisonPredicate, CompoundPredicate, ValuePredicate, FalsePredicate
+from .rules import Rule, Model, ModelEngineType
+
+# A precompiled model (.irlc) file is laid out as:
+#
+#   magic       4 bytes, b'IRLC'
+#   version     unsigned short
+#   length      unsigned int, the length of the header
+#   header      marshalled dictionary describing the model and its segments
+#   segments    one marshalled node table per bucket, in header order
+#
+# Each segment holds the rules of one key in bucket order, and the
+# predicate and expression trees they refer to as a table of nodes whose
+# children are indexes of earlier nodes. Segments are self-contained, so a
+# bucket can be decoded without reading the others. Rules are written as
+# they are in the model, along with the simplified specifier and value of
+# their copy in the bucket, which share the nodes that did not change.
+#
+# Only plain values (None, booleans, numbers, strings, bytes and tuples,
+# lists, sets and dictionaries of them) are written, so loading a file can
+# never create any other kind of object.
+
+Magic = b'IRLC'
+Version = 3
+
+_Preamble = struct.Struct('<4sHI')
+
+# Node tags
+
+_ConstantValue = 0
+_BuiltInFunctions = 1
+_EvaluatedObject = 2
+_Variable = 3
+_KeyPath = 4
+_Aggregate = 5
+_Set = 6
+_Function = 7
+_ValuePredicate = 8
+_ComparisonPredicate = 9
+_CompoundPredicate = 10
+
+# Values
+
+_ScalarTypes = frozenset((type(None), bool, int, float, complex, str, bytes))
+_CollectionTypes = (tuple, list, set, frozenset)
+
+def _plainValue(value):
+	# marshal can also load code objects, which are refused along with
+	# anything else that is not plain data
+	if value.__class__ in _ScalarTypes:
+		return value
+	if isinstance(value, _CollectionTypes):
+		for element in value:
+			_plainValue(element)
+		return value
+	if isinstance(value, dict):
+		for key, element in value.items():
+			_plainValue(key)
+			_plainValue(element)
+		return value
+	raise ValueError('Precompiled model contains a %s' % value.__class__.__name__)
+
+def _dumps(value):
+	try:
+		return marshal.dumps(_plainValue(value))
+	except ValueError:
+		raise ValueError('Cannot encode %r' % (value,))
+
+def _loads(data):
+	# The values loaded are checked by whoever uses them, which the header
+	# and the decoder do for every value they read
+	try:
+		return marshal.loads(data)
+	except (EOFError, TypeError, ValueError):
+		raise ValueError('Precompiled model is truncated or corrupt')
+
+
+class _Encoder(object):
+
+	def __init__(self):
+		self.nodes = []
+		self._indexes = {}
+
+	def encode(self, obj):
+		# Shared instances are encoded once
+		index = self._indexes.get(id(obj))
+		if index is None:
+			node = self._nodeForObject(obj)
+			index = self._indexes[id(obj)] = len(self.nodes)
+			self.nodes.append(node)
+		return index
+
+	def _nodeForObject(self, obj):
+		if isinstance(obj, expressions.KeyPathExpression):
+			return (_KeyPath, obj.keyPath)
+		if isinstance(obj, expressions.ConstantValueExpression):
+			if obj.constantValue is expressions._BuiltInFunctions:
+				return (_BuiltInFunctions,)
+			return (_ConstantValue, obj.constantValue)
+		if isinstance(obj, expressions.SelfExpression):
+			return (_EvaluatedObject,)
+		if isinstance(obj, expressions.VariableExpression):
+			return (_Variable, obj.variable)
+		if isinstance(obj, expressions.AggregateExpression):
+			return (_Aggregate, tuple(self.encode(e) for e in obj.collection))
+		if isinstance(obj, expressions.SetExpression):
+			return (_Set, obj._type, self.encode(obj.leftExpression), self.encode(obj.rightExpression))
+		if isinstance(obj, expressions.FunctionExpression):
+			return (_Function, self.encode(obj.operand), obj.function, tuple(self.encode(e) for e in obj.arguments), obj._type)
+		if isinstance(obj, ValuePredicate):
+			return (_ValuePredicate, obj.value)
+		if isinstance(obj, ComparisonPredicate):
+			return (_ComparisonPredicate, self.encode(obj.leftExpression), self.encode(obj.rightExpression), obj.modifier, obj.operatorType, obj.options)
+		if isinstance(obj, CompoundPredicate):
+			return (_CompoundPredicate, obj.compoundPredicateType, tuple(self.encode(p) for p in obj.subpredicates))
+		raise ValueError('Cannot encode %r' % obj)
+
+
+# The fields of each kind of node: a value, a reference to an earlier node
+# or a tuple of references.
+_NodeFields = {
+	_ConstantValue: 'v',
+	_BuiltInFunctions: '',
+	_EvaluatedObject: '',
+	_Variable: 'v',
+	_KeyPath: 'v',
+	_Aggregate: 'R',
+	_Set: 'vrr',
+	_Function: 'rvRv',
+	_ValuePredicate: 'v',
+	_ComparisonPredicate: 'rrvvv',
+	_CompoundPredicate: 'vR'
+}
+
+
+# Structurally identical nodes decode to one instance, across segments too
+class _Decoder(object):
+
+	def __init__(self):
+		self._instances = {}
+
+	def decode(self, nodes):
+		objects = []
+		for node in nodes:
+			objects.append(self._objectForNode(node, objects))
+		return objects
+
+	def _objectForNode(self, node, objects):
+		# Values of different types may compare equal (1, 1.0 and True), so
+		# a value's type is part of the key. References are keyed by the
+		# identity of the already decoded instance, which the cached
+		# instance keeps alive.
+		fields = _NodeFields[node[0]]
+		if len(node) != len(fields) + 1:
+			raise ValueError('Invalid node %r' % (node,))
+
+		key = [node[0]]
+		for kind, field in zip(fields, node[1:]):
+			if kind == 'r':
+				key.append(id(objects[field]))
+			elif kind == 'R':
+				key.append(tuple(id(objects[i]) for i in field))
+			else:
+				if field.__class__ not in _ScalarTypes:
+					_plainValue(field)
+				key.append(field.__class__)
+				key.append(field)
+		key = tuple(key)
+
+		try:
+			instance = self._instances.get(key)
+		except TypeError:
+			return self._newObjectForNode(node, objects)
+		if instance is None:
+			instance = self._instances[key] = self._newObjectForNode(node, objects)
+		return instance
+
+	def _newObjectForNode(self, node, objects):
+		tag = node[0]
+		if tag == _ConstantValue:
+			return Expression.expressionForConstantValue(node[1])
+		if tag == _BuiltInFunctions:
+			return Expression.expressionForConstantValue(expressions._BuiltInFunctions)
+		if tag == _EvaluatedObject:
+			return Expression.expressionForEvaluatedObject()
+		if tag == _Variable:
+			return Expression.expressionForVariable(node[1])
+		if tag == _KeyPath:
+			return Expression.expressionForKeyPath(node[1])
+		if tag == _Aggregate:
+			return Expression.expressionForAggregate([objects[i] for i in node[1]])
+		if tag == _Set:
+			return expressions.SetExpression(node[1], objects[node[2]], objects[node[3]])
+		if tag == _Function:
+			return expressions.FunctionExpression(objects[node[1]], node[2], [objects[i] for i in node[3]], node[4])
+		if tag == _ValuePredicate:
+			return Predicate.predicateWithValue(node[1])
+		if tag == _ComparisonPredicate:
+			return ComparisonPredicate(objects[node[1]], objects[node[2]], modifier=node[3], type=node[4], options=node[5])
+		if tag == _CompoundPredicate:
+			return CompoundPredicate([objects[i] for i in node[2]], type=node[1])
+		raise ValueError('Unknown node tag %r' % tag)
+
+
+# Encoding and Decoding Models
+
+def encodeModel(model, source=None):
+	# Rules are kept along with their simplified copies, so models without
+	# variables are not simplified again when they are loaded
+	return _encodeModelWithRules(list(model.rules or ()), model._variables, model.engine,
+		model._ruleCache.capacity if model._ruleCache is not None else 0, source)
+
+def _encodeModelWithRules(rules, variables, engine, ruleCacheSize, source):
+	# Rules are grouped by key in bucket order, highest priority first, with
+	# the index of each rule in model.rules so that order can be restored.
+	layout = {}
+	for i, rule in enumerate(rules):
+		layout.setdefault(rule.key, []).append(i)
+
+	segments = []
+	entries = []
+	offset = 0
+	for key, indexes in layout.items():
+		indexes.sort(key=lambda i: rules[i].priority, reverse=True)
+
+		encoder = _Encoder()
+		encodedRules = []
+		for i in indexes:
+			rule = rules[i]
+			bucketRule = rule._simplifiedRule()
+			encodedRules.append((
+				i,
+				encoder.encode(rule.specifier),
+				encoder.encode(rule.value),
+				rule.weight,
+				rule.priority,
+				encoder.encode(bucketRule.specifier),
+				encoder.encode(bucketRule.value)
+			))
+
+		segment = _dumps((encoder.nodes, encodedRules))
+		entries.append((key, offset, len(segment)))
+		segments.append(segment)
+		offset += len(segment)
+
+	header = _dumps({
+		'ruleCount': len(rules),
+		'variables': variables,
+		'engine': engine,
+		'ruleCacheSize': ruleCacheSize,
+		'segments': entries,
+		'source': source
+	})
+
+	return b''.join([_Preamble.pack(Magic, Version, len(header)), header] + segments)
+
+def decodeHeader(data):
+	# Returns the header and the offset of the segments. Raises ValueError
+	# if data is not a precompiled model of a supported version.
+	if len(data) < _Preamble.size:
+		raise ValueError('Precompiled model is truncated')
+
+	magic, version, length = _Preamble.unpack_from(data, 0)
+	if magic != Magic:
+		raise ValueError('Not a precompiled model')
+	if version != Version:
+		raise ValueError('Unsupported precompiled model version: %i' % version)
+
+	start = _Preamble.size + length
+	if len(data) < start:
+		raise ValueError('Precompiled model is truncated')
+	header = _plainValue(_loads(data[_Preamble.size:start]))
+	if not _isValidHeader(header):
+		raise ValueError('Invalid precompiled model header')
+	return header, start
+
+def _isValidHeader(header):
+	# Every field is checked, so readers can use the header as it is
+	def isInt(value):
+		return value.__class__ is int and value >= 0
+
+	if not isinstance(header, dict):
+		return False
+	if not all(key in header for key in ('ruleCount', 'variables', 'engine', 'ruleCacheSize', 'segments', 'source')):
+		return False
+	if not isInt(header['ruleCount']) or not isInt(header['ruleCacheSize']):
+		return False
+	if header['variables'] is not None and not isinstance(header['variables'], dict):
+		return False
+	if header['engine'].__class__ is not int or header['engine'] not in (ModelEngineType.Default, ModelEngineType.Network):
+		return False
+	if not isinstance(header['segments'], (list, tuple)):
+		return False
+	for entry in header['segments']:
+		if not isinstance(entry, (list, tuple)) or len(entry) != 3:
+			return False
+		key, offset, length = entry
+		if not isinstance(key, str) or not isInt(offset) or not isInt(length):
+			return False
+	source = header['source']
+	if source is not None:
+		if not isinstance(source, dict) or \
+		   not isInt(source.get('mtime')) or not isInt(source.get('size')) or \
+		   not isinstance(source.get('sha256'), str):
+			return False
+	return True
+
+def decodeSegment(segment, key, decoder=None):
+	# (index in the model's rules, rule, simplified rule) in bucket order
+	try:
+		nodes, encodedRules = _loads(segment)
+		objects = (decoder or _Decoder()).decode(nodes)
+		rules = []
+		for i, specifier, value, weight, priority, bucketSpecifier, bucketValue in encodedRules:
+			if weight.__class__ not in _ScalarTypes or priority.__class__ not in _ScalarTypes:
+				raise ValueError('Invalid rule weight or priority')
+			rule = Rule(objects[specifier], key, objects[value], weight=weight, priority=priority)
+			if bucketSpecifier != specifier or bucketValue != value:
+				simplifiedRule = Rule(objects[bucketSpecifier], key, objects[bucketValue], weight=weight, priority=priority)
+			else:
+				simplifiedRule = rule
+			rules.append((i, rule, simplifiedRule))
+	except (TypeError, KeyError, IndexError, AssertionError):
+		raise ValueError('Invalid precompiled model segment for %s' % key)
+	return rules
+
+def _bucketRuleForRule(rule, simplifiedRule, variables):
+	# As Model._bucketRuleForRule, using the simplified copy that was saved
+	# when there are no variables to substitute
+	if variables is not None:
+		simplifiedRule = rule._ruleWithSubstitutionVariables(variables)._simplifiedRule()
+	return simplifiedRule if simplifiedRule.specifier is not FalsePredicate else None
+
+def decodeModel(data):
+	header, start = decodeHeader(data)
+	variables = header['variables']
+
+	decoder = _Decoder()
+	rules = [None] * header['ruleCount']
+	buckets = {}
+	for key, offset, length in header['segments']:
+		bucket = buckets[key] = []
+		for i, rule, simplifiedRule in decodeSegment(data[start + offset:start + offset + length], key, decoder):
+			rules[i] = rule
+			rule = _bucketRuleForRule(rule, simplifiedRule, variables)
+			if rule is not None:
+				bucket.append(rule)
+
+	return Model._modelWithBuckets(rules, buckets, variables=variables,
+		engine=header['engine'], ruleCacheSize=header['ruleCacheSize'])
+
+def _rulesFromModelData(data):
+	# Without sorting into buckets or substituting variables
+	header, start = decodeHeader(data)
+
+	decoder = _Decoder()
+	rules = [None] * header['ruleCount']
+	for key, offset, length in header['segments']:
+		for i, rule, _ in decodeSegment(data[start + offset:start + offset + length], key, decoder):
+			rules[i] = rule
+	return rules
+
+# Encoding and Decoding Rules
+
+def encodeRules(rules):
+	# Only the rules as they were written, for sending between processes
+	encoder = _Encoder()
+	encodedRules = [(
+		encoder.encode(rule.specifier),
+		rule.key,
+		encoder.encode(rule.value),
+		rule.weight,
+		rule.priority
+	) for rule in rules]
+	return _dumps((encoder.nodes, encodedRules))
+
+def decodeRules(data):
+	try:
+		nodes, encodedRules = _loads(data)
+		objects = _Decoder().decode(nodes)
+		rules = []
+		for specifier, key, value, weight, priority in encodedRules:
+			if key.__class__ is not str or weight.__class__ not in _ScalarTypes or priority.__class__ not in _ScalarTypes:
+				raise ValueError('Invalid rule key, weight or priority')
+			rules.append(Rule(objects[specifier], key, objects[value], weight=weight, priority=priority))
+	except (TypeError, KeyError, IndexError, AssertionError):
+		raise ValueError('Invalid encoded rules')
+	return rules
+
+
+# Only the segment table is read up front. The rules for a key are
+# decoded when first needed, and the mapped pages are shared by processes.
+class MappedModel(Model):
+
+	def __init__(self, path):
+		with open(path, 'rb') as f:
+			self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		header, start = decodeHeader(self._map)
+		self._segments = dict((key, (start + offset, length)) for key, offset, length in header['segments'])
+		self._ruleCount = header['ruleCount']
+		self._decoder = _Decoder()
+		self._decodedRules = {}
+		self._decodingLock = threading.Lock()
+
+		super(MappedModel, self).__init__(rules=[], variables=header['variables'],
+			engine=header['engine'], ruleCacheSize=header['ruleCacheSize'])
+
+	@property
+	def rules(self):
+		if len(self._decodedRules) < self._ruleCount:
+			for key in self._segments:
+				self._bucketForKey(key)
+		return [self._decodedRules[i] for i in range(self._ruleCount)]
+
+	@property
+	def inferrableKeys(self):
+		return list(self._segments.keys())
+
+	def _sortRulesIntoBuckets(self):
+		# Buckets are stored sorted, and are decoded on demand
+		self._setBuckets({})
+
+	def _bucketForKey(self, keyPath):
+		bucket = self._buckets.get(keyPath)
+		if bucket is not None or keyPath not in self._segments:
+			return bucket
+
+		with self._decodingLock:
+			bucket = self._buckets.get(keyPath)
+			if bucket is None:
+				bucket = self._decodeBucket(keyPath)
+		return bucket
+
+	def _decodeBucket(self, keyPath):
+		offset, length = self._segments[keyPath]
+		bucket = []
+		for i, rule, simplifiedRule in decodeSegment(self._map[offset:offset + length], keyPath, self._decoder):
+			self._decodedRules[i] = rule
+			rule = _bucketRuleForRule(rule, simplifiedRule, self._variables)
+			if rule is not None:
+				bucket.append(rule)
+
+		if self._network is not None:
+			for rule in bucket:
+				self._network.addRule(rule)
+
+		self._buckets[keyPath] = bucket
+		return bucket
+
+	def addRule(self, rule):
+		raise TypeError('Mapped models are read-only; load the model with mapped=False to change its rules')
+
+	def removeRule(self, rule):
+		raise TypeError('Mapped models are read-only; load the model with mapped=False to change its rules')
+
+	def removeShadowedRules(self):
+		raise TypeError('Mapped models are read-only; load the model with mapped=False to change its rules')
+
+	def close(self):
+		self._map.close()
+
+# Reading and Writing Files
+
+def writeModel(model, path, source=None):
+	_writeData(encodeModel(model, source=source), path)
+
+def _writeData(data, path):
+	# The file is replaced atomically
+	directory = os.path.dirname(os.path.abspath(path))
+	fd, temporaryPath = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			f.write(data)
+		os.replace(temporaryPath, path)
+	except:
+		os.unlink(temporaryPath)
+		raise
+
+def readModel(path):
+	with open(path, 'rb') as f:
+		return decodeModel(f.read())
+
+def _encodedRulesFromFile(path, cache=False):
+	# Runs in the worker processes of Model.modelFromFiles. Only the parsed
+	# rules are sent back, encoded, since the parent sorts them into buckets.
+	from .scanners import ModelScanner, StreamingModelScanner
+
+	if cache:
+		rules = _fromFileWithCache(path, _rulesFromModelData,
+			lambda data: ModelScanner(data).parseRules(),
+			lambda rules, source: _encodeModelWithRules(rules, None, ModelEngineType.Default, 1024, source))
+	else:
+		with open(path, 'r') as f:
+			rules = list(StreamingModelScanner(f).parseRules())
+	return encodeRules(rules)
+
+def cachePathForPath(path):
+	# rules.irl is cached in rules.irlc
+	root, extension = os.path.splitext(path)
+	return root + '.irlc' if extension == '.irl' else path + '.irlc'
+
+def sourceInfoForData(path, data):
+	stat = os.stat(path)
+	return {
+		'mtime': stat.st_mtime_ns,
+		'size': stat.st_size,
+		'sha256': hashlib.sha256(data).hexdigest()
+	}
+
+def modelFromFileWithCache(path, parse):
+	# The cache is valid if it records the source's modification time and
+	# size, or else the hash of its contents. Otherwise parse is called.
+	return _fromFileWithCache(path, decodeModel, parse, encodeModel)
+
+def _fromFileWithCache(path, decode, parse, encode):
+	# decode reads the cache, parse the source, and encode writes the cache
+	cachePath = cachePathForPath(path)
+	stat = os.stat(path)
+
+	cached = None
+	source = None
+	try:
+		with open(cachePath, 'rb') as f:
+			cached = f.read()
+		source = decodeHeader(cached)[0]['source']
+	except (OSError, ValueError):
+		# A missing or corrupt cache is parsed again
+		cached = None
+
+	if source and source['mtime'] == stat.st_mtime_ns and source['size'] == stat.st_size:
+		try:
+			return decode(cached)
+		except Exception:
+			pass
+
+	with open(path, 'rb') as f:
+		data = f.read()
+	sourceInfo = sourceInfoForData(path, data)
+
+	result = None
+	if source and source['sha256'] == sourceInfo['sha256']:
+		try:
+			result = decode(cached)
+		except Exception:
+			pass
+	if result is None:
+		result = parse(data.decode('utf-8'))
+
+	# The cache is an optimization; failing to write it, or holding values
+	# that cannot be written, is not an error
+	try:
+		_writeData(encode(result, source=sourceInfo), cachePath)
+	except (OSError, ValueError):
+		pass
+
+	return result
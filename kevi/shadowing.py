@@ -0,0 +1,309 @@
+# coding=utf-8
+
+from .expressions import AggregateExpression, ConstantValueExpression, Expression, KeyPathExpression
+from .indexes import equalityTestsForPredicate
+from .operators import ComparisonPredicateOperator
+from .predicates import ComparisonPredicate, ComparisonPredicateModifier, ComparisonPredicateType
+from .predicates import CompoundPredicate, CompoundPredicateType, ValuePredicate
+
+# Key path tests
+
+# Comparisons with the constant on the left, as tests of the key path
+_ReversedOperatorTypes = {
+	ComparisonPredicateType.LessThan: ComparisonPredicateType.GreaterThan,
+	ComparisonPredicateType.LessThanOrEqual: ComparisonPredicateType.GreaterThanOrEqual,
+	ComparisonPredicateType.GreaterThan: ComparisonPredicateType.LessThan,
+	ComparisonPredicateType.GreaterThanOrEqual: ComparisonPredicateType.LessThanOrEqual,
+	ComparisonPredicateType.EqualTo: ComparisonPredicateType.EqualTo,
+	ComparisonPredicateType.NotEqualTo: ComparisonPredicateType.NotEqualTo,
+	ComparisonPredicateType.Contains: ComparisonPredicateType.In
+}
+
+_RangeOperatorTypes = frozenset([
+	ComparisonPredicateType.LessThan,
+	ComparisonPredicateType.LessThanOrEqual,
+	ComparisonPredicateType.GreaterThan,
+	ComparisonPredicateType.GreaterThanOrEqual,
+	ComparisonPredicateType.Between
+])
+
+# Only constants that compare in the usual way are reasoned about
+_ScalarTypes = (str, int, float, type(None))
+
+class _Test(object):
+	# A comparison between a key path and a constant, with the key path on
+	# the left
+
+	__slots__ = ('keyPath', 'operatorType', 'value', 'function')
+
+	def __init__(self, keyPath, operatorType, value, function):
+		self.keyPath = keyPath
+		self.operatorType = operatorType
+		self.value = value
+		self.function = function
+
+	def values(self):
+		# The finite set of values the key path may have, or None
+		if self.operatorType == ComparisonPredicateType.EqualTo:
+			return (self.value,)
+		if self.operatorType == ComparisonPredicateType.In:
+			return self.value
+		return None
+
+	def range(self):
+		# (low, low is included, high, high is included), or None
+		operatorType = self.operatorType
+		if operatorType not in _RangeOperatorTypes:
+			return None
+		if operatorType == ComparisonPredicateType.Between:
+			return (self.value[0], False, self.value[1], False)
+		if operatorType in (ComparisonPredicateType.GreaterThan, ComparisonPredicateType.GreaterThanOrEqual):
+			return (self.value, operatorType == ComparisonPredicateType.GreaterThanOrEqual, None, False)
+		return (None, False, self.value, operatorType == ComparisonPredicateType.LessThanOrEqual)
+
+	def isTrueForValue(self, value):
+		try:
+			return bool(self.function(value, self.value))
+		except Exception:
+			return False
+
+_NotConstant = object()
+
+def _constantValue(expression):
+	if isinstance(expression, ConstantValueExpression):
+		value = expression.constantValue
+		return value if isinstance(value, _ScalarTypes) else _NotConstant
+	if isinstance(expression, AggregateExpression) and expression._isConstant():
+		values = tuple(expression.compile()(None))
+		return values if all(isinstance(value, _ScalarTypes) for value in values) else _NotConstant
+	return _NotConstant
+
+def _testForPredicate(predicate):
+	if not isinstance(predicate, ComparisonPredicate) or \
+	   predicate.modifier != ComparisonPredicateModifier.Direct or \
+	   predicate.options:
+		return None
+
+	operatorType = predicate.operatorType
+	left, right = predicate.leftExpression, predicate.rightExpression
+	if not isinstance(left, KeyPathExpression):
+		left, right = right, left
+		operatorType = _ReversedOperatorTypes.get(operatorType)
+	if not isinstance(left, KeyPathExpression) or operatorType is None:
+		return None
+
+	value = _constantValue(right)
+	if value is _NotConstant:
+		return None
+	if operatorType == ComparisonPredicateType.In:
+		if not isinstance(value, tuple):
+			return None
+	elif operatorType == ComparisonPredicateType.Between:
+		if not isinstance(value, tuple) or len(value) != 2 or not all(_isNumber(v) for v in value):
+			return None
+	elif isinstance(value, tuple):
+		return None
+	elif operatorType in _RangeOperatorTypes and not _isNumber(value):
+		return None
+
+	function = ComparisonPredicateOperator.operatorWithType(operatorType, ComparisonPredicateModifier.Direct, 0).operatorFunction()
+	if function is None:
+		return None
+	return _Test(left.keyPath, operatorType, value, function)
+
+def _equalityPredicate(keyPath, value):
+	return ComparisonPredicate(Expression.expressionForKeyPath(keyPath), Expression.expressionForConstantValue(value))
+
+def _isNumber(value):
+	return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+# Ranges
+
+def _rangeIsWithinRange(range, other):
+	low, lowIncluded, high, highIncluded = range
+	otherLow, otherLowIncluded, otherHigh, otherHighIncluded = other
+
+	if otherLow is not None:
+		if low is None or low < otherLow or (low == otherLow and lowIncluded and not otherLowIncluded):
+			return False
+	if otherHigh is not None:
+		if high is None or high > otherHigh or (high == otherHigh and highIncluded and not otherHighIncluded):
+			return False
+	return True
+
+def _rangeIncludesValue(range, value):
+	return _rangeIsWithinRange((value, True, value, True), range)
+
+def _intersectedRange(range, other):
+	low, lowIncluded, high, highIncluded = range
+	otherLow, otherLowIncluded, otherHigh, otherHighIncluded = other
+
+	if otherLow is not None and (low is None or otherLow > low or (otherLow == low and not otherLowIncluded)):
+		low, lowIncluded = otherLow, otherLowIncluded
+	if otherHigh is not None and (high is None or otherHigh < high or (otherHigh == high and not otherHighIncluded)):
+		high, highIncluded = otherHigh, otherHighIncluded
+	return (low, lowIncluded, high, highIncluded)
+
+# Implication
+
+def _testImpliesTest(test, other):
+	if test.keyPath != other.keyPath:
+		return False
+
+	values = test.values()
+	if values is not None:
+		return all(other.isTrueForValue(value) for value in values)
+
+	range = test.range()
+	if range is not None:
+		otherRange = other.range()
+		if otherRange is not None:
+			return _rangeIsWithinRange(range, otherRange)
+		if other.operatorType == ComparisonPredicateType.NotEqualTo:
+			return _isNumber(other.value) and not _rangeIncludesValue(range, other.value)
+		return False
+
+	return test.operatorType == other.operatorType == ComparisonPredicateType.NotEqualTo and test.value == other.value
+
+def _rangeForConjunction(subpredicates, keyPath):
+	# The range a key path is restricted to by all the range tests of an AND
+	range = None
+	for subpredicate in subpredicates:
+		test = _testForPredicate(subpredicate)
+		if test is not None and test.keyPath == keyPath and test.range() is not None:
+			range = test.range() if range is None else _intersectedRange(range, test.range())
+	return range
+
+def predicateImplies(predicate, other):
+	# Whether other is true whenever predicate is. Only tests of key paths
+	# against constants are compared by value, so False may mean unknown.
+	if isinstance(other, ValuePredicate) and other.value:
+		return True
+	if isinstance(predicate, ValuePredicate) and not predicate.value:
+		return True
+
+	predicateType = predicate.compoundPredicateType if isinstance(predicate, CompoundPredicate) else None
+	otherType = other.compoundPredicateType if isinstance(other, CompoundPredicate) else None
+
+	if otherType == CompoundPredicateType.And:
+		return all(predicateImplies(predicate, subpredicate) for subpredicate in other.subpredicates)
+	if predicateType == CompoundPredicateType.Or:
+		return all(predicateImplies(subpredicate, other) for subpredicate in predicate.subpredicates)
+
+	# Predicates that read anything other than key paths, such as random:,
+	# may not give the same result twice
+	if predicate == other and predicate._collectKeyPaths(set()):
+		return True
+
+	if otherType == CompoundPredicateType.Or:
+		if any(predicateImplies(predicate, subpredicate) for subpredicate in other.subpredicates):
+			return True
+
+		# For example, x IN {1, 2} implies x == 1 OR x == 2
+		test = _testForPredicate(predicate)
+		if test is not None and test.operatorType == ComparisonPredicateType.In:
+			return all(predicateImplies(_equalityPredicate(test.keyPath, value), other) for value in test.value)
+	if predicateType == CompoundPredicateType.Not and otherType == CompoundPredicateType.Not:
+		return predicateImplies(other.subpredicates[0], predicate.subpredicates[0])
+
+	if predicateType == CompoundPredicateType.And:
+		if any(predicateImplies(subpredicate, other) for subpredicate in predicate.subpredicates):
+			return True
+
+		# For example, x > 1 AND x < 5 implies x BETWEEN {0, 10}
+		otherTest = _testForPredicate(other)
+		if otherTest is None or otherTest.range() is None:
+			return False
+		range = _rangeForConjunction(predicate.subpredicates, otherTest.keyPath)
+		return range is not None and _rangeIsWithinRange(range, otherTest.range())
+
+	test = _testForPredicate(predicate)
+	otherTest = _testForPredicate(other)
+	if test is None or otherTest is None:
+		return False
+	return _testImpliesTest(test, otherTest)
+
+# Shadowed Rules
+
+# shadowingRule comes before rule in its bucket and fires whenever it can.
+# A shadowed rule with the same specifier is a duplicate.
+class ShadowedRule(object):
+
+	__slots__ = ('_rule', '_shadowingRule')
+
+	def __init__(self, rule, shadowingRule):
+		self._rule = rule
+		self._shadowingRule = shadowingRule
+
+	@property
+	def rule(self):
+		return self._rule
+
+	@property
+	def shadowingRule(self):
+		return self._shadowingRule
+
+	@property
+	def key(self):
+		return self._rule.key
+
+	@property
+	def isDuplicate(self):
+		return self._rule.specifier == self._shadowingRule.specifier
+
+	def __repr__(self):
+		return '<%s> %s shadowed by %s' % (
+			self.__class__.__name__,
+			self._rule,
+			self._shadowingRule
+		)
+
+def shadowedRulesInBucket(bucket):
+	shadowedRules = []
+
+	# The rules that are not shadowed, grouped by the key paths their
+	# specifiers test for equality, then by the constants they test them
+	# against. Shadowed rules are implied by a rule that is not, so checking
+	# against the rules that are not shadowed is enough.
+	groups = {}   # key paths -> {constants -> [(position, rule)]}
+
+	for position, rule in enumerate(bucket):
+		specifier = rule.specifier
+		tests = equalityTestsForPredicate(specifier)
+		keyPaths = set()
+		if not specifier._collectKeyPaths(keyPaths):
+			keyPaths = None
+
+		# A specifier can only imply that a key path equals a constant if it
+		# tests the key path, and not against another constant
+		candidates = []
+		for groupKeyPaths, entries in groups.items():
+			if keyPaths is not None and not keyPaths.issuperset(groupKeyPaths):
+				continue
+			if all(keyPath in tests for keyPath in groupKeyPaths):
+				candidates.extend(entries.get(tuple(tests[keyPath] for keyPath in groupKeyPaths), ()))
+				continue
+			for values, groupEntries in entries.items():
+				if all(tests.get(keyPath, value) == value for keyPath, value in zip(groupKeyPaths, values)):
+					candidates.extend(groupEntries)
+
+		candidates.sort(key=_entryPosition)
+		for _, shadowingRule in candidates:
+			if predicateImplies(specifier, shadowingRule.specifier):
+				shadowedRules.append(ShadowedRule(rule, shadowingRule))
+				break
+		else:
+			groupKeyPaths = tuple(sorted(tests))
+			entries = groups.setdefault(groupKeyPaths, {})
+			entries.setdefault(tuple(tests[keyPath] for keyPath in groupKeyPaths), []).append((position, rule))
+
+	return shadowedRules
+
+def _entryPosition(entry):
+	return entry[0]
+
+def shadowedRulesInModel(model):
+	shadowedRules = []
+	for key in model.inferrableKeys:
+		shadowedRules.extend(shadowedRulesInBucket(model._bucketForKey(key) or ()))
+	return shadowedRules
@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from ..columns import numpy, ColumnBatch
+from ..expressions import Expression
+from ..predicates import Predicate
+from ..rules import Rule, Model
+
+@unittest.skipUnless(numpy, 'numpy is not installed')
+class VectorizedEvaluationTest(unittest.TestCase):
+
+	def setUp(self):
+		self.columns = {
+			'task': numpy.array(['edit', 'list', 'query', 'edit', 'query']),
+			'entity.name': numpy.array(['Person', 'Person', 'Address', 'Address', 'Phone']),
+			'count': numpy.array([1, 10, 2, 3, 9]),
+			'owner': numpy.array([None, {'name': 'Ada'}, None, {'name': 'Bob'}, None], dtype=object)
+		}
+		self.rows = [
+			{'task': task, 'entity': {'name': name}, 'count': int(count), 'owner': owner}
+			for task, name, count, owner in zip(*[self.columns[k] for k in ('task', 'entity.name', 'count', 'owner')])
+		]
+
+	def testPredicatesMatchRowEvaluation(self):
+		for format in (
+			'task == "edit"',
+			'task != "edit"',
+			'count > 2 AND count <= 9',
+			'task == "edit" OR count > 5',
+			'NOT entity.name == "Person"',
+			'task IN {"edit", "list"}',
+			'entity.name BEGINSWITH "P"',
+			'entity.name BEGINSWITH[c] "p"',
+			'entity.name ENDSWITH "ss"',
+			'entity.name LIKE[c] "*e*"',
+			'task MATCHES "(edit|list)"',
+			'owner.name == "Ada"',
+			'owner != nil AND count < 5',
+			'TRUEPREDICATE',
+			'sum:({count, 1}) > 5'
+		):
+			predicate = Predicate.predicateWithFormat(format)
+			mask = predicate.evaluateWithColumns(self.columns)
+			self.assertEqual(mask.dtype, bool, format)
+			self.assertEqual(mask.tolist(), [bool(predicate.evaluateWithObject(row)) for row in self.rows], format)
+
+	def testMembershipInMixedCollections(self):
+		for format in (
+			'count IN {1, "y"}',
+			'count IN {"1", 2}',
+			'count IN {1.0, 3}',
+			'task IN {"edit", 1}',
+			'task IN {nil, "list"}'
+		):
+			predicate = Predicate.predicateWithFormat(format)
+			mask = predicate.evaluateWithColumns(self.columns)
+			self.assertEqual(mask.tolist(), [bool(predicate.evaluateWithObject(row)) for row in self.rows], format)
+
+	def testShortCircuitingAvoidsInvalidComparisons(self):
+		predicate = Predicate.predicateWithFormat('owner != nil AND owner > 1')
+		batch = ColumnBatch({'owner': numpy.array([None, None], dtype=object)})
+		self.assertEqual(predicate.evaluateWithColumns(batch).tolist(), [False, False])
+
+	def testKeyPathValues(self):
+		values = Expression.expressionForKeyPath('owner.name').expressionValuesWithColumns(self.columns)
+		self.assertEqual(values.tolist(), [None, 'Ada', None, 'Bob', None])
+		self.assertEqual(Expression.expressionForConstantValue(1).expressionValuesWithColumns(self.columns), 1)
+
+	def testModelMatchesBatchInference(self):
+		def rule(format, key, value):
+			return Rule(Predicate.predicateWithFormat(format), key, value)
+
+		model = Model(rules=[
+			rule('task == "edit" AND entity.name == "Person"', 'componentName', Expression.expressionForConstantValue('EditPerson')),
+			rule('task == "edit"', 'componentName', Expression.expressionForConstantValue('Edit')),
+			rule('count > 5', 'componentName', Expression.expressionForKeyPath('count')),
+			rule('task IN {"list"}', 'componentName', Expression.expressionForConstantValue(['a', 'list']))
+		])
+		values = model.fireRuleForKeyPathWithColumns('componentName', self.columns)
+		self.assertEqual(values.tolist(), model.fireRuleForKeyPathInContexts('componentName', self.rows))
+
+	def testMismatchedColumnLengths(self):
+		with self.assertRaises(ValueError):
+			ColumnBatch({'a': numpy.array([1, 2]), 'b': numpy.array([1])})
+
+
+class ImportTest(unittest.TestCase):
+
+	def testRulesDoNotImportNumpy(self):
+		script = 'import sys, kevi.rules, kevi.context, kevi.serialization; print("numpy" in sys.modules)'
+		output = subprocess.check_output([sys.executable, '-c', script], cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+		self.assertEqual(output.strip(), b'False')
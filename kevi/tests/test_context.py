@@ -0,0 +1,107 @@
+import datetime
+import unittest
+
+from ..context import Context
+from ..expressions import Expression
+from ..predicates import Predicate
+from ..rules import Rule, Model
+
+class CountingModel(Model):
+
+	def __init__(self, rules):
+		super(CountingModel, self).__init__(rules=rules)
+		self.firedKeys = []
+
+	def ruleForKeyPathInContext(self, keyPath, context):
+		self.firedKeys.append(keyPath)
+		return super(CountingModel, self).ruleForKeyPathInContext(keyPath, context)
+
+
+class ContextInferenceCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		def rule(format, key, value):
+			return Rule(Predicate.predicateWithFormat(format), key, Expression.expressionForConstantValue(value))
+
+		self.model = CountingModel([
+			rule('task == "edit"', 'look', 'form'),
+			rule('TRUEPREDICATE', 'look', 'table'),
+			rule('look == "form"', 'componentName', 'EditForm'),
+			rule('TRUEPREDICATE', 'componentName', 'Table'),
+			rule('entity == "Person"', 'displayName', 'Person'),
+			rule('TRUEPREDICATE', 'displayName', 'Thing')
+		])
+		self.context = Context(model=self.model)
+		self.context['task'] = 'edit'
+		self.context['entity'] = 'Person'
+
+	def testRepeatedInferenceFiresOnce(self):
+		for _ in range(5):
+			self.assertEqual(self.context['componentName'], 'EditForm')
+		self.assertEqual(self.model.firedKeys.count('componentName'), 1)
+		self.assertEqual(self.model.firedKeys.count('look'), 1)
+
+	def testSettingAKeyInvalidatesDependentValues(self):
+		self.assertEqual(self.context['componentName'], 'EditForm')
+		self.assertEqual(self.context['displayName'], 'Person')
+
+		self.context['task'] = 'list'
+		self.assertEqual(self.context['componentName'], 'Table')
+		self.assertEqual(self.context['displayName'], 'Person')
+		self.assertEqual(self.model.firedKeys.count('componentName'), 2)
+		self.assertEqual(self.model.firedKeys.count('look'), 2)
+		self.assertEqual(self.model.firedKeys.count('displayName'), 1)
+
+	def testDeletingAKeyInvalidatesDependentValues(self):
+		self.assertEqual(self.context['displayName'], 'Person')
+		del self.context['entity']
+		self.assertEqual(self.context['displayName'], 'Thing')
+
+	def testLocalValuesOverrideInferredValues(self):
+		self.assertEqual(self.context['componentName'], 'EditForm')
+		self.context['look'] = 'table'
+		self.assertEqual(self.context['componentName'], 'Table')
+		del self.context['look']
+		self.assertEqual(self.context['componentName'], 'EditForm')
+
+	def testChangingRulesInvalidatesValues(self):
+		self.assertEqual(self.context['displayName'], 'Person')
+		self.assertEqual(self.context['componentName'], 'EditForm')
+
+		rule = Rule(Predicate.predicateWithFormat('TRUEPREDICATE'), 'displayName', Expression.expressionForConstantValue('New'), 100)
+		self.model.addRule(rule)
+		self.assertEqual(self.context['displayName'], 'New')
+		self.model.removeRule(rule)
+		self.assertEqual(self.context['displayName'], 'Person')
+		self.assertEqual(self.context['componentName'], 'EditForm')
+
+	def testVolatileValuesAreNotCached(self):
+		self.model.addRule(Rule(Predicate.predicateWithFormat('TRUEPREDICATE'), 'time', Expression.expressionWithFormat('now()')))
+		self.assertIsNotNone(self.context['time'])
+		self.assertIsNotNone(self.context['time'])
+		self.assertEqual(self.model.firedKeys.count('time'), 2)
+
+	def testRulesChosenByVolatileSpecifiersAreNotCached(self):
+		self.model.addRule(Rule(Predicate.predicateWithFormat('now() > $deadline').predicateWithSubstitutionVariables({'deadline': datetime.datetime(2000, 1, 1)}), 'state', Expression.expressionForConstantValue('closed')))
+		self.model.addRule(Rule(Predicate.predicateWithFormat('TRUEPREDICATE'), 'state', Expression.expressionForConstantValue('open')))
+		self.assertIsNone(self.model.significantKeyPaths('state'))
+		self.assertEqual(self.context['state'], 'closed')
+		self.assertEqual(self.context['state'], 'closed')
+		self.assertEqual(self.model.firedKeys.count('state'), 2)
+
+	def testRuleCacheDoesNotInferKeys(self):
+		def rule(format, key, value):
+			return Rule(Predicate.predicateWithFormat(format), key, Expression.expressionForConstantValue(value))
+
+		model = Model(rules=[
+			rule('task == "edit" AND mode == "x"', 'A', 1),
+			rule('B == 1', 'A', 2),
+			rule('A == 5 AND y == 1', 'B', 3),
+			rule('TRUEPREDICATE', 'B', 1)
+		])
+		for _ in range(2):
+			context = Context(model=model)
+			context['task'] = 'edit'
+			context['mode'] = 'x'
+			self.assertEqual(context['A'], 1)
+			self.assertNotIn('B', context._inferredValues)
@@ -90,3 +90,110 @@ class ExpressionsBasicCreationAndEvaluationTest(unittest.TestCase):
 		self.assertEqual(evaluatedValue, sum(numbers), 'Function expression for sum evaluated to %i. Expected %i.' % (evaluatedValue, sum(numbers)))
 
 	# Format - Not Implemented Yet
+
+class ExpressionsCompilationTest(unittest.TestCase):
+
+	def setUp(self):
+		self.object = {
+			'entity': {
+				'name': 'Person'
+			},
+			'numbers': [1, 2, 3]
+		}
+
+	def testCompiledKeyPath(self):
+		for keyPath in ('entity', 'entity.name', 'entity.missing.name', 'numbers'):
+			expression = Expression.expressionForKeyPath(keyPath)
+			self.assertEqual(expression.compile()(self.object), expression.expressionValueWithObject(self.object), keyPath)
+
+	def testCompiledFunction(self):
+		numbersExpression = Expression.expressionForKeyPath('numbers')
+		expression = Expression.expressionForFunction('sum:', parameters=[numbersExpression])
+		self.assertEqual(expression.compile()(self.object), 6)
+
+	def testConstantFunctionIsFolded(self):
+		numbersExpression = Expression.expressionForConstantValue([1, 2, 3])
+		expression = Expression.expressionForFunction('sum:', parameters=[numbersExpression])
+		self.assertTrue(expression._isConstant())
+		self.assertEqual(expression.compile()(None), 6)
+
+	def testVolatileFunctionIsNotFolded(self):
+		expression = Expression.expressionForFunction('random:', parameters=[Expression.expressionForConstantValue(10)])
+		self.assertFalse(expression._isConstant())
+
+	def testConstantAggregatesAreNotShared(self):
+		expression = Expression.expressionWithFormat('{"name", "email"}')
+		expression.compile()(None).append('phone')
+		self.assertEqual(expression.compile()(None), ['name', 'email'])
+
+	def testArithmetic(self):
+		for format, value in (('a * 2 + 1', 7), ('a - 1', 2), ('a / 2', 1.5), ('sqrt:(a + 6)', 3.0), ('abs:(1 - a)', 2.0)):
+			expression = Expression.expressionWithFormat(format)
+			self.assertEqual(expression.expressionValueWithObject({'a': 3}), value, format)
+			self.assertEqual(expression.compile()({'a': 3}), value, format)
+
+
+class ExpressionsSimplificationTest(unittest.TestCase):
+
+	def testConstantFunctionsAreFolded(self):
+		expression = Expression.expressionWithFormat('2 * 3 + 1')._simplified()
+		self.assertEqual(expression, Expression.expressionForConstantValue(7))
+
+		expression = Expression.expressionWithFormat('a + 2 * 3')._simplified()
+		self.assertEqual(expression, Expression.expressionWithFormat('a + 6'))
+
+		expression = Expression.expressionWithFormat('{a, 1 + 1}')._simplified()
+		self.assertEqual(expression, Expression.expressionWithFormat('{a, 2}'))
+
+	def testUnchangedExpressionsAreKept(self):
+		for format in ('a + 1', '{a, 2}', 'random:(3) + 1', '1 / 0', 'now'):
+			expression = Expression.expressionWithFormat(format)
+			self.assertIs(expression._simplified(), expression, format)
+
+
+class ExpressionsRepresentationTest(unittest.TestCase):
+
+	def testExpressionsHaveNoInstanceDictionary(self):
+		for format in ('1', '"a"', 'SELF', '$variable', 'a.b', '{1, 2}', 'count:({1, 2})'):
+			expression = Expression.expressionWithFormat(format)
+			self.assertFalse(hasattr(expression, '__dict__'), format)
+
+	def testKeyPathExpressionKeepsOnlyTheKeyPath(self):
+		expression = Expression.expressionForKeyPath('a.b')
+		self.assertEqual(expression.__slots__, ('_keyPath',))
+		self.assertEqual(expression.function, 'valueForKeyPath:')
+		self.assertEqual(expression.pathExpression.constantValue, 'a.b')
+		self.assertEqual(len(expression.arguments), 2)
+		self.assertEqual(expression.expressionValueWithObject({'a': {'b': 1}}), 1)
+
+
+class ExpressionsEqualityTest(unittest.TestCase):
+
+	def testEqualExpressions(self):
+		for format in ('1', '"a"', 'SELF', '$var', 'a.b', '{1, "a", b}', 'a + 1', 'FUNCTION(a, "count")'):
+			expression1 = Expression.expressionWithFormat(format)
+			expression2 = Expression.expressionWithFormat(format)
+			self.assertEqual(expression1, expression2, format)
+			self.assertEqual(hash(expression1), hash(expression2), format)
+
+	def testConstantsOfDifferentTypes(self):
+		values = (1, 1.0, True, '1', None)
+		expressions = [Expression.expressionForConstantValue(value) for value in values]
+		for i, expression in enumerate(expressions):
+			for j, other in enumerate(expressions):
+				self.assertEqual(expression == other, i == j, (values[i], values[j]))
+
+	def testUnhashableConstants(self):
+		value = [1, 2]
+		expression = Expression.expressionForConstantValue(value)
+		self.assertEqual(expression, Expression.expressionForConstantValue(value))
+		self.assertNotEqual(expression, Expression.expressionForConstantValue([1, 2]))
+		self.assertEqual(hash(expression), hash(Expression.expressionForConstantValue(value)))
+
+	def testInterning(self):
+		table = {}
+		expression1 = Expression.expressionWithFormat('{a.b, 2}')._internWithTable(table)
+		expression2 = Expression.expressionWithFormat('{2, a.b}')._internWithTable(table)
+		self.assertIs(expression1.collection[0], expression2.collection[1])
+		self.assertIs(expression1.collection[1], expression2.collection[0])
+		self.assertIs(Expression.expressionWithFormat('a.b')._internWithTable(table), expression1.collection[0])
@@ -0,0 +1,95 @@
+import itertools
+import unittest
+
+from ..expressions import Expression
+from ..indexes import DiscriminationIndex, equalityTestsForPredicate
+from ..predicates import Predicate
+from ..rules import Rule, Model
+
+class EqualityTestsTest(unittest.TestCase):
+
+	def testComparisonPredicate(self):
+		predicate = Predicate.predicateWithFormat('task == "edit"')
+		self.assertEqual(equalityTestsForPredicate(predicate), {'task': 'edit'})
+
+	def testReversedComparisonPredicate(self):
+		predicate = Predicate.predicateWithFormat('"edit" == task')
+		self.assertEqual(equalityTestsForPredicate(predicate), {'task': 'edit'})
+
+	def testAndPredicate(self):
+		predicate = Predicate.predicateWithFormat('task == "edit" AND entity.name == "Person" AND count > 1')
+		self.assertEqual(equalityTestsForPredicate(predicate), {'task': 'edit', 'entity.name': 'Person'})
+
+	def testUnindexablePredicates(self):
+		for format in (
+			'task != "edit"',
+			'task == "edit" OR task == "list"',
+			'NOT task == "edit"',
+			'task ==[c] "edit"',
+			'task == other',
+			'TRUEPREDICATE'
+		):
+			predicate = Predicate.predicateWithFormat(format)
+			self.assertEqual(equalityTestsForPredicate(predicate), {}, format)
+
+
+class DiscriminationIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		tasks = ('edit', 'list', 'inspect')
+		entities = ('Person', 'Address', 'Phone')
+
+		rules = [Rule(Predicate.predicateWithFormat('TRUEPREDICATE'), 'componentName', Expression.expressionForConstantValue('Default'))]
+		for task in tasks:
+			rules.append(Rule(Predicate.predicateWithFormat('task == "%s"' % task), 'componentName', Expression.expressionForConstantValue(task)))
+			for entity in entities:
+				format = 'task == "%s" AND entity.name == "%s"' % (task, entity)
+				rules.append(Rule(Predicate.predicateWithFormat(format), 'componentName', Expression.expressionForConstantValue(task + entity)))
+		rules.append(Rule(Predicate.predicateWithFormat('count > 5'), 'componentName', Expression.expressionForConstantValue('Many')))
+
+		self.model = Model(rules=rules)
+		self.contexts = [
+			{'task': task, 'entity': {'name': entity}, 'count': count}
+			for task, entity, count in itertools.product(tasks + ('query', None), entities + ('Other',), (1, 10))
+		]
+
+	def testCandidatesAreInBucketOrder(self):
+		bucket = self.model._buckets['componentName']
+		for context in self.contexts:
+			candidates = list(self.model.candidates('componentName', context))
+			positions = [[id(r) for r in bucket].index(id(rule)) for rule in candidates]
+			self.assertEqual(positions, sorted(positions))
+			self.assertLess(len(candidates), len(bucket))
+
+	def testFiringMatchesFullScan(self):
+		bucket = self.model._buckets['componentName']
+		for context in self.contexts:
+			expected = next(rule.fire(context) for rule in bucket if rule.canFireInContext(context))
+			self.assertEqual(self.model.fireRuleForKeyPathInContext('componentName', context), expected)
+
+	def testUnhashableContextValue(self):
+		index = DiscriminationIndex(self.model._buckets['componentName'])
+		candidates = index.candidatesInContext({'task': ['edit'], 'entity': {'name': 'Person'}})
+		self.assertIn(id(self.model._buckets['componentName'][-1]), [id(rule) for rule in candidates])
+
+	def testKeyPathsAreReadWhenNeeded(self):
+		rules = self.model.rules + [Rule(Predicate.predicateWithFormat('TRUEPREDICATE'), 'componentName', Expression.expressionForConstantValue('First'), 1)]
+		index = DiscriminationIndex(Model(rules=rules)._buckets['componentName'])
+
+		context = RecordingDict({'task': 'edit', 'entity': {'name': 'Person'}})
+		candidates = index.candidatesInContext(context)
+		self.assertEqual(next(candidates).value.constantValue, 'First')
+		self.assertEqual(context.readKeys, [])
+		self.assertEqual(next(candidates).value.constantValue, 'editPerson')
+		self.assertEqual(context.readKeys, ['task', 'entity'])
+
+
+class RecordingDict(dict):
+
+	def __init__(self, *args):
+		super(RecordingDict, self).__init__(*args)
+		self.readKeys = []
+
+	def get(self, key, default=None):
+		self.readKeys.append(key)
+		return super(RecordingDict, self).get(key, default)
@@ -1,6 +1,8 @@
 import unittest
 
 from .. import kvc
+from ..columns import numpy, ColumnBatch
+from ..predicates import Predicate
 
 class KVCTest(unittest.TestCase):
 
@@ -55,4 +57,145 @@ class KVCTest(unittest.TestCase):
 
 	def testValueForKeyPath(self):
 		value = kvc.valueForKeyPath(self.obj, 'names.total')
-		self.assertEqual(value, 6)
\ No newline at end of file
+		self.assertEqual(value, 6)
+
+	def testValueForKeyPathThroughSequences(self):
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'places.name'), ['Calgary', 'Edmonton', 'Vancouver'])
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'names.short'), ['Ada', 'Bob', 'Jim'])
+
+	def testMissingValues(self):
+		self.assertIsNone(kvc.valueForKeyPath(self.obj, 'missing.total'))
+		self.assertIsNone(kvc.valueForKeyPath(self.obj, 'names..total'))
+		self.assertIsNone(kvc.valueForKey(None, 'title'))
+		self.assertIsNone(kvc.valueForKey(self.obj, ''))
+
+
+class Book(object):
+
+	def __init__(self, title):
+		self.title = title
+
+	def uppercaseTitle(self):
+		return self.title.upper()
+
+
+class SlottedBook(object):
+
+	__slots__ = ('_title',)
+
+	def __init__(self, title):
+		self._title = title
+
+	def title(self):
+		return self._title
+
+	@property
+	def titleProperty(self):
+		return self._title
+
+
+class KeyPathTest(unittest.TestCase):
+
+	def testKeyPathsAreShared(self):
+		keyPath = kvc.KeyPath.keyPathWithString('entity.name')
+		self.assertIs(kvc.KeyPath.keyPathWithString('entity.name'), keyPath)
+		self.assertEqual(keyPath.keys, ('entity', 'name'))
+		self.assertEqual(str(keyPath), 'entity.name')
+
+	def testAttributesAndMethods(self):
+		book = Book('Dune')
+		self.assertEqual(kvc.valueForKey(book, 'title'), 'Dune')
+		self.assertEqual(kvc.valueForKey(book, 'uppercaseTitle'), 'DUNE')
+		self.assertIsNone(kvc.valueForKey(book, 'author'))
+
+		# Instances may hide their methods with attributes
+		book.uppercaseTitle = 'Hidden'
+		self.assertEqual(kvc.valueForKey(book, 'uppercaseTitle'), 'Hidden')
+
+		book = SlottedBook('Emma')
+		self.assertEqual(kvc.valueForKey(book, 'title'), 'Emma')
+		self.assertEqual(kvc.valueForKey(book, 'titleProperty'), 'Emma')
+
+	def testValuesOfDifferentTypes(self):
+		keyPath = kvc.KeyPath.keyPathWithString('book.title')
+		objects = [{'book': {'title': 'A'}}, {'book': Book('B')}, {'book': SlottedBook('C')}, {'book': [Book('D'), {'title': 'E'}]}, {}]
+		self.assertEqual([keyPath.valueWithObject(obj) for obj in objects], ['A', 'B', 'C', ['D', 'E'], None])
+
+
+class CollectionOperatorsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.obj = {
+			'orders': [
+				{'total': 10, 'tags': ['new', 'gift']},
+				{'total': 2.5, 'tags': ['gift']},
+				{'total': None, 'tags': None},
+				{'total': 10, 'tags': []}
+			],
+			'empty': []
+		}
+
+	def testAggregates(self):
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@count'), 4)
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@sum.total'), 22.5)
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@avg.total'), 7.5)
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@min.total'), 2.5)
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@max.total'), 10)
+
+	def testEmptyAndMissingCollections(self):
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'empty.@count'), 0)
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'empty.@sum.total'), 0)
+		self.assertIsNone(kvc.valueForKeyPath(self.obj, 'empty.@avg.total'))
+		self.assertIsNone(kvc.valueForKeyPath(self.obj, 'empty.@max.total'))
+		self.assertIsNone(kvc.valueForKeyPath(self.obj, 'missing.@count'))
+
+	def testMissingValuesInMappings(self):
+		obj = {'orders': {'a': {'total': 1}}}
+		for operator in ('@count', '@sum', '@avg', '@min', '@max', '@unionOfObjects', '@unionOfArrays'):
+			self.assertIsNone(kvc.valueForKeyPath(obj, 'orders.%s.total' % operator), operator)
+		self.assertIsNone(kvc.valueForKeyPath(self.obj, 'missing.@sum.total'))
+
+	def testUnions(self):
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@unionOfObjects.total'), [10, 2.5, None, 10])
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@distinctUnionOfObjects.total'), [10, 2.5, None])
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@unionOfArrays.tags'), ['new', 'gift', 'gift'])
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@distinctUnionOfArrays.tags'), ['new', 'gift'])
+		self.assertEqual(kvc.valueForKeyPath(self.obj, 'orders.@distinctUnionOfObjects.tags'), [['new', 'gift'], ['gift'], None, []])
+
+	def testUnionOfArraysWithValues(self):
+		obj = {'orders': [{'tags': ['new']}, {'tags': 'gift'}, {'tags': 3}, {'tags': {'a': 1}}]}
+		self.assertEqual(kvc.valueForKeyPath(obj, 'orders.@unionOfArrays.tags'), ['new', 'gift', 3, {'a': 1}])
+		self.assertEqual(kvc.valueForKeyPath(obj, 'orders.@distinctUnionOfArrays.tags'), ['new', 'gift', 3, {'a': 1}])
+
+	def testUnknownOperatorsAreKeys(self):
+		self.assertEqual(kvc.valueForKeyPath({'@other': {'a': 1}}, '@other.a'), 1)
+
+	def testOperatorsInPredicates(self):
+		predicate = Predicate.predicateWithFormat('orders.@sum.total > 20 AND orders.@count == 4')
+		self.assertTrue(predicate.evaluateWithObject(self.obj))
+		self.assertTrue(predicate.compile()(self.obj))
+		self.assertEqual(predicate.significantKeyPaths(), {'orders.@sum.total', 'orders.@count'})
+
+	@unittest.skipUnless(numpy, 'numpy is not installed')
+	def testArraysAreReducedWithNumpy(self):
+		obj = {
+			'items': {'price': numpy.array([3, 1, 3, 2])},
+			'values': numpy.array([0.5, 1.5]),
+			'records': numpy.array([(1, 2.0), (3, 4.0)], dtype=[('id', 'i4'), ('price', 'f8')])
+		}
+		self.assertEqual(kvc.valueForKeyPath(obj, 'items.@sum.price'), 9)
+		self.assertIsInstance(kvc.valueForKeyPath(obj, 'items.@sum.price'), int)
+		self.assertEqual(kvc.valueForKeyPath(obj, 'items.@avg.price'), 2.25)
+		self.assertEqual(kvc.valueForKeyPath(obj, 'items.@max.price'), 3)
+		self.assertEqual(kvc.valueForKeyPath(obj, 'items.@distinctUnionOfObjects.price'), [3, 1, 2])
+		self.assertEqual(kvc.valueForKeyPath(obj, 'values.@count'), 2)
+		self.assertEqual(kvc.valueForKeyPath(obj, 'values.@sum'), 2.0)
+		self.assertEqual(kvc.valueForKeyPath(obj, 'records.@sum.price'), 6.0)
+		self.assertEqual(kvc.valueForKeyPath(obj, 'records.@count'), 2)
+
+	@unittest.skipUnless(numpy, 'numpy is not installed')
+	def testColumnBatches(self):
+		batch = ColumnBatch({'total': numpy.array([1, 2, 3]), 'owner.name': numpy.array(['a', 'b', 'a'])})
+		self.assertEqual(kvc.valueForKeyPath({'batch': batch}, 'batch.@sum.total'), 6)
+		self.assertEqual(kvc.valueForKeyPath({'batch': batch}, 'batch.@count'), 3)
+		self.assertEqual(kvc.valueForKeyPath({'batch': batch}, 'batch.@distinctUnionOfObjects.owner.name'), ['a', 'b'])
@@ -0,0 +1,50 @@
+import itertools
+import unittest
+
+from ..context import Context
+from ..expressions import Expression
+from ..network import ConditionNetwork
+from ..predicates import Predicate
+from ..rules import Rule, Model, ModelEngineType
+
+class ConditionNetworkTest(unittest.TestCase):
+
+	def setUp(self):
+		self.rules = []
+		for key, task, entity in itertools.product(('componentName', 'displayName'), ('edit', 'list'), ('Person', 'Address')):
+			format = 'task == "%s" AND entity.name == "%s"' % (task, entity)
+			self.rules.append(Rule(Predicate.predicateWithFormat(format), key, Expression.expressionForConstantValue(task + entity)))
+		for key in ('componentName', 'displayName'):
+			self.rules.append(Rule(Predicate.predicateWithFormat('task == "edit" OR task == "inspect"'), key, Expression.expressionForConstantValue('Edit')))
+			self.rules.append(Rule(Predicate.predicateWithFormat('TRUEPREDICATE'), key, Expression.expressionForConstantValue('Default')))
+
+	def testConditionsAreShared(self):
+		network = ConditionNetwork(self.rules)
+		# task == edit, task == list, task == inspect, entity.name == Person, entity.name == Address
+		self.assertEqual(network.conditionCount, 5)
+
+	def testNetworkMatchesDefaultEngine(self):
+		defaultModel = Model(rules=self.rules)
+		networkModel = Model(rules=self.rules, engine=ModelEngineType.Network)
+		for task, entity in itertools.product(('edit', 'list', 'inspect', 'query'), ('Person', 'Address', 'Other')):
+			context = {'task': task, 'entity': {'name': entity}}
+			for key in ('componentName', 'displayName'):
+				self.assertEqual(
+					networkModel.fireRuleForKeyPathInContext(key, context),
+					defaultModel.fireRuleForKeyPathInContext(key, context)
+				)
+
+	def testConditionValuesAreSharedAcrossKeys(self):
+		model = Model(rules=self.rules, engine=ModelEngineType.Network)
+		context = Context(model=model)
+		context['task'] = 'edit'
+		context['entity'] = {'name': 'Address'}
+
+		self.assertEqual(context['componentName'], 'editAddress')
+		evaluatedConditions = len(context.conditionValues)
+		self.assertEqual(context['displayName'], 'editAddress')
+		self.assertEqual(len(context.conditionValues), evaluatedConditions)
+
+		context['task'] = 'list'
+		self.assertEqual(len(context.conditionValues), 0)
+		self.assertEqual(context['componentName'], 'listAddress')
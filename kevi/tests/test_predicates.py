@@ -1,7 +1,8 @@
+import collections
 import unittest
 
 from ..expressions import Expression
-from ..predicates import Predicate, ComparisonPredicate
+from ..predicates import Predicate, ComparisonPredicate, CompoundPredicate, TruePredicate
 
 class PredicatesBasicCreationAndEvaluationTest(unittest.TestCase):
 
@@ -57,3 +58,270 @@ class PredicatesBasicCreationAndEvaluationTest(unittest.TestCase):
 		self.assertTrue(trueOrFalsePredicate.evaluateWithObject(self.object))
 		self.assertTrue(falseOrTruePredicate.evaluateWithObject(self.object))
 		self.assertFalse(falseOrFalsePredicate.evaluateWithObject(self.object))
+
+class PredicatesCompilationTest(unittest.TestCase):
+
+	def setUp(self):
+		self.object = {
+			'task': 'edit',
+			'entity': {
+				'name': 'Person'
+			},
+			'count': 3
+		}
+
+	def testCompiledPredicatesMatchEvaluation(self):
+		for format in (
+			'task == "edit"',
+			'task != "edit"',
+			'entity.name == "Person"',
+			'entity.name == "Person" AND task == "list"',
+			'entity.name == "Person" OR task == "list"',
+			'NOT task == "list"',
+			'count > 2 AND count <= 3',
+			'task IN {"edit", "inspect"}',
+			'TRUEPREDICATE AND TRUEPREDICATE AND task == "edit"',
+			'FALSEPREDICATE OR task == "list"'
+		):
+			predicate = Predicate.predicateWithFormat(format)
+			self.assertEqual(predicate.compile()(self.object), predicate.evaluateWithObject(self.object), format)
+
+	def testCompiledPredicateIsCached(self):
+		predicate = Predicate.predicateWithFormat('task == "edit"')
+		self.assertIs(predicate.compile(), predicate.compile())
+
+	def testConstantPredicatesAreFolded(self):
+		predicate = Predicate.predicateWithFormat('1 == 1 AND TRUEPREDICATE')
+		self.assertTrue(predicate._isConstant())
+		self.assertTrue(predicate.compile()(None))
+
+		predicate = Predicate.predicateWithFormat('task == "edit" AND FALSEPREDICATE')
+		self.assertFalse(predicate._isConstant())
+		self.assertFalse(predicate.compile()(self.object))
+
+
+class PredicatesRepresentationTest(unittest.TestCase):
+
+	def testPredicatesHaveNoInstanceDictionary(self):
+		for format in ('a == 1', 'a == 1 AND b == 2', 'TRUEPREDICATE'):
+			predicate = Predicate.predicateWithFormat(format)
+			self.assertFalse(hasattr(predicate, '__dict__'), format)
+
+	def testOperatorsAreShared(self):
+		predicate1 = Predicate.predicateWithFormat('a ==[c] 1 AND b < 2')
+		predicate2 = Predicate.predicateWithFormat('c ==[c] 3 AND d < 4')
+		self.assertIs(predicate1._operator, predicate2._operator)
+		for p1, p2 in zip(predicate1.subpredicates, predicate2.subpredicates):
+			self.assertIs(p1._operator, p2._operator)
+		self.assertIsNot(predicate1.subpredicates[0]._operator, predicate1.subpredicates[1]._operator)
+
+
+class PredicatesEqualityTest(unittest.TestCase):
+
+	def testEqualPredicates(self):
+		for format in ('a == 1', 'a.b ==[c] "x"', 'a == 1 AND (b < 2 OR NOT c IN {1, 2})', 'ANY a == 1', 'TRUEPREDICATE'):
+			predicate1 = Predicate.predicateWithFormat(format)
+			predicate2 = Predicate.predicateWithFormat(format)
+			self.assertEqual(predicate1, predicate2, format)
+			self.assertEqual(hash(predicate1), hash(predicate2), format)
+
+	def testDifferentPredicates(self):
+		formats = ('a == 1', 'a == 1.0', 'a == TRUE', 'a == "1"', 'a ==[c] 1', 'a != 1', 'b == 1',
+		           'ANY a == 1', 'a == 1 AND b == 2', 'a == 1 OR b == 2', 'b == 2 AND a == 1')
+		predicates = [Predicate.predicateWithFormat(format) for format in formats]
+		for i, predicate in enumerate(predicates):
+			for j, other in enumerate(predicates):
+				if i != j:
+					self.assertNotEqual(predicate, other, (formats[i], formats[j]))
+		self.assertNotEqual(predicates[0], predicates[0].leftExpression)
+
+	def testInterning(self):
+		table = {}
+		predicate1 = Predicate.predicateWithFormat('a == 1 AND b == 2')._internWithTable(table)
+		predicate2 = Predicate.predicateWithFormat('b == 2 OR a == 1')._internWithTable(table)
+		predicate3 = Predicate.predicateWithFormat('a == 1 AND b == 2')._internWithTable(table)
+		self.assertIs(predicate1, predicate3)
+		self.assertIs(predicate1.subpredicates[0], predicate2.subpredicates[1])
+		self.assertIs(predicate1.subpredicates[1], predicate2.subpredicates[0])
+		self.assertIs(predicate1.subpredicates[0].rightExpression, predicate2.subpredicates[1].rightExpression)
+
+
+class PredicatesStringComparisonTest(unittest.TestCase):
+
+	def _assertResults(self, format, results):
+		predicate = Predicate.predicateWithFormat(format)
+		for value, result in results:
+			obj = {'name': value}
+			self.assertEqual(predicate.evaluateWithObject(obj), result, (format, value))
+			self.assertEqual(predicate.compile()(obj), result, (format, value))
+
+	def testMatches(self):
+		self._assertResults('name MATCHES "first[A-Z]"', [('firstName', True), ('FIRSTNAME', False), ('lastName', False), (None, False), (1, False)])
+		self._assertResults('name MATCHES[c] "first[A-Z]"', [('firstName', True), ('FIRSTNAME', True)])
+		self._assertResults('name MATCHES[d] "cafe"', [('café', True), ('Café', False)])
+
+	def testLike(self):
+		self._assertResults('name LIKE "a*c"', [('abc', True), ('ac', True), ('abcd', False), ('a\nc', True), ('ABC', False)])
+		self._assertResults('name LIKE "a?c"', [('abc', True), ('ac', False), ('abbc', False)])
+		self._assertResults('name LIKE "a.c*"', [('a.cd', True), ('abcd', False)])
+		self._assertResults('name LIKE[cd] "CAFE*"', [('Café au lait', True), ('cafe', True), ('caffe', False)])
+		self._assertResults('name LIKE "a\\*"', [('a*', True), ('ab', False)])
+
+	def testOptions(self):
+		self._assertResults('name ==[c] "Straße"', [('STRASSE', True), ('strasse', True), ('Strasse', True), ('Strase', False), (None, False)])
+		self._assertResults('name !=[cd] "cafe"', [('CAFÉ', False), ('cafes', True)])
+		self._assertResults('name BEGINSWITH[c] "CA"', [('café', True), ('ac', False)])
+		self._assertResults('name ENDSWITH[d] "fe"', [('café', True), ('CAFÉ', False)])
+		self._assertResults('name CONTAINS[cd] "FE"', [('café', True), ('cafa', False)])
+		self._assertResults('name ENDSWITH "fé"', [('café', True), ('cafe', False)])
+		self._assertResults('name IN[c] {"Person", "Address"}', [('person', True), ('ADDRESS', True), ('Phone', False), (None, False)])
+		self._assertResults('name IN[cd] {"Café", 1}', [('CAFE', True), (1, True), ('caff', False)])
+		self._assertResults('name IN[c] "Person"', [('ERS', True), ('x', False)])
+		self._assertResults('name CONTAINS[c] "B"', [(['a', 'b'], True), (('A', 'B'), True), (['a'], False)])
+
+	def testPatternFromKeyPath(self):
+		predicate = Predicate.predicateWithFormat('name LIKE[c] pattern')
+		self.assertTrue(predicate.evaluateWithObject({'name': 'Alpha', 'pattern': 'a*'}))
+		self.assertTrue(predicate.compile()({'name': 'Alpha', 'pattern': 'A*A'}))
+		self.assertFalse(predicate.compile()({'name': 'Alpha', 'pattern': None}))
+
+
+class PredicatesMembershipTest(unittest.TestCase):
+
+	def _assertResults(self, format, results):
+		predicate = Predicate.predicateWithFormat(format)
+		for obj, result in results:
+			self.assertEqual(predicate.evaluateWithObject(obj), result, (format, obj))
+			self.assertEqual(predicate.compile()(obj), result, (format, obj))
+
+	def testIn(self):
+		self._assertResults('name IN {"a", "b", 1}', [({'name': 'a'}, True), ({'name': 'c'}, False), ({'name': 1.0}, True), ({'name': True}, True), ({'name': ['a']}, False), ({}, False)])
+		self._assertResults('name IN {}', [({'name': 'a'}, False)])
+		self._assertResults('name IN "abc"', [({'name': 'bc'}, True), ({'name': 'd'}, False)])
+
+	def testContains(self):
+		self._assertResults('{"a", "b"} CONTAINS name', [({'name': 'a'}, True), ({'name': 'c'}, False), ({}, False)])
+		self._assertResults('names CONTAINS "a"', [({'names': ['a', 'b']}, True), ({'names': 'cab'}, True), ({'names': ['c']}, False)])
+
+	def testUnhashableValues(self):
+		from ..operators import _membershipTestForCollection
+		isMember = _membershipTestForCollection(['a', ['b'], ['c', 'd']])
+		self.assertTrue(isMember('a'))
+		self.assertTrue(isMember(['c', 'd']))
+		self.assertFalse(isMember(['c']))
+		self.assertFalse(isMember('b'))
+
+		isMember = _membershipTestForCollection([{'a': 1}, [2]])
+		self.assertTrue(isMember({'a': 1}))
+		self.assertTrue(isMember([2]))
+		self.assertFalse(isMember({'a': 2}))
+
+	def testPartiallyOrderedValues(self):
+		from ..operators import _membershipTestForCollection
+		values = [{1, 2}, {3}, {1}, {2, 5}]
+		isMember = _membershipTestForCollection(values)
+		for value in values:
+			self.assertTrue(isMember(value), value)
+		self.assertFalse(isMember({2}))
+
+		values = [[{1, 2}], [{3}], [{1}], [{2, 5}]]
+		isMember = _membershipTestForCollection(values)
+		for value in values:
+			self.assertTrue(isMember(value), value)
+
+
+class CountingObject(object):
+
+	def __init__(self, values):
+		self.values = values
+		self.reads = collections.Counter()
+
+	def __getattr__(self, key):
+		self.reads[key] += 1
+		return self.values.get(key)
+
+
+class PredicatesReorderingTest(unittest.TestCase):
+
+	def _reads(self, evaluate, objects):
+		reads = collections.Counter()
+		for values in objects:
+			obj = CountingObject(values)
+			evaluate(obj)
+			reads.update(obj.reads)
+		return reads
+
+	def testCheapSubpredicatesFirst(self):
+		evaluate = Predicate.predicateWithFormat('note MATCHES "a.*z" AND task == "edit"').compile()
+		self.assertEqual(self._reads(evaluate, [{'note': 'abz', 'task': 'list'}]), {'task': 1})
+
+		evaluate = Predicate.predicateWithFormat('note LIKE[c] "A*" OR task == "edit"').compile()
+		self.assertEqual(self._reads(evaluate, [{'note': 'abz', 'task': 'edit'}]), {'task': 1})
+
+	def testSelectivity(self):
+		# a is nearly always 1 and b nearly never, so once the first
+		# evaluations are counted, b is tested first
+		objects = [{'a': 1, 'b': 1 if i % 10 == 0 else 2} for i in range(CompoundPredicate._sampleCount)]
+		evaluate = Predicate.predicateWithFormat('a == 1 AND b == 1').compile()
+		self.assertEqual(self._reads(evaluate, objects), {'a': len(objects), 'b': len(objects)})
+		self.assertEqual(self._reads(evaluate, objects), {'a': len(objects) // 10, 'b': len(objects)})
+		self.assertEqual([evaluate(values) for values in objects], [values['b'] == 1 for values in objects])
+
+	def testResultsAreUnchanged(self):
+		predicate = Predicate.predicateWithFormat('count != nil AND count > 3')
+		evaluate = predicate.compile()
+		for i in range(CompoundPredicate._sampleCount):
+			obj = {'count': i % 5}
+			self.assertEqual(evaluate(obj), predicate.evaluateWithObject(obj))
+
+		# count > 3 is now tested first, and would raise for nil
+		self.assertFalse(evaluate({'count': None}))
+		self.assertTrue(evaluate({'count': 4}))
+
+		# Exceptions raised by both orders are raised
+		evaluate = Predicate.predicateWithFormat('count > 3 AND count != nil').compile()
+		self.assertRaises(TypeError, evaluate, {'count': None})
+
+	def testMovedSubpredicatesCanDecideBeforeExceptions(self):
+		predicate = Predicate.predicateWithFormat('count > 3 AND kind == "x"')
+		evaluate = predicate.compile()
+		for i in range(CompoundPredicate._sampleCount):
+			evaluate({'count': i % 5, 'kind': 'y'})
+
+		# kind == "x" is now tested first
+		obj = {'count': None, 'kind': 'y'}
+		self.assertRaises(TypeError, predicate.evaluateWithObject, obj)
+		self.assertFalse(evaluate(obj))
+		self.assertRaises(TypeError, evaluate, {'count': None, 'kind': 'x'})
+
+	def testVolatileSubpredicatesKeepTheirPlace(self):
+		evaluate = Predicate.predicateWithFormat('note MATCHES "a.*" AND random:(1) > 2 AND task == "edit"').compile()
+		self.assertEqual(self._reads(evaluate, [{'note': 'b', 'task': 'list'}]), {'note': 1})
+
+
+class PredicatesSimplificationTest(unittest.TestCase):
+
+	def _assertSimplified(self, format, simplifiedFormat):
+		predicate = Predicate.predicateWithFormat(format)._simplified()
+		self.assertEqual(predicate, Predicate.predicateWithFormat(simplifiedFormat), format)
+
+	def testIdentityTermsAreDropped(self):
+		self._assertSimplified('TRUEPREDICATE AND TRUEPREDICATE AND x == 1', 'x == 1')
+		self._assertSimplified('x == 1 OR FALSEPREDICATE OR y == 2', 'x == 1 OR y == 2')
+		self._assertSimplified('x == 1 AND FALSEPREDICATE', 'FALSEPREDICATE')
+		self._assertSimplified('x == 1 OR NOT FALSEPREDICATE', 'TRUEPREDICATE')
+
+	def testConstantsAreFolded(self):
+		self._assertSimplified('x == 1 AND 1 + 1 == 3', 'FALSEPREDICATE')
+		self._assertSimplified('NOT (1 == 2) AND x == 2 * 3', 'x == 6')
+		self._assertSimplified('x IN {1, 1 + 1}', 'x IN {1, 2}')
+
+	def testNestedPredicatesAreFlattened(self):
+		predicate = Predicate.predicateWithFormat('a == 1 AND (b == 2 OR c == 3)')
+		predicate = Predicate.andPredicateWithSubpredicates([predicate, Predicate.andPredicateWithSubpredicates([Predicate.predicateWithFormat('d == 4'), TruePredicate])])
+		self.assertEqual(predicate._simplified(), Predicate.predicateWithFormat('a == 1 AND (b == 2 OR c == 3) AND d == 4'))
+
+	def testUnchangedPredicatesAreKept(self):
+		for format in ('x == 1', 'x == 1 AND y == 2', 'NOT x == 1', 'x == 1 OR (y == 2 AND z == 3)', '1 / 0 == 1'):
+			predicate = Predicate.predicateWithFormat(format)
+			self.assertIs(predicate._simplified(), predicate, format)
@@ -1,8 +1,9 @@
 import unittest
 
+from ..caches import LRUCache
 from ..expressions import Expression
 from ..predicates import Predicate
-from ..rules import Rule
+from ..rules import Rule, Model, ModelEngineType
 
 class RulePriorityTest(unittest.TestCase):
 
@@ -53,4 +54,249 @@ class WeightedRulePriorityTest(unittest.TestCase):
 		predicate = Predicate.predicateWithFormat('TRUEPREDICATE')
 		rule = Rule(predicate, 'key', self.trueValue, 4)
 		self.assertEqual(rule.priority, 4001)
-		
\ No newline at end of file
+
+class RuleEqualityTest(unittest.TestCase):
+
+	def testEqualRules(self):
+		rule1 = Rule(Predicate.predicateWithFormat('a == 1'), 'key', Expression.expressionForConstantValue('x'))
+		rule2 = Rule(Predicate.predicateWithFormat('a == 1'), 'key', Expression.expressionForConstantValue('x'))
+		self.assertEqual(rule1, rule2)
+		self.assertNotEqual(rule1, Rule(Predicate.predicateWithFormat('a == 2'), 'key', rule1.value))
+		self.assertNotEqual(rule1, Rule(rule1.specifier, 'other', rule1.value))
+		self.assertNotEqual(rule1, Rule(rule1.specifier, 'key', Expression.expressionForConstantValue('y')))
+		self.assertNotEqual(rule1, Rule(rule1.specifier, 'key', rule1.value, 1))
+
+	def testModelInternsRules(self):
+		rules = [
+			Rule(Predicate.predicateWithFormat('a == 1'), 'k1', Expression.expressionForConstantValue('x')),
+			Rule(Predicate.predicateWithFormat('a == 1 AND b == 2'), 'k2', Expression.expressionForConstantValue('x'))
+		]
+		model = Model(rules=rules)
+		self.assertIs(model.rules[0].specifier, model.rules[1].specifier.subpredicates[0])
+		self.assertIs(model.rules[0].value, model.rules[1].value)
+
+class ModelRuleCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		def rule(format, key, value):
+			return Rule(Predicate.predicateWithFormat(format), key, Expression.expressionForConstantValue(value))
+
+		self.model = Model(rules=[
+			rule('task == "edit" AND entity.name == "Person"', 'componentName', 'EditPerson'),
+			rule('task == "edit"', 'componentName', 'Edit'),
+			rule('TRUEPREDICATE', 'componentName', 'Default'),
+			rule('random:(1) == 0', 'volatile', 'Zero')
+		])
+
+	def testSignificantKeyPaths(self):
+		self.assertEqual(self.model.significantKeyPaths('componentName'), ('entity.name', 'task'))
+		self.assertIsNone(self.model.significantKeyPaths('volatile'))
+		self.assertEqual(self.model.significantKeyPaths('missing'), ())
+
+	def testRuleIsSharedAcrossContexts(self):
+		context1 = {'task': 'edit', 'entity': {'name': 'Person'}, 'unrelated': 1}
+		context2 = {'task': 'edit', 'entity': {'name': 'Person'}, 'unrelated': 2}
+
+		rule = self.model.ruleForKeyPathInContext('componentName', context1)
+		self.assertEqual(len(self.model._ruleCache), 1)
+		self.assertIs(self.model.ruleForKeyPathInContext('componentName', context2), rule)
+		self.assertEqual(len(self.model._ruleCache), 1)
+
+		self.assertEqual(self.model.fireRuleForKeyPathInContext('componentName', {'task': 'list'}), 'Default')
+		self.assertEqual(self.model.fireRuleForKeyPathInContext('componentName', {'task': 'edit'}), 'Edit')
+		self.assertEqual(len(self.model._ruleCache), 3)
+
+	def testEqualValuesOfDifferentTypesAreNotShared(self):
+		model = Model(rules=[Rule(Predicate.predicateWithFormat('flag == 1'), 'key', Expression.expressionForConstantValue(True))])
+		model.fireRuleForKeyPathInContext('key', {'flag': 1})
+		model.fireRuleForKeyPathInContext('key', {'flag': True})
+		self.assertEqual(len(model._ruleCache), 2)
+
+	def testUnhashableValuesAreNotCached(self):
+		self.model.fireRuleForKeyPathInContext('componentName', {'task': ['edit']})
+		self.assertEqual(len(self.model._ruleCache), 0)
+
+
+
+class ModelRuleChangesTest(unittest.TestCase):
+
+	def setUp(self):
+		self.rules = [
+			self._rule('task == "edit"', 'componentName', 'Edit'),
+			self._rule('TRUEPREDICATE', 'componentName', 'Default'),
+			self._rule('task == "list"', 'componentName', 'List'),
+			self._rule('TRUEPREDICATE', 'title', 'Title')
+		]
+
+	def _rule(self, format, key, value, weight=0):
+		return Rule(Predicate.predicateWithFormat(format), key, Expression.expressionForConstantValue(value), weight)
+
+	def _values(self, model, key):
+		return [rule.value.constantValue for rule in model._bucketForKey(key) or ()]
+
+	def testBucketsAreSortedStably(self):
+		model = Model(rules=self.rules)
+		self.assertEqual(self._values(model, 'componentName'), ['Edit', 'List', 'Default'])
+		self.assertEqual(self._values(model, 'title'), ['Title'])
+
+	def testAddRule(self):
+		for engine in (ModelEngineType.Default, ModelEngineType.Network):
+			model = Model(rules=self.rules, engine=engine)
+			context = {'task': 'inspect'}
+			self.assertEqual(model.fireRuleForKeyPathInContext('componentName', context), 'Default')
+			titleBucket = model._bucketForKey('title')
+
+			model.addRule(self._rule('task == "inspect"', 'componentName', 'Inspect'))
+			self.assertEqual(self._values(model, 'componentName'), ['Edit', 'List', 'Inspect', 'Default'])
+			self.assertEqual(model.fireRuleForKeyPathInContext('componentName', context), 'Inspect')
+			self.assertIs(model._bucketForKey('title'), titleBucket)
+
+			model.addRule(self._rule('TRUEPREDICATE', 'componentName', 'Weighted', 1))
+			self.assertEqual(model.fireRuleForKeyPathInContext('componentName', context), 'Weighted')
+
+			model.addRule(self._rule('TRUEPREDICATE', 'newKey', 'New'))
+			self.assertIn('newKey', model.inferrableKeys)
+			self.assertEqual(model.fireRuleForKeyPathInContext('newKey', context), 'New')
+			self.assertEqual(len(model.rules), 7)
+
+	def testRemoveRule(self):
+		for engine in (ModelEngineType.Default, ModelEngineType.Network):
+			model = Model(rules=self.rules, engine=engine)
+			context = {'task': 'edit'}
+			self.assertEqual(model.fireRuleForKeyPathInContext('componentName', context), 'Edit')
+
+			model.removeRule(self.rules[0])
+			self.assertEqual(self._values(model, 'componentName'), ['List', 'Default'])
+			self.assertEqual(model.fireRuleForKeyPathInContext('componentName', context), 'Default')
+
+			model.removeRule(self.rules[3])
+			self.assertNotIn('title', model.inferrableKeys)
+			self.assertIsNone(model.fireRuleForKeyPathInContext('title', context))
+			self.assertEqual(len(model.rules), 2)
+
+			with self.assertRaises(ValueError):
+				model.removeRule(self.rules[0])
+
+	def testRemoveEqualAndRepeatedRules(self):
+		model = Model(rules=self.rules + [self.rules[1]])
+		model.removeRule(self._rule('task == "edit"', 'componentName', 'Edit'))
+		self.assertEqual(self._values(model, 'componentName'), ['List', 'Default', 'Default'])
+		model.removeRule(self.rules[1])
+		self.assertEqual(self._values(model, 'componentName'), ['List', 'Default'])
+		self.assertEqual(model.rules, [self.rules[2], self.rules[3], self.rules[1]])
+		self.assertIs(model.rules[2], self.rules[1])
+
+	def testReplaceRules(self):
+		model = Model(rules=self.rules)
+		self.assertEqual(model.fireRuleForKeyPathInContext('componentName', {'task': 'list'}), 'List')
+		model.replaceRules([self.rules[2]], [self._rule('task == "list"', 'componentName', 'Table')])
+		self.assertEqual(self._values(model, 'componentName'), ['Edit', 'Table', 'Default'])
+		self.assertEqual(model.fireRuleForKeyPathInContext('componentName', {'task': 'list'}), 'Table')
+
+	def testRulesWithVariables(self):
+		rules = [self._rule('task == $task', 'componentName', 'Task')] + self.rules
+		model = Model(rules=rules, variables={'task': 'inspect'})
+		self.assertEqual(model.fireRuleForKeyPathInContext('componentName', {'task': 'inspect'}), 'Task')
+		model.removeRule(rules[0])
+		self.assertEqual(model.fireRuleForKeyPathInContext('componentName', {'task': 'inspect'}), 'Default')
+		model.addRule(self._rule('task == $task', 'componentName', 'Added'))
+		self.assertEqual(model.fireRuleForKeyPathInContext('componentName', {'task': 'inspect'}), 'Added')
+
+	def testOnlyTheChangedKeyIsInvalidated(self):
+		model = Model(rules=self.rules)
+		context = {'task': 'list'}
+		model.candidates('componentName', context)
+		self.assertEqual(model.fireRuleForKeyPathInContext('title', context), 'Title')
+		titleIndex = model._indexes['title']
+
+		model.addRule(self._rule('task == "list"', 'title', 'List'))
+		self.assertNotIn('title', model._indexes)
+		self.assertIn('componentName', model._indexes)
+		self.assertEqual(model.fireRuleForKeyPathInContext('title', context), 'List')
+		self.assertIsNot(model._indexes['title'], titleIndex)
+
+
+class ModelSimplificationTest(unittest.TestCase):
+
+	def setUp(self):
+		self.rules = [
+			Rule(Predicate.predicateWithFormat('TRUEPREDICATE AND TRUEPREDICATE AND task == "edit"'), 'title', Expression.expressionWithFormat('"Edit"')),
+			Rule(Predicate.predicateWithFormat('task == "edit" AND FALSEPREDICATE'), 'title', Expression.expressionWithFormat('"Never"'), 1),
+			Rule(Predicate.predicateWithFormat('TRUEPREDICATE'), 'columns', Expression.expressionWithFormat('2 * 3')),
+			Rule(Predicate.predicateWithFormat('1 == 2'), 'hidden', Expression.expressionWithFormat('TRUE'))
+		]
+
+	def testRulesAreSimplified(self):
+		model = Model(rules=self.rules)
+		rule, = model._bucketForKey('title')
+		self.assertEqual(rule.specifier, Predicate.predicateWithFormat('task == "edit"'))
+		self.assertEqual(rule.priority, self.rules[0].priority)
+		self.assertEqual(model._bucketForKey('columns')[0].value, Expression.expressionForConstantValue(6))
+		self.assertEqual(model.fireRuleForKeyPathInContext('title', {'task': 'edit'}), 'Edit')
+		self.assertEqual(model.fireRuleForKeyPathInContext('columns', {}), 6)
+
+		# The model's rules are left as they were written
+		self.assertEqual(model.rules, self.rules)
+		self.assertEqual(model.rules[0].specifier, Predicate.predicateWithFormat('TRUEPREDICATE AND TRUEPREDICATE AND task == "edit"'))
+
+	def testFiredAggregatesAreNotShared(self):
+		model = Model(rules=[Rule(Predicate.predicateWithFormat('TRUEPREDICATE'), 'fields', Expression.expressionWithFormat('{"name", "email"}'))])
+		model.fireRuleForKeyPathInContext('fields', {}).append('phone')
+		self.assertEqual(model.fireRuleForKeyPathInContext('fields', {}), ['name', 'email'])
+
+	def testRulesThatCanNeverFireAreDropped(self):
+		for engine in (ModelEngineType.Default, ModelEngineType.Network):
+			model = Model(rules=self.rules, engine=engine)
+			self.assertEqual(len(model._bucketForKey('title')), 1)
+			self.assertEqual(model._bucketForKey('hidden'), [])
+			self.assertIn('hidden', model.inferrableKeys)
+			self.assertIsNone(model.fireRuleForKeyPathInContext('hidden', {}))
+			self.assertEqual(model.fireAllRulesForKeyPathInContext('hidden', {}), [])
+
+			model.addRule(Rule(Predicate.predicateWithFormat('FALSEPREDICATE'), 'other', Expression.expressionForConstantValue(1)))
+			self.assertIn('other', model.inferrableKeys)
+			self.assertIsNone(model.fireRuleForKeyPathInContext('other', {}))
+
+			model.removeRule(self.rules[0])
+			model.removeRule(self.rules[1])
+			self.assertEqual(model._bucketForKey('title'), None)
+			self.assertIsNone(model.fireRuleForKeyPathInContext('title', {'task': 'edit'}))
+
+
+class LRUCacheTest(unittest.TestCase):
+
+	def testLeastRecentlyUsedItemIsDiscarded(self):
+		cache = LRUCache(2)
+		cache['a'] = 1
+		cache['b'] = 2
+		self.assertEqual(cache.get('a'), 1)
+		cache['c'] = 3
+		self.assertIn('a', cache)
+		self.assertNotIn('b', cache)
+		self.assertEqual(len(cache), 2)
+
+class ModelBatchInferenceTest(unittest.TestCase):
+
+	def setUp(self):
+		def rule(format, key, value):
+			return Rule(Predicate.predicateWithFormat(format), key, Expression.expressionForConstantValue(value))
+
+		self.rules = [
+			rule('task == "edit" AND entity.name == "Person"', 'componentName', 'EditPerson'),
+			rule('task == "edit"', 'componentName', 'Edit'),
+			rule('count > 5', 'componentName', 'Many')
+		]
+		self.contexts = [
+			{'task': task, 'entity': {'name': entity}, 'count': count}
+			for task in ('edit', 'list') for entity in ('Person', 'Address') for count in (1, 10)
+		]
+
+	def testBatchMatchesSingleInference(self):
+		for model in (Model(rules=self.rules), Model(rules=self.rules, ruleCacheSize=0), Model(rules=self.rules, engine=ModelEngineType.Network)):
+			expected = [model.fireRuleForKeyPathInContext('componentName', context) for context in self.contexts]
+			self.assertEqual(model.fireRuleForKeyPathInContexts('componentName', self.contexts), expected)
+			self.assertIn(None, expected)
+
+	def testMissingKey(self):
+		model = Model(rules=self.rules)
+		self.assertEqual(model.fireRuleForKeyPathInContexts('missing', self.contexts[:2]), [None, None])
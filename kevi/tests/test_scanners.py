@@ -1,9 +1,11 @@
+import io
+import itertools
 import pkg_resources
 import string
 import unittest
 
 from .. import expressions, predicates
-from ..scanners import Scanner, ExpressionScanner, PredicateScanner, ModelScanner
+from ..scanners import Scanner, ExpressionScanner, PredicateScanner, ModelScanner, StreamingModelScanner
 
 class ScannerTest(unittest.TestCase):
 
@@ -52,6 +54,36 @@ class ScannerTest(unittest.TestCase):
 		self.assertEqual(scanner.scanUpToString('1'), 'bravo')
 		self.assertEqual(scanner.scanLocation, 20)
 
+	def testScanNumberFormats(self):
+		for string, expected, location in (
+			('42', 42, 2),
+			('-42 ', -42, 3),
+			('+3.25x', 3.25, 5),
+			('.5', 0.5, 2),
+			('6.02e23', 6.02e23, 7),
+			('1E-3', 0.001, 4),
+			('0x1F', 31, 4),
+			('12e', 12, 2),
+		):
+			scanner = Scanner(string)
+			result = scanner.scanNumber()
+			self.assertEqual(result, expected)
+			self.assertIs(type(result), type(expected))
+			self.assertEqual(scanner.scanLocation, location)
+
+	def testScanIntDoesNotConsumeFraction(self):
+		scanner = Scanner('12.5')
+		self.assertEqual(scanner.scanInt(), 12)
+		self.assertEqual(scanner.scanLocation, 2)
+		self.assertIsNone(Scanner('alpha').scanInt())
+		self.assertIsNone(Scanner('alpha').scanFloat())
+
+	def testScanFloatReturnsFloat(self):
+		scanner = Scanner('0x10')
+		result = scanner.scanFloat()
+		self.assertEqual(result, 16.0)
+		self.assertIs(type(result), float)
+
 	def testScanCharactersFromSet(self):
 		scanner = Scanner(self.strings_and_numbers)
 		result = scanner.scanCharactersFromSet(string.ascii_lowercase)
@@ -86,6 +118,14 @@ class ExpressionScannerTest(unittest.TestCase):
 		self.assertEqual(expression.constantValue, 1)
 		self.assertTrue(scanner.atEnd)
 
+	def testNumbersParseLikeScannedNumbers(self):
+		for string in ('-42', '+3.25', '.5', '-.5e2', '-0x1F'):
+			expression = ExpressionScanner(string).parseExpression()
+			self.assertIsInstance(expression, expressions.ConstantValueExpression)
+			self.assertEqual(expression.constantValue, Scanner(string).scanNumber())
+		self.assertEqual(ExpressionScanner('5-2').parseExpression().expressionValueWithObject(None), 3)
+		self.assertEqual(ExpressionScanner('- count').parseExpression().expressionValueWithObject({'count': 2}), -2)
+
 	def testParseStringConstantValueExpression(self):
 		for string in ('"string"', "'string'"):
 			scanner = ExpressionScanner(string)
@@ -244,6 +284,13 @@ class PredicateScannerTest(unittest.TestCase):
 			self.assertEqual(predicate.options, options)
 			self.assertTrue(scanner.atEnd)
 
+	def testParseKeywordsAreWholeTokens(self):
+		scanner = PredicateScanner('NOTE == 1')
+		predicate = scanner.parsePredicate()
+		self.assertIsInstance(predicate, predicates.ComparisonPredicate)
+		self.assertEqual(predicate.leftExpression.keyPath, 'NOTE')
+		self.assertTrue(scanner.atEnd)
+
 
 class ModelScannerTest(unittest.TestCase):
 
@@ -321,4 +368,133 @@ class ModelScannerTest(unittest.TestCase):
 		self.assertFalse(predicate.value)
 
 		self.assertEqual(rule.key, 'key2')
-		self.assertEqual(rule.value.constantValue, '2')		
+		self.assertEqual(rule.value.constantValue, '2')
+
+	def testParseModelString(self):
+		scanner = ModelScanner('task == "edit" AND count > 25 {\n\tdisplay-name: "Edit"; weight: 0.5;\n}\n')
+		model = scanner.parseModel()
+		self.assertEqual(scanner.lineNumber, 4)
+		self.assertTrue(scanner.atEnd)
+		self.assertEqual([rule.key for rule in model.rules], ['display-name', 'weight'])
+		self.assertEqual(model.rules[0].specifier.subpredicates[1].rightExpression.constantValue, 25)
+		self.assertEqual(model.rules[1].value.constantValue, 0.5)
+
+	def testNestedSpecifiersAreCombinedPredicates(self):
+		scanner = ModelScanner('''
+			a == 1 AND b == 2 {
+				k1: 1; k2: 2;
+				c == 3 OR d == 4 {
+					k3: 3; k4: 4;
+				}
+			}
+		''')
+		model = scanner.parseModel()
+		self.assertTrue(scanner.atEnd)
+		self.assertEqual([rule.key for rule in model.rules], ['k1', 'k2', 'k3', 'k4'])
+
+		# The rules of one specifier share its predicate
+		self.assertIs(model.rules[0].specifier, model.rules[1].specifier)
+		self.assertIs(model.rules[2].specifier, model.rules[3].specifier)
+
+		# The parent's conjunction is flattened, and the child's disjunction
+		# stays a single term
+		specifier = model.rules[2].specifier
+		self.assertEqual(specifier.compoundPredicateType, predicates.CompoundPredicateType.And)
+		self.assertEqual(len(specifier.subpredicates), 3)
+		self.assertIs(specifier.subpredicates[0], model.rules[0].specifier.subpredicates[0])
+		self.assertEqual(specifier.subpredicates[2].compoundPredicateType, predicates.CompoundPredicateType.Or)
+		self.assertEqual(model.rules[2].priority, 1 + 2 + 2 + (1 + 2 + 2))
+
+		self.assertFalse(model.rules[2].canFireInContext({'a': 1, 'b': 3, 'c': 3}))
+		self.assertTrue(model.rules[2].canFireInContext({'a': 1, 'b': 2, 'd': 4}))
+
+	def testEqualSubtreesAreShared(self):
+		scanner = ModelScanner('''
+			task == "edit" { title: entity.name; }
+			task == "edit" AND count > 2 { title: entity.name; }
+			task == "list" {
+				count > 2 { color: "red"; }
+			}
+		''')
+		model = scanner.parseModel()
+		self.assertTrue(scanner.atEnd)
+		rule1, rule2, rule3 = model.rules
+
+		self.assertIs(rule1.specifier, rule2.specifier.subpredicates[0])
+		self.assertIs(rule2.specifier.subpredicates[1], rule3.specifier.subpredicates[1])
+		self.assertIs(rule1.value, rule2.value)
+		self.assertIs(rule1.specifier.leftExpression, rule3.specifier.subpredicates[0].leftExpression)
+
+
+class ReadCountingFile(object):
+
+	def __init__(self, data):
+		self.file = io.BytesIO(data) if isinstance(data, bytes) else io.StringIO(data)
+		self.reads = 0
+
+	def read(self, size):
+		self.reads += 1
+		return self.file.read(size)
+
+
+class StreamingModelScannerTest(unittest.TestCase):
+
+	Source = '''
+		task == "edit" { title: "Édition"; color: 'red'; }
+		entity.name IN {"a", "b"} {
+			title: entity.name;
+			count > 2 { title: "Many"; }
+		}
+		TRUEPREDICATE { items: {1, 2.5, "}"}; }
+	'''
+
+	def testRulesMatchModelScanner(self):
+		expected = ModelScanner(self.Source).parseModel().rules
+		for chunkSize in (1, 3, 16, 4096):
+			rules = list(StreamingModelScanner(io.StringIO(self.Source), chunkSize=chunkSize).parseRules())
+			self.assertEqual(rules, expected, chunkSize)
+
+	def testBytesAreDecoded(self):
+		expected = ModelScanner(self.Source).parseModel().rules
+		for chunkSize in (1, 5):
+			rules = list(StreamingModelScanner(io.BytesIO(self.Source.encode('utf-8')), chunkSize=chunkSize).parseRules())
+			self.assertEqual(rules, expected, chunkSize)
+		self.assertEqual(rules[0].value.constantValue, 'Édition')
+
+	def testRulesAreYieldedBeforeTheEnd(self):
+		source = ''.join('task == "t%i" { key: %i; }\n' % (i, i) for i in range(100))
+		f = ReadCountingFile(source)
+		rules = StreamingModelScanner(f, chunkSize=64).parseRules()
+		rule = next(rules)
+		self.assertEqual(rule.value.constantValue, 0)
+		self.assertLess(f.reads, 3)
+		self.assertEqual(len(list(rules)), 99)
+
+	def testModelSharesEqualSubtrees(self):
+		model = StreamingModelScanner(io.StringIO(self.Source), chunkSize=8).parseModel()
+		self.assertIs(model.rules[2].specifier, model.rules[3].specifier.subpredicates[0])
+
+	def testErrorLineNumber(self):
+		source = 'TRUEPREDICATE { a: 1; }\nTRUEPREDICATE {\n\tb: 2;\n}\nTRUEPREDICATE {\n\tc: ;\n}\n'
+		scanner = StreamingModelScanner(io.StringIO(source), chunkSize=4)
+		rules = scanner.parseRules()
+		self.assertEqual([rule.key for rule in itertools.islice(rules, 2)], ['a', 'b'])
+		with self.assertRaises(ValueError) as e:
+			list(rules)
+		self.assertIn('line 5', str(e.exception))
+
+	def testErrorIsRaisedBeforeTheEnd(self):
+		source = 'TRUEPREDICATE { a: 1; }\nTRUEPREDICATE { b: ; }\n' + ''.join('task == "t%i" { key: %i; }\n' % (i, i) for i in range(100))
+		f = ReadCountingFile(source)
+		rules = StreamingModelScanner(f, chunkSize=16).parseRules()
+		self.assertEqual(next(rules).key, 'a')
+		with self.assertRaises(ValueError) as e:
+			next(rules)
+		self.assertIn('line 2', str(e.exception))
+		self.assertLess(f.reads, 10)
+
+	def testOpenStringsAreNotErrors(self):
+		source = 'TRUEPREDICATE { a: "}"; }\nTRUEPREDICATE { b: "x } {"; }\n'
+		for chunkSize in (1, 2, 7):
+			rules = list(StreamingModelScanner(io.StringIO(source), chunkSize=chunkSize).parseRules())
+			self.assertEqual([rule.value.constantValue for rule in rules], ['}', 'x } {'], chunkSize)
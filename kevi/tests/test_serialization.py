@@ -0,0 +1,365 @@
+import marshal
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from .. import serialization
+from ..predicates import Predicate
+from ..rules import Model, ModelEngineType
+from ..scanners import ModelScanner
+
+ModelSource = '''
+TRUEPREDICATE {
+	title: "Item";
+	color: "black";
+}
+task == "edit" {
+	title: entity.name;
+	count > 2 OR entity.name IN {"a", "b"} {
+		color: "red";
+	}
+}
+task == "list", task == "inspect" {
+	title: $default;
+	items: {1, 2.5, "three", NULL, TRUE};
+}
+'''
+
+def describeRule(rule):
+	# A nested tuple describing the structure of a rule
+	encoder = serialization._Encoder()
+	def describe(index):
+		node = encoder.nodes[index]
+		fields = []
+		for kind, field in zip(serialization._NodeFields[node[0]], node[1:]):
+			if kind == 'r':
+				fields.append(describe(field))
+			elif kind == 'R':
+				fields.append(tuple(describe(i) for i in field))
+			else:
+				fields.append((field.__class__, field))
+		return (node[0],) + tuple(fields)
+	return (
+		describe(encoder.encode(rule.specifier)),
+		rule.key,
+		describe(encoder.encode(rule.value)),
+		rule.weight,
+		rule.priority
+	)
+
+class SerializationTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.model = ModelScanner(ModelSource).parseModel()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def _roundTrip(self, model):
+		path = os.path.join(self.directory, 'model.irlc')
+		model.save(path)
+		return Model.load(path)
+
+	def testRoundTripKeepsRulesAndOrder(self):
+		loaded = self._roundTrip(self.model)
+		self.assertEqual(len(loaded.rules), len(self.model.rules))
+		for original, rule in zip(self.model.rules, loaded.rules):
+			self.assertEqual(describeRule(rule), describeRule(original))
+
+	def testRoundTripKeepsBucketLayout(self):
+		loaded = self._roundTrip(self.model)
+		self.assertEqual(sorted(loaded.inferrableKeys), sorted(self.model.inferrableKeys))
+		for key in self.model.inferrableKeys:
+			self.assertEqual([describeRule(r) for r in loaded._buckets[key]], [describeRule(r) for r in self.model._buckets[key]])
+
+	def testRoundTripInference(self):
+		loaded = self._roundTrip(self.model)
+		for context in (
+			{'task': 'edit', 'entity': {'name': 'a'}, 'count': 0},
+			{'task': 'edit', 'entity': {'name': 'z'}, 'count': 1},
+			{'task': 'list'},
+			{},
+		):
+			for key in ('title', 'color', 'items'):
+				self.assertEqual(loaded.fireRuleForKeyPathInContext(key, context),
+				                 self.model.fireRuleForKeyPathInContext(key, context))
+
+	def testSharedPredicatesStayShared(self):
+		loaded = self._roundTrip(self.model)
+		# Within the rules of one specifier, and across buckets
+		self.assertIs(loaded.rules[4].specifier, loaded.rules[5].specifier)
+		self.assertIs(loaded.rules[6].specifier, loaded.rules[7].specifier)
+		self.assertIs(loaded.rules[3].specifier.subpredicates[0], loaded.rules[2].specifier)
+		self.assertIsNot(loaded.rules[4].specifier, loaded.rules[6].specifier)
+
+	def testConstantTypesArePreserved(self):
+		loaded = self._roundTrip(self.model)
+		items = loaded.fireRuleForKeyPathInContext('items', {'task': 'list'})
+		self.assertEqual([type(value) for value in items], [int, float, str, type(None), bool])
+
+	def testModelSettingsArePreserved(self):
+		model = Model(rules=self.model.rules, variables={'default': 'Default'}, engine=ModelEngineType.Network, ruleCacheSize=16)
+		loaded = self._roundTrip(model)
+		self.assertEqual(loaded.engine, ModelEngineType.Network)
+		self.assertEqual(loaded._ruleCache.capacity, 16)
+		self.assertEqual(loaded.fireRuleForKeyPathInContext('title', {'task': 'list'}), None)
+		self.assertEqual(loaded.rules[4].value.variable, 'default')
+
+	def testVariablesAreSubstitutedAfterLoading(self):
+		model = ModelScanner('task == $task { key: "value"; }').parseModel()
+		model = Model(rules=model.rules, variables={'task': 'edit'})
+		loaded = self._roundTrip(model)
+		self.assertEqual(loaded.rules[0].specifier.rightExpression.variable, 'task')
+		self.assertEqual(loaded.fireRuleForKeyPathInContext('key', {'task': 'edit'}), 'value')
+		self.assertIsNone(loaded.fireRuleForKeyPathInContext('key', {'task': 'list'}))
+
+	def testRulesAreSavedSimplified(self):
+		model = ModelScanner('TRUEPREDICATE AND task == "edit" { columns: 2 * 3; } FALSEPREDICATE { hidden: TRUE; } task == $task AND 1 == 1 { title: "Task"; }').parseModel()
+		for variables in (None, {'task': 'edit'}):
+			loaded = self._roundTrip(Model(rules=model.rules, variables=variables))
+			self.assertEqual(loaded.rules, model.rules)
+			self.assertEqual(loaded._buckets['columns'][0].specifier, Predicate.predicateWithFormat('task == "edit"'))
+			self.assertEqual(loaded._buckets['columns'][0].priority, model.rules[0].priority)
+			self.assertEqual(loaded._buckets['columns'][0].value.constantValue, 6)
+			self.assertEqual(loaded._buckets['hidden'], [])
+			self.assertEqual(loaded.fireRuleForKeyPathInContext('columns', {'task': 'edit'}), 6)
+			self.assertEqual(loaded.fireRuleForKeyPathInContext('title', {'task': 'edit'}), 'Task' if variables else None)
+
+	def testChangingLoadedRules(self):
+		model = Model(rules=self.model.rules, variables={'default': 'Default'})
+		loaded = self._roundTrip(model)
+		context = {'task': 'edit', 'entity': {'name': 'a'}}
+		self.assertEqual(loaded.fireRuleForKeyPathInContext('title', context), 'a')
+		loaded.removeRule(loaded.rules[2])
+		self.assertEqual(loaded.fireRuleForKeyPathInContext('title', context), 'Item')
+		loaded.addRule(model.rules[2])
+		self.assertEqual(loaded.fireRuleForKeyPathInContext('title', context), 'a')
+		self.assertEqual(len(loaded.rules), len(model.rules))
+
+	def testInvalidData(self):
+		with self.assertRaises(ValueError):
+			serialization.decodeModel(b'not a model')
+		data = serialization.encodeModel(self.model)
+		with self.assertRaises(ValueError):
+			serialization.decodeModel(data[:4] + b'\xff\xff' + data[6:])
+		with self.assertRaises(ValueError):
+			serialization.decodeModel(data[:12])
+
+	def testMalformedHeadersAreRejected(self):
+		data = serialization.encodeModel(Model._modelFromString(ModelSource))
+		header, start = serialization.decodeHeader(data)
+		for field, value in (
+			('ruleCount', '3'),
+			('ruleCount', None),
+			('ruleCacheSize', 1.5),
+			('engine', 'network'),
+			('segments', None),
+			('segments', [('title', 0)]),
+			('segments', [(1, 0, 10)]),
+			('segments', [('title', '0', 10)]),
+			('source', 'oops'),
+			('source', {'mtime': 1}),
+			('source', {'mtime': 1, 'size': 2, 'sha256': None}),
+			('variables', [])
+		):
+			malformed = dict(header)
+			malformed[field] = value
+			encodedHeader = marshal.dumps(malformed)
+			with self.assertRaises(ValueError, msg=(field, value)):
+				serialization.decodeHeader(serialization._Preamble.pack(serialization.Magic, serialization.Version, len(encodedHeader)) + encodedHeader)
+		for field in ('variables', 'engine'):
+			malformed = dict(header)
+			del malformed[field]
+			encodedHeader = marshal.dumps(malformed)
+			with self.assertRaises(ValueError, msg=field):
+				serialization.decodeHeader(serialization._Preamble.pack(serialization.Magic, serialization.Version, len(encodedHeader)) + encodedHeader)
+
+	def testOnlyPlainValuesAreLoaded(self):
+		code = compile('None', '<rules>', 'eval')
+		header = marshal.dumps({'segments': [], 'source': code})
+		with self.assertRaises(ValueError):
+			serialization.decodeHeader(serialization._Preamble.pack(serialization.Magic, serialization.Version, len(header)) + header)
+		with self.assertRaises(ValueError):
+			serialization.decodeSegment(marshal.dumps(([(serialization._ConstantValue, code)], [])), 'key')
+		with self.assertRaises(ValueError):
+			serialization.decodeSegment(marshal.dumps(([(serialization._ConstantValue, 1, code)], [])), 'key')
+
+
+class ModelFileCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'model.irl')
+		self.cachePath = os.path.join(self.directory, 'model.irlc')
+		with open(self.path, 'w') as f:
+			f.write(ModelSource)
+		self.parses = 0
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def _parse(self, data):
+		self.parses += 1
+		return Model._modelFromString(data)
+
+	def _load(self):
+		return serialization.modelFromFileWithCache(self.path, self._parse)
+
+	def testCacheIsWrittenAndUsed(self):
+		model = self._load()
+		self.assertTrue(os.path.exists(self.cachePath))
+		self.assertEqual(self.parses, 1)
+
+		cached = self._load()
+		self.assertEqual(self.parses, 1)
+		self.assertEqual([describeRule(r) for r in cached.rules], [describeRule(r) for r in model.rules])
+
+	def testTouchedSourceWithSameContentsUsesCache(self):
+		self._load()
+		stat = os.stat(self.path)
+		os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+		self._load()
+		self.assertEqual(self.parses, 1)
+
+	def testChangedSourceIsParsedAgain(self):
+		self._load()
+		with open(self.path, 'a') as f:
+			f.write('FALSEPREDICATE { extra: 1; }\n')
+		model = self._load()
+		self.assertEqual(self.parses, 2)
+		self.assertIn('extra', model.inferrableKeys)
+
+	def testCorruptCacheIsParsedAgain(self):
+		with open(self.cachePath, 'wb') as f:
+			f.write(b'IRLC garbage')
+		self._load()
+		self.assertEqual(self.parses, 1)
+		self._load()
+		self.assertEqual(self.parses, 1)
+
+	def testCorruptCacheHeaderIsParsedAgain(self):
+		self._load()
+		with open(self.cachePath, 'rb') as f:
+			data = f.read()
+		header, start = serialization.decodeHeader(data)
+		header['source'] = 'oops'
+		encodedHeader = marshal.dumps(header)
+		with open(self.cachePath, 'wb') as f:
+			f.write(serialization._Preamble.pack(serialization.Magic, serialization.Version, len(encodedHeader)) + encodedHeader + data[start:])
+		self._load()
+		self.assertEqual(self.parses, 2)
+		self._load()
+		self.assertEqual(self.parses, 2)
+
+	def testModelFromFile(self):
+		model = Model.modelFromFile(self.path)
+		self.assertFalse(os.path.exists(self.cachePath))
+		self.assertEqual(len(Model.modelFromFile(self.path, cache=True).rules), len(model.rules))
+		self.assertTrue(os.path.exists(self.cachePath))
+		self.assertEqual(len(Model.modelFromFile(self.path, cache=True).rules), len(model.rules))
+
+
+class MappedModelTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'model.irlc')
+		self.model = ModelScanner(ModelSource).parseModel()
+		self.model.save(self.path)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def testBucketsAreDecodedOnDemand(self):
+		model = Model.load(self.path, mapped=True)
+		self.assertIsInstance(model, serialization.MappedModel)
+		self.assertEqual(sorted(model.inferrableKeys), sorted(self.model.inferrableKeys))
+		self.assertEqual(model._buckets, {})
+
+		context = {'task': 'edit', 'entity': {'name': 'a'}, 'count': 0}
+		self.assertEqual(model.fireRuleForKeyPathInContext('color', context), 'red')
+		self.assertEqual(list(model._buckets.keys()), ['color'])
+		self.assertEqual(model.fireRuleForKeyPathInContext('title', context), 'a')
+		self.assertIsNone(model.fireRuleForKeyPathInContext('missing', context))
+		self.assertEqual(sorted(model._buckets.keys()), ['color', 'title'])
+		model.close()
+
+	def testRulesAreDecodedInOrder(self):
+		model = Model.load(self.path, mapped=True)
+		self.assertEqual([describeRule(r) for r in model.rules], [describeRule(r) for r in self.model.rules])
+		self.assertEqual(sorted(model._buckets.keys()), sorted(self.model.inferrableKeys))
+		model.close()
+
+	def testRulesCannotBeChanged(self):
+		model = Model.load(self.path, mapped=True)
+		with self.assertRaises(TypeError):
+			model.addRule(self.model.rules[0])
+		with self.assertRaises(TypeError):
+			model.removeRule(self.model.rules[0])
+		with self.assertRaises(TypeError):
+			model.removeShadowedRules()
+		model.close()
+
+	def testNetworkEngine(self):
+		Model(rules=self.model.rules, engine=ModelEngineType.Network).save(self.path)
+		model = Model.load(self.path, mapped=True)
+		self.assertEqual(model.fireRuleForKeyPathInContext('color', {'task': 'edit', 'count': 3}), 'red')
+		self.assertEqual(model.fireRuleForKeyPathInContext('color', {'task': 'list'}), 'black')
+		self.assertGreater(model._network.conditionCount, 0)
+		model.close()
+
+
+class ModelFromFilesTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.paths = []
+		for i, source in enumerate((ModelSource, 'task == "edit" { color: "blue"; extra: entity.name; }', 'FALSEPREDICATE { extra: 1; }')):
+			path = os.path.join(self.directory, 'model%i.irl' % i)
+			with open(path, 'w') as f:
+				f.write(source)
+			self.paths.append(path)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def _expectedRules(self):
+		rules = []
+		for path in self.paths:
+			rules.extend(Model.modelFromFile(path, cache=False).rules)
+		return rules
+
+	def testRulesAreMergedInOrder(self):
+		expected = [describeRule(r) for r in self._expectedRules()]
+		for workers in (1, 2):
+			model = Model.modelFromFiles(self.paths, workers=workers, cache=False)
+			self.assertEqual([describeRule(r) for r in model.rules], expected)
+			self.assertEqual(model.fireRuleForKeyPathInContext('color', {'task': 'edit', 'count': 0}), 'blue')
+			self.assertEqual(model.fireRuleForKeyPathInContext('extra', {'task': 'edit', 'entity': {'name': 'a'}}), 'a')
+
+	def testEqualPredicatesAreSharedAcrossFiles(self):
+		model = Model.modelFromFiles(self.paths, workers=2, cache=False)
+		self.assertIs(model.rules[2].specifier, model.rules[8].specifier)
+		self.assertIs(model.rules[2].value, model.rules[9].value)
+
+	def testWorkersDoNotSortRulesIntoBuckets(self):
+		expected = [describeRule(r) for r in Model.modelFromFile(self.paths[0]).rules]
+		with unittest.mock.patch.object(Model, '_sortRulesIntoBuckets', side_effect=AssertionError):
+			for cache in (False, True, True):
+				rules = serialization.decodeRules(serialization._encodedRulesFromFile(self.paths[0], cache=cache))
+				self.assertEqual([describeRule(r) for r in rules], expected)
+
+		# The cache written by a worker is used when loading the file alone
+		model = serialization.modelFromFileWithCache(self.paths[0], self.fail)
+		self.assertEqual([describeRule(r) for r in model.rules], expected)
+
+	def testCachesAreWritten(self):
+		Model.modelFromFiles(self.paths, workers=2)
+		for path in self.paths:
+			self.assertFalse(os.path.exists(serialization.cachePathForPath(path)))
+		Model.modelFromFiles(self.paths, workers=2, cache=True)
+		for path in self.paths:
+			self.assertTrue(os.path.exists(serialization.cachePathForPath(path)))
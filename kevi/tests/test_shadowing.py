@@ -0,0 +1,118 @@
+import unittest
+
+from ..expressions import Expression
+from ..predicates import Predicate
+from ..rules import Rule, Model, ModelEngineType
+from ..shadowing import predicateImplies, shadowedRulesInBucket
+
+class PredicateImplicationTest(unittest.TestCase):
+
+	def _assertImplies(self, format, otherFormat, implies=True):
+		predicate = Predicate.predicateWithFormat(format)
+		other = Predicate.predicateWithFormat(otherFormat)
+		self.assertEqual(predicateImplies(predicate, other), implies, (format, otherFormat))
+
+	def testEqualityTests(self):
+		self._assertImplies('x == 1', 'x == 1')
+		self._assertImplies('x == 1', 'x IN {1, 2}')
+		self._assertImplies('x == "a"', 'x != "b"')
+		self._assertImplies('x IN {1, 2}', 'x == 1', False)
+		self._assertImplies('x == 1', 'y == 1', False)
+		self._assertImplies('x == 1', 'x ==[c] 1', False)
+
+	def testRangeTests(self):
+		self._assertImplies('x > 5', 'x > 3')
+		self._assertImplies('x > 3', 'x >= 3')
+		self._assertImplies('3 < x', 'x > 2')
+		self._assertImplies('x == 3', 'x BETWEEN {0, 10}')
+		self._assertImplies('x > 1 AND x <= 5', 'x BETWEEN {0, 10}')
+		self._assertImplies('x > 3', 'x != 2')
+		self._assertImplies('x >= 3', 'x > 3', False)
+		self._assertImplies('x > 3', 'x != 4', False)
+		self._assertImplies('x > 1 AND x < 20', 'x BETWEEN {0, 10}', False)
+
+	def testCompoundPredicates(self):
+		self._assertImplies('x == 1 AND y == 2', 'x == 1')
+		self._assertImplies('x == 1 AND y == 2', 'y == 2 AND x IN {1, 3}')
+		self._assertImplies('x == 1', 'x == 1 OR y == 2')
+		self._assertImplies('x == 1 OR x == 2', 'x IN {1, 2}')
+		self._assertImplies('x IN {1, 2}', 'x == 2 OR x == 1 OR y == 3')
+		self._assertImplies('x IN {1, 2}', 'x == 2 OR y == 3', False)
+		self._assertImplies('NOT x IN {1, 2}', 'NOT x == 1')
+		self._assertImplies('x == 1', 'TRUEPREDICATE')
+		self._assertImplies('FALSEPREDICATE', 'x == 1')
+		self._assertImplies('x == 1', 'x == 1 AND y == 2', False)
+		self._assertImplies('x == 1 OR y == 2', 'x == 1', False)
+
+	def testOtherPredicates(self):
+		self._assertImplies('name MATCHES "a.*"', 'name MATCHES "a.*"')
+		self._assertImplies('name MATCHES "a.*"', 'name MATCHES "a.+"', False)
+		self._assertImplies('random:(1) == 0', 'random:(1) == 0', False)
+
+
+class ShadowedRulesTest(unittest.TestCase):
+
+	def setUp(self):
+		self.rules = [
+			self._rule('task == "edit" AND entity.name == "Book"', 'title', 'Edit Book', 1),
+			self._rule('task == "edit"', 'title', 'Edit'),
+			self._rule('task == "edit" AND entity.name == "Book" AND count > 2', 'title', 'Edit Books'),
+			self._rule('task == "edit"', 'title', 'Edit Again'),
+			self._rule('task IN {"list", "inspect"}', 'title', 'View'),
+			self._rule('task == "list" OR task == "inspect"', 'title', 'View Again'),
+			self._rule('task == "list" AND count > 2', 'title', 'Long List'),
+			self._rule('count BETWEEN {0, 10}', 'title', 'Few'),
+			self._rule('count > 20', 'title', 'Many'),
+			self._rule('TRUEPREDICATE', 'color', 'black', 1),
+			self._rule('task == "edit"', 'color', 'red')
+		]
+		self.contexts = [
+			{'task': task, 'entity': {'name': name}, 'count': count}
+			for task in ('edit', 'list', 'inspect', 'query')
+			for name in ('Book', 'Author')
+			for count in (0, 3, 15, 30)
+		]
+
+	def _rule(self, format, key, value, weight=0):
+		return Rule(Predicate.predicateWithFormat(format), key, Expression.expressionForConstantValue(value), weight)
+
+	def _values(self, shadowedRules):
+		return [(s.rule.value.constantValue, s.shadowingRule.value.constantValue, s.isDuplicate) for s in shadowedRules]
+
+	def testShadowedRulesInBucket(self):
+		model = Model(rules=self.rules)
+		self.assertEqual(self._values(shadowedRulesInBucket(model._bucketForKey('title'))), [
+			('Edit Books', 'Edit Book', False),
+			('Long List', 'View Again', False),
+			('Edit Again', 'Edit', True),
+			('View', 'View Again', False)
+		])
+		self.assertEqual(self._values(model.shadowedRules()), self._values(shadowedRulesInBucket(model._bucketForKey('title'))) + [
+			('red', 'black', False)
+		])
+
+	def testRemoveShadowedRules(self):
+		for engine in (ModelEngineType.Default, ModelEngineType.Network):
+			model = Model(rules=self.rules, engine=engine)
+			results = [(model.fireRuleForKeyPathInContext('title', c), model.fireRuleForKeyPathInContext('color', c)) for c in self.contexts]
+
+			self.assertEqual(len(model.removeShadowedRules()), 5)
+			self.assertEqual(len(model.rules), len(self.rules) - 5)
+			self.assertEqual(len(model._bucketForKey('title')), 5)
+			self.assertEqual(model.shadowedRules(), [])
+			self.assertEqual([(model.fireRuleForKeyPathInContext('title', c), model.fireRuleForKeyPathInContext('color', c)) for c in self.contexts], results)
+
+			# The rules that are left can still be changed
+			rule = model.rules[0]
+			bucketSize = len(model._bucketForKey(rule.key))
+			model.removeRule(rule)
+			self.assertEqual(len(model._bucketForKey(rule.key)), bucketSize - 1)
+			self.assertEqual(len(model.rules), len(self.rules) - 6)
+
+	def testRemoveShadowedRulesWithVariables(self):
+		rules = [self._rule('task == $task', 'title', 'Task'), self._rule('task == "edit"', 'title', 'Edit')] + self.rules
+		model = Model(rules=rules, variables={'task': 'edit'})
+		model.removeShadowedRules()
+		self.assertNotIn(rules[1], model.rules)
+		self.assertIs(model.rules[0], rules[0])
+		self.assertEqual(model.fireRuleForKeyPathInContext('title', {'task': 'edit'}), 'Task')
@@ -0,0 +1,60 @@
+import unittest
+
+from ..tokenizer import TokenType, tokenize
+
+class TokenizerTest(unittest.TestCase):
+
+	def _types(self, string):
+		return [token.type for token in tokenize(string)]
+
+	def _texts(self, string):
+		return [token.text for token in tokenize(string)]
+
+	def testEmptyString(self):
+		tokens = tokenize('')
+		self.assertEqual(len(tokens), 1)
+		self.assertEqual(tokens[0].type, TokenType.End)
+		self.assertEqual(tokens[0].line, 1)
+
+	def testTokenTypes(self):
+		self.assertEqual(self._types('name == "value" AND count >= 1.5'), [
+			TokenType.Identifier, TokenType.Operator, TokenType.String,
+			TokenType.Identifier, TokenType.Identifier, TokenType.Operator,
+			TokenType.Number, TokenType.End
+		])
+
+	def testMultiCharacterOperators(self):
+		self.assertEqual(self._texts('a<=b=>c<>d&&e||f**g:=h'), [
+			'a', '<=', 'b', '=>', 'c', '<>', 'd', '&&', 'e', '||', 'f', '**', 'g', ':=', 'h', ''
+		])
+
+	def testTokenValues(self):
+		tokens = tokenize("12 'single' \"double\" ''")
+		self.assertEqual(tokens[0].value, 12.0)
+		self.assertEqual(tokens[1].value, 'single')
+		self.assertEqual(tokens[2].value, 'double')
+		self.assertEqual(tokens[3].value, '')
+
+	def testVariableSigil(self):
+		self.assertEqual(self._texts('$variable'), ['$', 'variable', ''])
+
+	def testOffsetsAndLines(self):
+		tokens = tokenize('a\n  b "x\ny"\nc')
+		self.assertEqual([(t.start, t.end) for t in tokens], [(0, 1), (4, 5), (6, 11), (12, 13), (13, 13)])
+		self.assertEqual([t.line for t in tokens], [1, 2, 2, 4, 4])
+
+	def testInvalidCharacters(self):
+		tokens = tokenize('a ? "unterminated')
+		self.assertEqual(tokens[1].type, TokenType.Invalid)
+		self.assertEqual(tokens[1].text, '?')
+		self.assertEqual(tokens[2].type, TokenType.Invalid)
+		self.assertEqual(tokens[2].text, '"')
+
+	def testNumberTypes(self):
+		tokens = tokenize('12 1.5 2. .5 1e3 2.5E-2 0x1F 0X10')
+		values = [token.value for token in tokens[:-1]]
+		self.assertEqual(values, [12, 1.5, 2.0, 0.5, 1000.0, 0.025, 31, 16])
+		self.assertEqual([type(value) for value in values], [int, float, float, float, float, float, int, int])
+
+	def testNumbersFollowedByIdentifiers(self):
+		self.assertEqual(self._texts('0x1fg 2e 3abc'), ['0', 'x1fg', '2', 'e', '3', 'abc', ''])
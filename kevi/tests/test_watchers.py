@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from .. import rules
+from ..context import Context
+from ..watchers import ModelWatcher
+
+class CountingModelWatcher(ModelWatcher):
+
+	def __init__(self, *args, **kwargs):
+		super(CountingModelWatcher, self).__init__(*args, **kwargs)
+		self.parsedPaths = []
+
+	def _modelForPath(self, path):
+		self.parsedPaths.append(os.path.basename(path))
+		return super(CountingModelWatcher, self)._modelForPath(path)
+
+
+class ModelWatcherTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.defaultModel = rules.DefaultModel
+		self.paths = [os.path.join(self.directory, name) for name in ('a.irl', 'b.irl')]
+		self._write(self.paths[0], 'TRUEPREDICATE { title: "A"; }')
+		self._write(self.paths[1], 'task == "edit" { title: "Edit"; }')
+
+	def tearDown(self):
+		rules.DefaultModel = self.defaultModel
+		shutil.rmtree(self.directory)
+
+	def _write(self, path, data):
+		# Files written within the same clock tick would otherwise have the
+		# same modification time
+		mtime = os.stat(path).st_mtime_ns + 10 ** 9 if os.path.exists(path) else None
+		with open(path, 'w') as f:
+			f.write(data)
+		if mtime is not None:
+			os.utime(path, ns=(mtime, mtime))
+
+	def testFilesAreMergedIntoDefaultModel(self):
+		watcher = CountingModelWatcher(self.paths, cache=False)
+		self.assertTrue(watcher.checkForChanges())
+		self.assertIs(rules.DefaultModel, watcher.model)
+		self.assertEqual(watcher.parsedPaths, ['a.irl', 'b.irl'])
+		self.assertEqual(len(watcher.model.rules), 2)
+
+		self.assertEqual(Context()['title'], 'A')
+		context = Context()
+		context['task'] = 'edit'
+		self.assertEqual(context['title'], 'Edit')
+
+	def testOnlyChangedFilesAreParsed(self):
+		watcher = CountingModelWatcher(self.paths, cache=False)
+		watcher.checkForChanges()
+		model = watcher.model
+		self.assertFalse(watcher.checkForChanges())
+		self.assertIs(watcher.model, model)
+
+		self._write(self.paths[0], 'TRUEPREDICATE { title: "B"; }')
+		self.assertTrue(watcher.checkForChanges())
+		self.assertEqual(watcher.parsedPaths, ['a.irl', 'b.irl', 'a.irl'])
+		self.assertIsNot(watcher.model, model)
+		self.assertEqual(Context()['title'], 'B')
+
+	def testContextsKeepTheirModel(self):
+		watcher = ModelWatcher(self.paths, cache=False)
+		watcher.checkForChanges()
+		context = Context()
+
+		self._write(self.paths[0], 'TRUEPREDICATE { title: "B"; }')
+		watcher.checkForChanges()
+		self.assertEqual(context['title'], 'A')
+		self.assertEqual(Context()['title'], 'B')
+
+	def testFailedFilesKeepTheirRules(self):
+		watcher = ModelWatcher(self.paths, cache=False)
+		watcher.checkForChanges()
+		model = watcher.model
+
+		self._write(self.paths[0], 'TRUEPREDICATE { title: ')
+		self.assertFalse(watcher.checkForChanges())
+		self.assertIs(watcher.model, model)
+		self.assertEqual(list(watcher.errors.keys()), [self.paths[0]])
+
+		self._write(self.paths[0], 'TRUEPREDICATE { title: "C"; }')
+		self.assertTrue(watcher.checkForChanges())
+		self.assertEqual(watcher.errors, {})
+		self.assertEqual(Context()['title'], 'C')
+
+	def testDefaultModelIsOptional(self):
+		rules.DefaultModel = None
+		watcher = ModelWatcher(self.paths, cache=False, updatesDefaultModel=False)
+		watcher.checkForChanges()
+		self.assertIsNone(rules.DefaultModel)
+		self.assertEqual(Context(model=watcher.model)['title'], 'A')
+
+	def testWatchingInTheBackground(self):
+		watcher = ModelWatcher(self.paths, interval=0.01, cache=False)
+		watcher.start()
+		try:
+			self.assertEqual(Context()['title'], 'A')
+			self._write(self.paths[0], 'TRUEPREDICATE { title: "B"; }')
+
+			deadline = time.time() + 5
+			while Context()['title'] != 'B' and time.time() < deadline:
+				time.sleep(0.01)
+			self.assertEqual(Context()['title'], 'B')
+		finally:
+			watcher.stop()
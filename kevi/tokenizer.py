@@ -0,0 +1,82 @@
+# coding=utf-8
+
+import collections
+import re
+import sys
+
+from . import characters
+
+# Quasi-Enums
+
+class TokenType(object):
+
+	End = 0
+	Number = 1
+	String = 2
+	Identifier = 3
+	Operator = 4
+	Invalid = 5
+
+Token = collections.namedtuple('Token', ('type', 'text', 'value', 'start', 'end', 'line'))
+
+# Hexadecimal integers must not run into an identifier (0x1fg is 0 then x1fg)
+HexadecimalNumberPattern = r'0[xX][0-9a-fA-F]+(?![_$A-Za-z0-9])'
+DecimalNumberPattern = r'(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?'
+
+# Unsigned number literals. A sign is a token of its own, and only belongs
+# to a number where a value is expected (see ExpressionScanner).
+NumberPattern = r'%s|%s' % (HexadecimalNumberPattern, DecimalNumberPattern)
+
+_TokenPattern = re.compile(r'''
+	(?P<whitespace>[%s]+) |
+	(?P<number>%s) |
+	(?P<string>"[^"]*"|'[^']*') |
+	(?P<identifier>[_A-Za-z][_$A-Za-z0-9]*) |
+	(?P<operator>:=|<=|=<|>=|=>|==|!=|<>|&&|\|\||\*\*|[-+*/%%(){}\[\],.;:<>=!@\#$]) |
+	(?P<invalid>.)
+''' % (
+	re.escape(''.join(sorted(characters.ScannerCharactersToBeSkippedCharacterSet))),
+	NumberPattern
+), re.VERBOSE | re.DOTALL)
+
+def numberValue(text):
+	# An int unless the literal has a fraction or an exponent
+	if text[:1] in '+-':
+		sign, digits = text[0], text[1:]
+	else:
+		sign, digits = '', text
+	if digits[:2] in ('0x', '0X'):
+		return int(sign + digits[2:], 16)
+	if '.' in digits or 'e' in digits or 'E' in digits:
+		return float(text)
+	return int(text)
+
+def tokenize(string):
+	# Ends with an End token. Characters that cannot start a token become
+	# Invalid tokens.
+	tokens = []
+	append = tokens.append
+	line = 1
+
+	for match in _TokenPattern.finditer(string):
+		kind = match.lastgroup
+		text = match.group()
+
+		if kind == 'whitespace':
+			line += text.count('\n')
+			continue
+
+		if kind == 'identifier':
+			append(Token(TokenType.Identifier, text, text, match.start(), match.end(), line))
+		elif kind == 'operator':
+			append(Token(TokenType.Operator, text, text, match.start(), match.end(), line))
+		elif kind == 'number':
+			append(Token(TokenType.Number, text, numberValue(text), match.start(), match.end(), line))
+		elif kind == 'string':
+			append(Token(TokenType.String, text, sys.intern(text[1:-1]), match.start(), match.end(), line))
+			line += text.count('\n')
+		else:
+			append(Token(TokenType.Invalid, text, text, match.start(), match.end(), line))
+
+	append(Token(TokenType.End, '', None, len(string), len(string), line))
+	return tokens
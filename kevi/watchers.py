@@ -0,0 +1,108 @@
+# coding=utf-8
+
+import itertools
+import os
+import threading
+
+from . import rules
+from .rules import Model, ModelEngineType
+
+# Polls the rule files, and replaces the model with a new one when any
+# of them changes, so inferences using the previous model are unaffected.
+# A file that fails to load keeps its last good rules.
+class ModelWatcher(object):
+
+	def __init__(self, paths, interval=1.0, variables=None, engine=ModelEngineType.Default, ruleCacheSize=1024, cache=False, updatesDefaultModel=True):
+		self._paths = list(paths)
+		self._interval = interval
+		self._variables = variables
+		self._engine = engine
+		self._ruleCacheSize = ruleCacheSize
+		self._cache = cache
+		self._updatesDefaultModel = updatesDefaultModel
+
+		self._model = None
+		self._models = {}        # path -> model parsed from the file
+		self._signatures = {}    # path -> signature of the file when parsed
+		self._errors = {}
+		self._lock = threading.Lock()
+		self._thread = None
+		self._stopping = threading.Event()
+
+	@property
+	def paths(self):
+		return list(self._paths)
+
+	@property
+	def model(self):
+		return self._model
+
+	@property
+	def errors(self):
+		return dict(self._errors)
+
+	# Checking for Changes
+
+	def checkForChanges(self):
+		# Returns whether the model was replaced
+		with self._lock:
+			changed = False
+			for path in self._paths:
+				try:
+					signature = self._signatureForPath(path)
+					if signature == self._signatures.get(path):
+						continue
+					model = self._modelForPath(path)
+				except Exception as e:
+					self._errors[path] = e
+					continue
+
+				self._errors.pop(path, None)
+				self._models[path] = model
+				self._signatures[path] = signature
+				changed = True
+
+			if changed or self._model is None:
+				self._setModel(self._mergedModel())
+			return changed
+
+	def _signatureForPath(self, path):
+		stat = os.stat(path)
+		return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+	def _modelForPath(self, path):
+		return Model.modelFromFile(path, cache=self._cache)
+
+	def _mergedModel(self):
+		models = [self._models[path] for path in self._paths if path in self._models]
+		return Model(rules=list(itertools.chain.from_iterable(model.rules for model in models)),
+			variables=self._variables, engine=self._engine, ruleCacheSize=self._ruleCacheSize)
+
+	def _setModel(self, model):
+		self._model = model
+		if self._updatesDefaultModel:
+			rules.DefaultModel = model
+
+	# Watching in the Background
+
+	def start(self):
+		# Checks for changes every interval seconds until stop is called
+		if self._thread is not None:
+			return
+		self.checkForChanges()
+
+		self._stopping.clear()
+		self._thread = threading.Thread(target=self._watch, name='ModelWatcher')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self):
+		if self._thread is None:
+			return
+		self._stopping.set()
+		self._thread.join()
+		self._thread = None
+
+	def _watch(self):
+		while not self._stopping.wait(self._interval):
+			self.checkForChanges()